@@ -0,0 +1,223 @@
+__author__ = "Fernando Carrillo"
+__email__ = "fernando at carrillo.at"
+
+import os
+import sys
+import json
+import shutil
+import platform
+import argparse
+import tempfile
+from time import time
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from sklearn.pipeline import Pipeline
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+from sklearn.naive_bayes import MultinomialNB
+
+from db_tables import Base, User, Connection, Message, create_sqlite_db
+from synthetic_tweets import SyntheticTweets
+from json_parser import ParseJSON, ParallelJSONReader
+from message_classifier import MessageClassifier
+from compact_model import CompactTextModel
+from bulk_writer import BulkWriter
+from fake_twitter_api import FakeTwitterAPI
+from users import Twitter_user
+from network_search import Network_search
+from network_graph import NetworkGraph
+from twitter_stream_classifier import TwitterStreamClassifier
+
+STAGES = ['parse', 'classify', 'persist', 'crawl', 'graph']
+
+def timed(function, *args, **kwargs):
+	"""
+	Returns (result, seconds).
+	"""
+	t0 = time()
+	result = function(*args, **kwargs)
+	return result, time() - t0
+
+def rate(items, seconds):
+	return items / max(seconds, 1e-9)
+
+class Benchmark(object):
+	"""
+	End-to-end benchmark of the pipeline on synthetic data. Every stage runs on
+	its own temporary database and reports durations and rates as a dict, so
+	results of different releases can be compared.
+	"""
+	def __init__(self, tweets=20000, users=10000, edges=100000, crawl_users=200, workers=8, latency=0.01, seed=32, verbose=1):
+		"""
+		tweets : int
+			Number of stream lines for parsing, classification and persistence.
+
+		users : int
+			Size of the synthetic user population.
+
+		edges : int
+			Number of mention edges of the graph stage.
+
+		crawl_users : int
+			Size of the fake API user population of the crawl stage.
+
+		workers : int
+			Worker threads of the concurrent crawl.
+
+		latency : float
+			Seconds per fake API call.
+		"""
+		self.params = {'tweets': tweets, 'users': users, 'edges': edges, 'crawl_users': crawl_users, 'workers': workers, 'latency': latency, 'seed': seed}
+		self.generator = SyntheticTweets(n_users=users, seed=seed)
+		self.verbose = verbose
+		self.directory = None
+		self.results = {}
+
+	def session(self, name):
+		"""
+		Returns a session of a new database in the benchmark directory.
+		"""
+		db_path = 'sqlite:///' + os.path.join(self.directory, name + '.db')
+		create_sqlite_db(db_path)
+		engine = create_engine(db_path)
+		Base.metadata.bind = engine
+		return sessionmaker(bind=engine)()
+
+	def run(self, stages=STAGES):
+		"""
+		Runs the stages and returns the report dict.
+		"""
+		self.directory = tempfile.mkdtemp(prefix='benchmark_')
+		try:
+			self.stream_path = os.path.join(self.directory, 'stream.json')
+			_, seconds = timed(self.generator.write, self.stream_path, self.params['tweets'])
+			if self.verbose > 0:
+				print('Generated %d tweets in %fs.' % (self.params['tweets'], seconds))
+			for stage in stages:
+				_, seconds = timed(getattr(self, 'bench_' + stage))
+				self.results[stage]['total_seconds'] = seconds
+				if self.verbose > 0:
+					print('%s: %s' % (stage, json.dumps(self.results[stage], sort_keys=True)))
+		finally:
+			shutil.rmtree(self.directory, ignore_errors=True)
+		return self.report()
+
+	def report(self):
+		return {
+			'timestamp': datetime.utcnow().isoformat(),
+			'python': platform.python_version(),
+			'platform': platform.platform(),
+			'params': self.params,
+			'results': self.results,
+		}
+
+	def bench_parse(self):
+		size = os.path.getsize(self.stream_path)
+		parser = ParseJSON(self.stream_path)
+		n, seconds = timed(lambda: sum(1 for _ in parser))
+		reader = ParallelJSONReader(self.stream_path, chunk_size=4 * 1024 ** 2)
+		_, parallel_seconds = timed(lambda: sum(len(batch) for batch in reader.batches()))
+		self.results['parse'] = {'tweets': n, 'megabytes': size / 1024. ** 2,
+			'seconds': seconds, 'tweets_per_second': rate(n, seconds),
+			'parallel_seconds': parallel_seconds, 'parallel_tweets_per_second': rate(reader.tweets, parallel_seconds), 'processes': reader.processes}
+
+	def classifier(self):
+		"""
+		Trains a small naive Bayes pipeline on synthetic labelled texts.
+		"""
+		if not hasattr(self, 'mc'):
+			texts, labels = self.generator.labelled(5000)
+			self.mc = MessageClassifier()
+			self.mc.clf = Pipeline([('vect', CountVectorizer()), ('tfidf', TfidfTransformer()), ('nb', MultinomialNB(alpha=0.01))])
+			self.mc.clf.fit(texts, labels)
+			self.mc.labels = self.generator.labels
+		return self.mc
+
+	def bench_classify(self):
+		mc = self.classifier()
+		texts = [tweet['text'] for tweet in ParseJSON(self.stream_path) if 'delete' not in tweet]
+		_, seconds = timed(mc.clf.predict_proba, texts)
+		compact = CompactTextModel.from_pipeline(mc.clf, mc.labels)
+		_, compact_seconds = timed(compact.predict_proba, texts)
+		self.results['classify'] = {'messages': len(texts),
+			'seconds': seconds, 'messages_per_second': rate(len(texts), seconds),
+			'compact_seconds': compact_seconds, 'compact_messages_per_second': rate(len(texts), compact_seconds)}
+
+	def bench_persist(self):
+		"""
+		Stores every tweet of the stream (all classes, no threshold), so only
+		parsing, mention extraction and the database writes are measured.
+		"""
+		mc = self.classifier()
+		session = self.session('persist')
+		listener = TwitterStreamClassifier(db_session=session, classifier=mc, classes_of_interest=mc.labels,
+			probability_threshold=0, batch_size=self.params['tweets'] + 1, verbose=0)
+		with open(self.stream_path, 'rb') as f:
+			batch = [line for line in f if line.strip()]
+		_, seconds = timed(listener.classify_batch, batch)
+		rows = listener.writer.rows_written
+		self.results['persist'] = {'tweets': len(batch), 'rows': rows,
+			'seconds': seconds, 'tweets_per_second': rate(len(batch), seconds),
+			'write_seconds': listener.writer.time_spent, 'rows_per_second': listener.writer.rows_per_second()}
+
+	def bench_crawl(self):
+		results = {}
+		for name, workers in [('sequential', 1), ('concurrent', self.params['workers'])]:
+			api = FakeTwitterAPI(n_users=self.params['crawl_users'], latency=self.params['latency'], seed=self.params['seed'])
+			session = self.session('crawl_' + name)
+			user = Twitter_user('user0', None, api=api)
+			search = Network_search(user_object=user, db_session=session)
+			_, seconds = timed(search.run, message_count=100, dump=False, fraction_connections=0.2, max_depth=1, workers=workers, verbose=0)
+			users = session.query(User).filter(User.visited == True).count()
+			results[name] = {'workers': workers, 'users': users, 'api_calls': sum(api.calls.values()),
+				'messages': session.query(Message).count(), 'connections': session.query(Connection).count(),
+				'seconds': seconds, 'users_per_second': rate(users, seconds)}
+		results['speedup'] = results['sequential']['seconds'] / max(results['concurrent']['seconds'], 1e-9)
+		self.results['crawl'] = results
+
+	def bench_graph(self):
+		session = self.session('graph')
+		edges = self.generator.edges(self.params['edges'])
+		users = set(u for edge in edges for u in edge)
+		writer = BulkWriter(session)
+		_, write_seconds = timed(writer.write, users=users, connections=edges)
+
+		graph = NetworkGraph(session)
+		_, build_seconds = timed(graph.build)
+		_, rank_seconds = timed(graph.page_rank)
+		_, warm_seconds = timed(graph.page_rank)
+		_, top_seconds = timed(graph.get_top_nodes, 100)
+		snapshot = os.path.join(self.directory, 'graph.snap')
+		_, save_seconds = timed(graph.save_snapshot, snapshot)
+		_, load_seconds = timed(NetworkGraph(session).load_snapshot, snapshot)
+		_, load_networkx_seconds = timed(NetworkGraph(session).load_snapshot, snapshot, networkx=True)
+		self.results['graph'] = {'nodes': graph.graph.number_of_nodes(), 'edges': graph.graph.number_of_edges(),
+			'write_seconds': write_seconds, 'build_seconds': build_seconds, 'edges_per_second': rate(len(edges), build_seconds),
+			'page_rank_seconds': rank_seconds, 'page_rank_warm_seconds': warm_seconds, 'top_nodes_seconds': top_seconds,
+			'snapshot_bytes': os.path.getsize(snapshot), 'snapshot_save_seconds': save_seconds,
+			'snapshot_load_seconds': load_seconds, 'snapshot_load_networkx_seconds': load_networkx_seconds}
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmarks every stage of the pipeline on synthetic tweets and prints the results as JSON.')
+	parser.add_argument('--tweets', type=int, default=20000)
+	parser.add_argument('--users', type=int, default=10000)
+	parser.add_argument('--edges', type=int, default=100000)
+	parser.add_argument('--crawl-users', type=int, default=200)
+	parser.add_argument('--workers', type=int, default=8)
+	parser.add_argument('--latency', type=float, default=0.01, help='seconds per fake API call')
+	parser.add_argument('--seed', type=int, default=32)
+	parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+	parser.add_argument('--output', default=None, help='write the results as JSON to this file (default: stdout)')
+	args = parser.parse_args()
+
+	benchmark = Benchmark(tweets=args.tweets, users=args.users, edges=args.edges, crawl_users=args.crawl_users,
+		workers=args.workers, latency=args.latency, seed=args.seed, verbose=1 if args.output else 0)
+	report = benchmark.run(stages=args.stages)
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(report, f, indent=2, sort_keys=True)
+	else:
+		json.dump(report, sys.stdout, indent=2, sort_keys=True)
+		print('')
@@ -0,0 +1,90 @@
+__author__ = "Fernando Carrillo"
+__email__ = "fernando at carrillo.at"
+
+import math
+import threading
+import numpy as np
+
+def mix64(x):
+	"""
+	splitmix64 finalizer of a uint64 array. Spreads consecutive ids over all bits.
+	"""
+	with np.errstate(over='ignore'):
+		x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+		x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+		return x ^ (x >> np.uint64(31))
+
+class BloomFilter(object):
+	"""
+	Probabilistic set of integer keys (e.g. tweet ids) with bounded memory.
+	Keys are never missed, other keys are reported as seen with probability error_rate.
+
+	Two generations of capacity keys each are kept: once the current one is
+	full it replaces the previous one, so memory stays bounded on an endless
+	stream and the most recent keys are always remembered. Thread-safe.
+	"""
+	def __init__(self, capacity=1000000, error_rate=1e-4):
+		"""
+		capacity : int
+			Keys per generation.
+
+		error_rate : float
+			False positive rate of a full generation.
+		"""
+		self.capacity = capacity
+		self.error_rate = error_rate
+		self.n_bits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+		self.n_hashes = max(1, int(round(self.n_bits / float(capacity) * math.log(2))))
+		self.current = np.zeros((self.n_bits + 7) // 8, dtype=np.uint8)
+		self.previous = None
+		self.count = 0
+		self.lock = threading.Lock()
+
+	def _positions(self, keys):
+		"""
+		Returns the (bytes, masks) of the n_hashes bits of every key, computed by double hashing.
+		"""
+		h1 = mix64(keys)
+		h2 = mix64(keys ^ np.uint64(0x9e3779b97f4a7c15)) | np.uint64(1)
+		i = np.arange(self.n_hashes, dtype=np.uint64)
+		with np.errstate(over='ignore'):
+			bits = (h1[:, np.newaxis] + i * h2[:, np.newaxis]) % np.uint64(self.n_bits)
+		return (bits >> np.uint64(3)).astype(np.int64), (np.uint8(1) << (bits & np.uint64(7)).astype(np.uint8))
+
+	def _contains(self, array, positions):
+		byte, mask = positions
+		return ((array[byte] & mask) != 0).all(axis=1)
+
+	def add(self, keys):
+		"""
+		Adds a batch of keys. Returns a boolean array, True for keys which were
+		(probably) seen before, including repetitions within the batch.
+		"""
+		keys = np.asarray(keys, dtype=np.int64).astype(np.uint64)
+		seen = np.ones(len(keys), dtype=bool)
+		if not len(keys):
+			return seen
+		_, first = np.unique(keys, return_index=True)
+		seen[first] = False
+		positions = self._positions(keys)
+		with self.lock:
+			seen |= self._contains(self.current, positions)
+			if self.previous is not None:
+				seen |= self._contains(self.previous, positions)
+			new = ~seen
+			byte, mask = positions
+			np.bitwise_or.at(self.current, byte[new].ravel(), mask[new].ravel())
+			self.count += int(new.sum())
+			if self.count >= self.capacity:
+				self.previous = self.current
+				self.current = np.zeros_like(self.previous)
+				self.count = 0
+		return seen
+
+	def __contains__(self, key):
+		positions = self._positions(np.array([key], dtype=np.int64).astype(np.uint64))
+		with self.lock:
+			return bool(self._contains(self.current, positions)[0] or (self.previous is not None and self._contains(self.previous, positions)[0]))
+
+	def nbytes(self):
+		return self.current.nbytes * (1 if self.previous is None else 2)
@@ -0,0 +1,241 @@
+__author__ = "Fernando Carrillo"
+__email__ = "fernando at carrillo.at"
+
+from time import time
+
+from sqlalchemy import bindparam
+from sqlalchemy.sql import select, text
+from db_tables import User, Connection, Message, Location, Frontier, NO_BUCKET
+
+# Maximal number of bound parameters per IN clause. SQLite allows 999.
+CHUNK_SIZE = 500
+
+def chunks(items, size=CHUNK_SIZE):
+	"""
+	Splits a list into lists of at most size items.
+	"""
+	items = list(items)
+	for i in range(0, len(items), size):
+		yield items[i:i + size]
+
+class BulkWriter(object):
+	"""
+	Writes users, messages, locations and connections of a whole batch
+	with set-based statements in a single transaction.
+	"""
+	def __init__(self, db_session, verbose=0):
+		"""
+		db_session : Session
+			Database session used for writing.
+
+		verbose : int
+			Print rows/s of every written batch if > 0.
+		"""
+		self.db_session = db_session
+		self.verbose = verbose
+		self.rows_written = 0
+		self.time_spent = 0.0
+
+	def write(self, users=(), messages=(), locations=(), connections=None, depth=0, visited=(), frontier=None, twitter_ids=None):
+		"""
+		Writes a batch in one transaction and returns the number of rows written.
+		Users referenced by messages, locations or connections are created if missing.
+
+		users : iterable of String
+			User names. Duplicates and already stored users are skipped.
+
+		messages : list of (user_name, text) or (user_name, text, tweet_id, created_at)
+			Messages with an already stored tweet id are skipped.
+
+		locations : list of (user_name, geojson, location)
+
+		connections : dict {(user_name1, user_name2): weight} or {(user_name1, user_name2, bucket): weight}
+			Weights are added to already stored connections of the same time bucket
+			(NO_BUCKET if not given).
+
+		depth : int
+			Depth assigned to new users.
+
+		visited : iterable of String
+			User names to flag as visited in the same transaction.
+
+		frontier : int
+			If not None, visited users are marked done in the crawl frontier and the
+			targets of connections become pending at depth frontier, weighted by
+			the connection weights.
+
+		twitter_ids : dict {user_name: twitter user id}
+			Stable ids of the API, stored for users which have none yet.
+		"""
+		t0 = time()
+		connections = connections or {}
+		visited = set(visited)
+		names = set(users) | visited
+		names.update(m[0] for m in messages)
+		names.update(u for u, _, _ in locations)
+		for key in connections:
+			names.add(key[0])
+			names.add(key[1])
+
+		conn = self.db_session.connection()
+		try:
+			ids, rows = self._write_users(conn, names, depth)
+			if messages:
+				rows += self._write_messages(conn, ids, messages)
+			if locations:
+				conn.execute(Location.__table__.insert(), [{'user_id': ids[u], 'geojson': g, 'location': l} for u, g, l in self._clean_locations(locations)])
+				rows += len(locations)
+			if connections:
+				rows += self._write_connections(conn, dict(((ids[key[0]], ids[key[1]], key[2] if len(key) > 2 else NO_BUCKET), w) for key, w in connections.items()))
+			for chunk in chunks([ids[u] for u in visited]):
+				conn.execute(User.__table__.update().where(User.id.in_(chunk)).values(visited=True))
+			if frontier is not None:
+				self._write_frontier(conn, ids, connections, visited, frontier)
+			if twitter_ids:
+				self._write_twitter_ids(conn, ids, twitter_ids)
+			self.db_session.commit()
+		except:
+			self.db_session.rollback()
+			raise
+
+		duration = time() - t0
+		self.rows_written += rows
+		self.time_spent += duration
+		if self.verbose > 0:
+			print('Wrote %d rows in %fs (%.0f rows/s).' % (rows, duration, rows / max(duration, 1e-9)))
+		return rows
+
+	def _select_user_ids(self, conn, names):
+		ids = {}
+		for chunk in chunks(names):
+			ids.update((name, id_) for id_, name in conn.execute(select([User.id, User.name]).where(User.name.in_(chunk))))
+		return ids
+
+	def _write_users(self, conn, names, depth):
+		"""
+		Inserts all users in names which are not yet stored.
+		Returns ({user_name: user_id}, number of inserted users).
+		"""
+		names.discard(None)
+		ids = self._select_user_ids(conn, names)
+		new_users = [{'name': n, 'visited': False, 'depth': depth} for n in names if n not in ids]
+		if new_users:
+			conn.execute(User.__table__.insert(), new_users)
+			ids.update(self._select_user_ids(conn, [u['name'] for u in new_users]))
+		return ids, len(new_users)
+
+	def _write_messages(self, conn, ids, messages):
+		"""
+		Inserts messages, ignoring tweet ids which are already stored.
+		Returns the number of inserted messages.
+		"""
+		rows = [{'user_id': ids[m[0]], 'text': m[1], 'tweet_id': m[2] if len(m) > 2 else None, 'created_at': m[3] if len(m) > 3 else None} for m in messages]
+		return conn.execute(Message.__table__.insert().prefix_with('OR IGNORE'), rows).rowcount
+
+	def _write_connections(self, conn, connections):
+		"""
+		Upserts connections keyed by (user_1_id, user_2_id, bucket): adds weight to stored
+		connections, inserts the others. Updated connections are re-inserted with
+		a new id, so readers can find all changes above their last seen id.
+		"""
+		stored = {}
+		sources = set(u1 for u1, _, _ in connections)
+		for chunk in chunks(sources):
+			query = select([Connection.id, Connection.user_1_id, Connection.user_2_id, Connection.bucket, Connection.weight]).where(Connection.user_1_id.in_(chunk))
+			for id_, u1, u2, bucket, weight in conn.execute(query):
+				if (u1, u2, bucket) in connections:
+					stored[(u1, u2, bucket)] = (id_, weight or 0)
+
+		updates = []
+		inserts = []
+		for key, weight in connections.items():
+			if key in stored:
+				id_, old_weight = stored[key]
+				updates.append({'_id': id_})
+				weight += old_weight
+			inserts.append({'user_1_id': key[0], 'user_2_id': key[1], 'bucket': key[2], 'weight': weight})
+
+		if updates:
+			table = Connection.__table__
+			conn.execute(table.delete().where(table.c.id == bindparam('_id')), updates)
+		if inserts:
+			conn.execute(Connection.__table__.insert(), inserts)
+		return len(inserts)
+
+	def _write_frontier(self, conn, ids, connections, visited, depth):
+		"""
+		Adds the weights of connections to the frontier entries of their targets,
+		inserts entries for newly discovered users and marks visited users done.
+		"""
+		weights = {}
+		for key, weight in connections.items():
+			u2 = key[1]
+			if u2 not in visited:
+				weights[ids[u2]] = weights.get(ids[u2], 0) + (weight or 0)
+		done = set(ids[u] for u in visited)
+
+		stored = {}
+		for chunk in chunks(set(weights) | done):
+			query = select([Frontier.user_id, Frontier.status]).where(Frontier.user_id.in_(chunk))
+			stored.update(conn.execute(query).fetchall())
+
+		table = Frontier.__table__
+		updates = [{'_id': u, '_weight': w} for u, w in weights.items() if u in stored]
+		if updates:
+			conn.execute(table.update().where(table.c.user_id == bindparam('_id')).values(weight=table.c.weight + bindparam('_weight')), updates)
+		inserts = [{'user_id': u, 'depth': depth, 'weight': w, 'status': Frontier.PENDING} for u, w in weights.items() if u not in stored]
+		inserts.extend({'user_id': u, 'depth': depth - 1, 'weight': 0, 'status': Frontier.DONE} for u in done if u not in stored)
+		if inserts:
+			conn.execute(table.insert(), inserts)
+		for chunk in chunks([u for u in done if u in stored]):
+			conn.execute(table.update().where(table.c.user_id.in_(chunk)).values(status=Frontier.DONE))
+
+	def _write_twitter_ids(self, conn, ids, twitter_ids):
+		"""
+		Sets the twitter id of stored users without one. Ids already taken by
+		another user (e.g. after a screen name change) are skipped.
+		"""
+		table = User.__table__
+		rows = [{'_id': ids[name], '_twitter_id': twitter_id} for name, twitter_id in twitter_ids.items() if name in ids]
+		if rows:
+			update = table.update().prefix_with('OR IGNORE').where(table.c.id == bindparam('_id')).where(table.c.twitter_id == None)
+			conn.execute(update.values(twitter_id=bindparam('_twitter_id')), rows)
+
+	def _clean_locations(self, locations):
+		"""
+		Replaces missing values by the NULL string as done by add_location.
+		"""
+		for user_name, geojson, location in locations:
+			if (geojson == "nan" or geojson == "None"): geojson = "NULL"
+			if (location == "nan"): location = "NULL"
+			yield user_name, geojson, location
+
+	def rows_per_second(self):
+		"""
+		Returns the average write throughput of all batches so far.
+		"""
+		return self.rows_written / max(self.time_spent, 1e-9)
+
+	def compact_connections(self, before, span=24, after=0):
+		"""
+		Merges the connections of time buckets from bucket `after` to bucket
+		`before` into buckets of span buckets (e.g. hours into days), so old
+		activity takes fewer rows. Pass the previous `before` as `after` to only
+		scan the buckets added since. Total weights per user pair do not change.
+		Merged connections are re-inserted with new ids. Returns the number of
+		removed rows.
+		"""
+		params = {'before': before // span * span, 'after': max(after, 0) // span * span, 'span': span}
+		conn = self.db_session.connection()
+		try:
+			conn.execute(text('CREATE TEMPORARY TABLE compacted AS SELECT user_1_id, user_2_id, bucket / :span * :span AS bucket, SUM(weight) AS weight '
+				'FROM connection WHERE bucket >= :after AND bucket < :before GROUP BY user_1_id, user_2_id, bucket / :span HAVING COUNT(*) > 1 OR MAX(bucket % :span) > 0'), **params)
+			removed = conn.execute(text('DELETE FROM connection WHERE bucket >= :after AND bucket < :before AND EXISTS (SELECT 1 FROM compacted c '
+				'WHERE c.user_1_id = connection.user_1_id AND c.user_2_id = connection.user_2_id AND c.bucket = connection.bucket / :span * :span)'), **params).rowcount
+			inserted = conn.execute(text('INSERT INTO connection (user_1_id, user_2_id, bucket, weight) SELECT user_1_id, user_2_id, bucket, weight FROM compacted')).rowcount
+			conn.execute(text('DROP TABLE compacted'))
+			self.db_session.commit()
+		except:
+			self.db_session.rollback()
+			raise
+		return removed - inserted
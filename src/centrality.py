@@ -0,0 +1,213 @@
+__author__ = "Fernando Carrillo"
+__email__ = "fernando at carrillo.at"
+
+import numpy as np
+import scipy.sparse as sparse
+from collections import namedtuple
+from multiprocessing import Pool, cpu_count
+
+# Estimates and their errors (1.96 standard errors, see path_centrality).
+PathCentrality = namedtuple('PathCentrality', ['betweenness', 'betweenness_error', 'closeness', 'closeness_error', 'samples'])
+
+# Adjacency structure of a worker process, set once by the pool initializer.
+_structure = None
+
+def structure(matrix):
+	"""
+	Returns the unweighted CSR structure of an adjacency matrix without self loops.
+	"""
+	edges = sparse.coo_matrix(matrix)
+	loop = edges.row == edges.col
+	pattern = sparse.csr_matrix((np.ones((~loop).sum()), (edges.row[~loop], edges.col[~loop])), shape=edges.shape)
+	pattern.data[:] = 1
+	return pattern
+
+def hits(matrix, tol=1.0e-8, max_iter=100):
+	"""
+	Vectorized HITS on a weighted adjacency matrix (rows are sources).
+	Returns hub and authority vectors (each summing to one) and the number of iterations.
+	"""
+	n = matrix.shape[0]
+	if n == 0:
+		return np.zeros(0), np.zeros(0), 0
+	matrix = sparse.csr_matrix(matrix, dtype=np.float64)
+	transposed = sparse.csr_matrix(matrix.T)
+	hubs = np.ones(n) / n
+	authorities = np.zeros(n)
+	for i in range(1, max_iter + 1):
+		last = hubs
+		authorities = transposed.dot(hubs)
+		authorities /= max(authorities.max(), 1e-300)
+		hubs = matrix.dot(authorities)
+		hubs /= max(hubs.max(), 1e-300)
+		if np.abs(hubs - last).sum() < tol:
+			break
+	return hubs / max(hubs.sum(), 1e-300), authorities / max(authorities.sum(), 1e-300), i
+
+def core_number(matrix):
+	"""
+	k-core decomposition in O(nodes + edges) (Batagelj and Zaversnik). Edge
+	direction is ignored, reciprocal edges count twice and self loops are
+	ignored, as in networkx.core_number. Returns the core number of every node.
+	"""
+	pattern = structure(matrix)
+	n = pattern.shape[0]
+	if n == 0:
+		return np.zeros(0, dtype=np.int64)
+	neighbours = sparse.csr_matrix(pattern + pattern.T)
+	indptr, indices = neighbours.indptr.tolist(), neighbours.indices.tolist()
+	multiplicity = neighbours.data.astype(np.int64).tolist()
+	degree = np.asarray(neighbours.sum(axis=1)).astype(np.int64).ravel()
+
+	# Nodes sorted by degree, bins[d] is the first position of degree d.
+	vert = np.argsort(degree, kind='mergesort').tolist()
+	bins = np.concatenate([[0], np.cumsum(np.bincount(degree))]).tolist()
+	pos = [0] * n
+	for i, v in enumerate(vert):
+		pos[v] = i
+	degree = degree.tolist()
+	for i in range(n):
+		v = vert[i]
+		for j in range(indptr[v], indptr[v + 1]):
+			u = indices[j]
+			for _ in range(multiplicity[j]):
+				if degree[u] <= degree[v]:
+					break
+				# Move u to the front of its bin and the bin boundary behind it.
+				du = degree[u]
+				pu, pw = pos[u], bins[du]
+				w = vert[pw]
+				if u != w:
+					vert[pu], vert[pw] = w, u
+					pos[u], pos[w] = pw, pu
+				bins[du] += 1
+				degree[u] -= 1
+	return np.array(degree, dtype=np.int64)
+
+def _single_source(pattern, source):
+	"""
+	Level synchronous breadth first search with Brandes' dependency accumulation.
+	Returns (dependencies, distances) of one source, distance -1 if unreachable.
+	"""
+	n = pattern.shape[0]
+	distance = np.empty(n, dtype=np.int64)
+	distance.fill(-1)
+	sigma = np.zeros(n)
+	distance[source] = 0
+	sigma[source] = 1
+	levels = [np.array([source])]
+	while True:
+		rows = pattern[levels[-1]]
+		paths = np.repeat(sigma[levels[-1]], np.diff(rows.indptr))
+		unvisited = distance[rows.indices] < 0
+		new, inverse = np.unique(rows.indices[unvisited], return_inverse=True)
+		if not len(new):
+			break
+		sigma[new] = np.bincount(inverse, paths[unvisited])
+		distance[new] = len(levels)
+		levels.append(new)
+
+	dependency = np.zeros(n)
+	coefficient = np.zeros(n)
+	for level in range(len(levels) - 1, 0, -1):
+		children, parents = levels[level], levels[level - 1]
+		coefficient[children] = (1 + dependency[children]) / sigma[children]
+		rows = pattern[parents]
+		owner = np.repeat(np.arange(len(parents)), np.diff(rows.indptr))
+		dependency[parents] += sigma[parents] * np.bincount(owner, coefficient[rows.indices], minlength=len(parents))
+		coefficient[children] = 0
+	dependency[source] = 0
+	return dependency, distance
+
+def _init_worker(pattern):
+	global _structure
+	_structure = pattern
+
+def _source_sums(sources):
+	"""
+	Returns the sums over sources of dependencies, squared dependencies,
+	reachability, distances and squared distances of every node.
+	"""
+	n = _structure.shape[0]
+	sums = np.zeros((5, n))
+	for source in sources:
+		dependency, distance = _single_source(_structure, source)
+		reached = distance > 0
+		sums[0] += dependency
+		sums[1] += dependency ** 2
+		sums[2] += reached
+		sums[3] += np.where(reached, distance, 0)
+		sums[4] += np.where(reached, distance, 0) ** 2
+	return sums
+
+def path_centrality(matrix, samples=200, processes=1, seed=32):
+	"""
+	Approximate betweenness and closeness centrality from breadth first
+	searches of a random sample of source nodes (shortest paths in hops, edge
+	weights are ignored). Normalized as networkx.betweenness_centrality and
+	networkx.closeness_centrality of a directed graph, exact if samples >= nodes.
+
+	Errors are 1.96 standard errors from the variation between the sampled
+	sources, with finite population correction. They are an error scale, not
+	95% bounds: the dependencies of a node on the sources are skewed, so the
+	intervals are too narrow unless most sources are sampled. Measured share
+	of nodes whose exact value lies within estimate +- error:
+
+		graph                       samples  betweenness  closeness
+		random, 120 nodes                30         0.79       0.94
+		random, 120 nodes               100         0.91       0.97
+		random, 1000 nodes               30         0.61       0.93-0.97
+		random, 1000 nodes              400         0.85-0.90  0.95
+		scale-free, 1000 nodes           30         0.89       0.83
+		scale-free, 1000 nodes          400         0.94       0.91
+
+	On random graphs betweenness reached 90% only with samples of 40-80% of
+	the nodes. Nodes with no dependency in the sample get error 0.
+
+	samples : int
+		Number of source nodes. The error decreases with 1/sqrt(samples).
+
+	processes : int
+		Sources are split over a pool of processes (default: number of cpus).
+	"""
+	pattern = structure(matrix)
+	n = pattern.shape[0]
+	k = min(samples, n)
+	if k == 0:
+		empty = np.zeros(0)
+		return PathCentrality(empty, empty, empty, empty, 0)
+	sources = np.sort(np.random.RandomState(seed).choice(n, k, replace=False))
+
+	processes = processes or cpu_count()
+	if processes > 1 and k > 1:
+		shards = [shard for shard in np.array_split(sources, min(k, 4 * processes)) if len(shard)]
+		pool = Pool(processes, initializer=_init_worker, initargs=(pattern,))
+		try:
+			sums = np.sum(pool.map(_source_sums, shards), axis=0)
+		finally:
+			pool.close()
+			pool.join()
+	else:
+		_init_worker(pattern)
+		sums = _source_sums(sources)
+	correction = np.sqrt((n - k) / max(n - 1., 1.))
+
+	# Betweenness: mean dependency over sources times n.
+	mean = sums[0] / k
+	variance = np.maximum(sums[1] / k - mean ** 2, 0) * k / max(k - 1, 1)
+	scale = 1. / ((n - 1) * (n - 2)) if n > 2 else 1.
+	betweenness = n * mean * scale
+	betweenness_error = 1.96 * n * np.sqrt(variance / k) * correction * scale
+
+	# Closeness: ratio estimator reached^2 / distance over the sampled sources
+	# other than the node itself, error by the delta method.
+	others = k - np.in1d(np.arange(n), sources)
+	m = np.maximum(others, 1).astype(np.float64)
+	x, y, y2 = sums[2] / m, sums[3] / m, sums[4] / m
+	safe_y = np.where(y > 0, y, 1)
+	closeness = np.where(y > 0, x ** 2 / safe_y, 0)
+	variance_x, variance_y, covariance = x * (1 - x), np.maximum(y2 - y ** 2, 0), y * (1 - x)
+	gx, gy = 2 * x / safe_y, -x ** 2 / safe_y ** 2
+	variance = np.maximum(gx ** 2 * variance_x + 2 * gx * gy * covariance + gy ** 2 * variance_y, 0) / np.maximum(m - 1, 1)
+	closeness_error = np.where(y > 0, 1.96 * np.sqrt(variance) * np.sqrt(np.maximum(n - 1 - others, 0) / np.maximum(n - 2., 1.)), 0)
+	return PathCentrality(betweenness, betweenness_error, closeness, closeness_error, k)
@@ -0,0 +1,256 @@
+__author__ = "Fernando Carrillo"
+__email__ = "fernando at carrillo.at"
+
+import os
+import json
+import shutil
+import hashlib
+from itertools import islice
+import numpy as np
+
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.linear_model import SGDClassifier, LogisticRegression
+
+# CountVectorizer parameters which are needed to rebuild the analyzer.
+ANALYZER_PARAMS = ['analyzer', 'input', 'encoding', 'decode_error', 'strip_accents', 'lowercase', 'token_pattern', 'stop_words', 'ngram_range']
+
+def hash_terms(terms):
+	"""
+	Returns stable 64 bit hashes of unicode terms as uint64 array.
+	"""
+	digests = b''.join(hashlib.md5(t.encode('utf-8')).digest()[:8] for t in terms)
+	return np.frombuffer(digests, dtype='<u8')
+
+class CompactTextModel(object):
+	"""
+	Inference-only version of a CountVectorizer -> TfidfTransformer -> estimator pipeline.
+
+	The vocabulary is a sorted array of 64 bit term hashes, the idf is folded into
+	the weight matrix and a whole batch is scored with a single sparse-dense product.
+	Supports MultinomialNB, LogisticRegression and SGDClassifier (log or modified_huber loss).
+
+	Every process keeps a private cache of cache_size token -> column entries
+	(about 160 bytes each, so about 8 MB for the default 50000 and 160 MB for
+	a million) on top of the shared model arrays. 0 disables the cache.
+	"""
+	def __init__(self, analyzer_params, hashes, weights, bias, idf, labels, kind, binary=False, sublinear_tf=False, norm=None, cache_size=50000):
+		self.analyzer_params = analyzer_params
+		self.analyzer = CountVectorizer(**analyzer_params).build_analyzer()
+		self.hashes = hashes
+		self.weights = weights
+		self.bias = bias
+		self.idf = idf
+		self.labels = list(labels)
+		self.kind = kind
+		self.binary = binary
+		self.sublinear_tf = sublinear_tf
+		self.norm = norm
+		self.cache_size = cache_size
+		self.column_cache = {}
+
+	@classmethod
+	def from_pipeline(cls, pipeline, labels):
+		"""
+		Exports a trained sklearn Pipeline.
+		"""
+		steps = [step for _, step in pipeline.steps]
+		vect, estimator = steps[0], steps[-1]
+		tfidf = steps[1] if len(steps) == 3 else None
+		if not isinstance(vect, CountVectorizer) or len(steps) not in (2, 3) or (tfidf is not None and not isinstance(tfidf, TfidfTransformer)):
+			raise ValueError('Only CountVectorizer [-> TfidfTransformer] -> estimator pipelines can be exported.')
+
+		params = vect.get_params()
+		analyzer_params = dict((k, params[k]) for k in ANALYZER_PARAMS)
+		if callable(params['analyzer']) or params['tokenizer'] is not None or params['preprocessor'] is not None:
+			raise ValueError('Custom analyzers, tokenizers and preprocessors cannot be exported.')
+		if analyzer_params['stop_words'] is not None and not isinstance(analyzer_params['stop_words'], basestring):
+			analyzer_params['stop_words'] = sorted(analyzer_params['stop_words'])
+
+		if isinstance(estimator, MultinomialNB):
+			kind = 'nb'
+			weights, bias = estimator.feature_log_prob_.T, estimator.class_log_prior_
+		elif isinstance(estimator, LogisticRegression):
+			kind = 'softmax' if estimator.multi_class == 'multinomial' else 'logistic'
+			weights, bias = estimator.coef_.T, estimator.intercept_
+		elif isinstance(estimator, SGDClassifier) and estimator.loss in ('log', 'modified_huber'):
+			kind = 'logistic' if estimator.loss == 'log' else 'modified_huber'
+			weights, bias = estimator.coef_.T, estimator.intercept_
+		else:
+			raise ValueError('Estimator %s cannot be exported.' % type(estimator).__name__)
+
+		n_features = len(vect.vocabulary_)
+		idf = np.ones(n_features)
+		norm, sublinear_tf = None, False
+		if tfidf is not None:
+			norm, sublinear_tf = tfidf.norm, tfidf.sublinear_tf
+			if tfidf.use_idf:
+				idf = tfidf.idf_
+
+		# Order columns by term hash. Column j of the vectorizer becomes row order[j].
+		terms = [None] * n_features
+		for term, j in vect.vocabulary_.items():
+			terms[j] = term
+		hashes = hash_terms(terms)
+		order = np.argsort(hashes)
+		hashes = hashes[order]
+		if np.any(hashes[1:] == hashes[:-1]):
+			raise ValueError('Hash collision in the vocabulary.')
+		weights = np.ascontiguousarray(np.asarray(weights)[order] * idf[order][:, np.newaxis])
+
+		return cls(analyzer_params, hashes, weights, np.asarray(bias, dtype=np.float64), idf[order], labels, kind,
+			binary=vect.binary, sublinear_tf=sublinear_tf, norm=norm)
+
+	def transform(self, texts):
+		"""
+		Returns the non-zero entries (row, column, term frequency) of the document term
+		matrix of texts in the column order of the model.
+		"""
+		indptr = [0]
+		tokens = []
+		for text in texts:
+			tokens.extend(self.analyzer(text))
+			indptr.append(len(tokens))
+		rows = np.repeat(np.arange(len(texts)), np.diff(indptr))
+		cols = self.lookup(tokens)
+		found = cols >= 0
+		# Count repeated terms of a document.
+		n_features = len(self.hashes)
+		keys, tf = np.unique(rows[found] * n_features + cols[found], return_counts=True)
+		tf = tf.astype(np.float64)
+		if self.binary:
+			tf[:] = 1
+		if self.sublinear_tf:
+			tf = 1 + np.log(tf)
+		return keys // n_features, keys % n_features, tf
+
+	def lookup(self, tokens):
+		"""
+		Returns the column of every token, -1 for unknown tokens. Columns of tokens seen
+		before come from a cache of at most cache_size entries, only new tokens are
+		hashed and searched.
+		"""
+		cache = self.column_cache
+		missing = list(set(t for t in tokens if t not in cache))
+		found = {}
+		if missing:
+			hashes = hash_terms(missing)
+			cols = np.minimum(np.searchsorted(self.hashes, hashes), len(self.hashes) - 1)
+			cols[self.hashes[cols] != hashes] = -1
+			found = dict(zip(missing, cols.tolist()))
+		columns = np.fromiter((cache[t] if t in cache else found[t] for t in tokens), dtype=np.int64, count=len(tokens))
+		if found and self.cache_size > 0:
+			if len(cache) + len(found) > self.cache_size:
+				cache.clear()
+			cache.update(islice(found.iteritems(), self.cache_size))
+		return columns
+
+	def decision_function(self, texts):
+		"""
+		Product of the sparse document term matrix and the weight matrix, computed
+		directly on the non-zero entries to avoid the sparse matrix set-up cost.
+		"""
+		n = len(texts)
+		rows, cols, tf = self.transform(texts)
+		contributions = self.weights[cols] * tf[:, np.newaxis]
+		scores = np.empty((n, self.weights.shape[1]))
+		for c in range(scores.shape[1]):
+			scores[:, c] = np.bincount(rows, weights=contributions[:, c], minlength=n)
+		if self.norm == 'l2':
+			norms = np.sqrt(np.bincount(rows, weights=(tf * self.idf[cols]) ** 2, minlength=n))
+		elif self.norm == 'l1':
+			norms = np.bincount(rows, weights=tf * self.idf[cols], minlength=n)
+		else:
+			norms = np.ones(n)
+		norms[norms == 0] = 1
+		scores /= norms[:, np.newaxis]
+		scores += self.bias
+		return scores
+
+	def predict_proba(self, texts):
+		scores = self.decision_function(texts)
+		if self.kind in ('nb', 'softmax'):
+			scores -= scores.max(axis=1)[:, np.newaxis]
+			prob = np.exp(scores)
+		elif self.kind == 'logistic':
+			prob = 1. / (1. + np.exp(-scores))
+		else:
+			prob = (np.clip(scores, -1, 1) + 1.) / 2.
+		if prob.shape[1] == 1:
+			return np.hstack([1 - prob, prob])
+		prob_sum = prob.sum(axis=1)
+		all_zero = prob_sum == 0
+		prob[all_zero, :] = 1
+		prob_sum[all_zero] = prob.shape[1]
+		return prob / prob_sum[:, np.newaxis]
+
+	def predict(self, texts):
+		"""
+		Returns the index of the most probable class.
+		"""
+		return np.argmax(self.predict_proba(texts), axis=1)
+
+	def save(self, filename, mmap=True):
+		"""
+		Saves the model.
+
+		mmap : boolean
+			Write the memory-mappable format: a directory filename + '_compact' with one
+			uncompressed .npy file per array and meta.json. Otherwise a compressed
+			archive filename + '_compact.npz' is written. A saved model of the other
+			format is removed, so load does not pick up an outdated model.
+		"""
+		meta = {'analyzer_params': self.analyzer_params, 'labels': self.labels, 'kind': self.kind,
+			'binary': self.binary, 'sublinear_tf': self.sublinear_tf, 'norm': self.norm}
+		arrays = {'hashes': self.hashes, 'weights': self.weights, 'bias': self.bias, 'idf': self.idf}
+		directory = filename + '_compact'
+		archive = filename + '_compact.npz'
+		if not mmap:
+			tmp = archive + '.tmp%d' % os.getpid()
+			with open(tmp, 'wb') as f:
+				np.savez_compressed(f, meta=np.array(json.dumps(meta)), **arrays)
+			os.rename(tmp, archive)
+			if os.path.isdir(directory):
+				shutil.rmtree(directory)
+			return
+
+		# Write into a new directory and swap it in, so running processes keep
+		# their mapping of the old files. The old directory is only removed once
+		# the new one is in place, a failed save leaves it untouched.
+		tmp = directory + '.tmp%d' % os.getpid()
+		old = directory + '.old%d' % os.getpid()
+		os.makedirs(tmp)
+		for name, array in arrays.items():
+			np.save(os.path.join(tmp, name + '.npy'), np.ascontiguousarray(array))
+		with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+			json.dump(meta, f)
+		if os.path.isdir(directory):
+			os.rename(directory, old)
+		os.rename(tmp, directory)
+		if os.path.isdir(old):
+			shutil.rmtree(old)
+		if os.path.isfile(archive):
+			os.remove(archive)
+
+	@classmethod
+	def load(cls, filename, mmap_mode='r'):
+		"""
+		Loads a model saved with save. Arrays of the memory-mappable format are mapped
+		lazily with mmap_mode, so processes loading the same model share its pages.
+		"""
+		directory = filename + '_compact'
+		if os.path.isdir(directory):
+			with open(os.path.join(directory, 'meta.json')) as f:
+				meta = json.load(f)
+			data = dict((name, np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode)) for name in ['hashes', 'weights', 'bias', 'idf'])
+		else:
+			data = np.load(filename + '_compact.npz')
+			meta = json.loads(str(data['meta']))
+		params = meta['analyzer_params']
+		params['ngram_range'] = tuple(params['ngram_range'])
+		return cls(params, data['hashes'], data['weights'], data['bias'], data['idf'], meta['labels'], meta['kind'],
+			binary=meta['binary'], sublinear_tf=meta['sublinear_tf'], norm=meta['norm'])
+
+	@classmethod
+	def exists(cls, filename):
+		return os.path.isdir(filename + '_compact') or os.path.isfile(filename + '_compact.npz')
@@ -0,0 +1,101 @@
+__author__ = "Fernando Carrillo"
+__email__ = "fernando at carrillo.at"
+
+import numpy as np
+import scipy.sparse as sparse
+from scipy.sparse.csgraph import connected_components
+
+def component_labels(matrix, connection='weak'):
+	"""
+	Returns an array with the component label of every node of a CSR
+	adjacency matrix in linear time (union of edges for weak, Pearce's iterative
+	variant of Tarjan's algorithm for strong components).
+
+	connection : String
+		'weak' or 'strong'.
+	"""
+	# Structure only, so edges of weight 0 count as well.
+	pattern = sparse.csr_matrix((np.ones(len(matrix.indices)), matrix.indices, matrix.indptr), shape=matrix.shape)
+	_, labels = connected_components(pattern, directed=True, connection=connection)
+	return labels
+
+def small_components(labels, min_nodes):
+	"""
+	Returns a boolean array, True for nodes of components with less than min_nodes nodes.
+	"""
+	if not len(labels):
+		return np.zeros(0, dtype=bool)
+	return np.bincount(labels)[labels] < min_nodes
+
+class UnionFind(object):
+	"""
+	Weakly connected components maintained incrementally while edges arrive.
+	Union by size with path halving, so every edge costs almost constant time.
+	"""
+	def __init__(self, edges=(), nodes=()):
+		self.parent = {}
+		self.size = {}
+		for node in nodes:
+			self.add(node)
+		self.add_edges(edges)
+
+	def __contains__(self, node):
+		return node in self.parent
+
+	def __len__(self):
+		return len(self.parent)
+
+	def add(self, node):
+		if node not in self.parent:
+			self.parent[node] = node
+			self.size[node] = 1
+
+	def find(self, node):
+		"""
+		Returns the representative of the component of node.
+		"""
+		parent = self.parent
+		while parent[node] != node:
+			parent[node] = parent[parent[node]]
+			node = parent[node]
+		return node
+
+	def union(self, node1, node2):
+		"""
+		Joins the components of two (possibly new) nodes and returns the representative.
+		"""
+		self.add(node1)
+		self.add(node2)
+		root1, root2 = self.find(node1), self.find(node2)
+		if root1 == root2:
+			return root1
+		if self.size[root1] < self.size[root2]:
+			root1, root2 = root2, root1
+		self.parent[root2] = root1
+		self.size[root1] += self.size.pop(root2)
+		return root1
+
+	def add_edges(self, edges):
+		for node1, node2 in edges:
+			self.union(node1, node2)
+
+	def component_size(self, node):
+		return self.size[self.find(node)]
+
+	def components(self):
+		"""
+		Returns {representative: size} of all components.
+		"""
+		return dict(self.size)
+
+	def remove(self, nodes):
+		"""
+		Removes nodes. Only whole components may be removed, otherwise the
+		remaining nodes of a component could point to a removed node.
+		"""
+		nodes = list(nodes)
+		roots = set(self.find(node) for node in nodes)
+		for node in nodes:
+			del self.parent[node]
+		for root in roots:
+			del self.size[root]
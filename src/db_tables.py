@@ -3,73 +3,164 @@ __email__ = "fernando at carrillo.at"
 
 import os 
 import sys
-from sqlalchemy import Column, ForeignKey, Boolean, String, Integer, Text
+import calendar
+from datetime import datetime
+from sqlalchemy import Column, ForeignKey, Boolean, String, Integer, Float, Text, DateTime, Index, inspect
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import create_engine
 from sqlalchemy.orm import relationship
 		
 Base = declarative_base()
 
+# Version of the schema below. Stored in the sqlite user_version pragma. 
+# Databases of older versions are converted by migrate_db.py. 
+SCHEMA_VERSION = 8
+
+# Length of the time buckets of connections in seconds. 
+BUCKET_SECONDS = 3600
+# Bucket of connections which are not counted per time (e.g. of the crawler). 
+# Not NULL, so the unique index of connections also covers them. 
+NO_BUCKET = -1
+
+def time_bucket(value): 
+	"""
+	Returns the time bucket of a unix timestamp or UTC datetime: the number of 
+	BUCKET_SECONDS intervals since the epoch. 
+	"""
+	if isinstance(value, datetime): 
+		value = calendar.timegm(value.utctimetuple())
+	return int(value // BUCKET_SECONDS)
+
 class User(Base):
 	"""
 	Set-up user table: 
-	Columns: username and isVisited
+	Columns: id, username, isVisited, depth and twitter_id (stable id of the twitter API, if known) 
 	"""
 	__tablename__ = 'user'
-	name = Column(String(50), primary_key=True)
+	id = Column(Integer, primary_key=True)
+	name = Column(String(50), nullable=False, unique=True)
 	visited = Column(Boolean, nullable=False)
 	depth = Column(Integer, nullable=False)
+	twitter_id = Column(Integer)
+
+	__table_args__ = (Index('ix_user_visited_depth', 'visited', 'depth'), Index('ix_user_twitter_id', 'twitter_id', unique=True))
 
 class Connection(Base): 
 	"""
 	Set-up connection table: 
-	id, source node (user1), target node (user2), weight 
+	id, source node (user1), target node (user2), weight, bucket 
+	Connections of the stream are counted per time bucket (see time_bucket), 
+	connections of the crawler have bucket NO_BUCKET. 
 	"""
 	__tablename__ = 'connection'
 	id = Column(Integer, primary_key=True)
-	user_1_name = Column(String(50), ForeignKey('user.name'))
-	user_2_name = Column(String(50), ForeignKey('user.name'))
+	user_1_id = Column(Integer, ForeignKey('user.id'), nullable=False)
+	user_2_id = Column(Integer, ForeignKey('user.id'), nullable=False)
 	weight = Column(Integer)
+	bucket = Column(Integer, nullable=False, default=NO_BUCKET, server_default=str(NO_BUCKET))
 	
-	user_1 = relationship("User", foreign_keys=[user_1_name])
-	user_2 = relationship("User", foreign_keys=[user_2_name])
+	user_1 = relationship("User", foreign_keys=[user_1_id])
+	user_2 = relationship("User", foreign_keys=[user_2_id])
+
+	# Ids are never reused, so the largest id seen marks which connections are new or updated. 
+	__table_args__ = (Index('ix_connection_users', 'user_1_id', 'user_2_id', 'bucket', unique=True), Index('ix_connection_bucket', 'bucket'), {'sqlite_autoincrement': True})
 
 class Location(Base):
 	"""
 	Set-up location table: 
-	id, user_name, geojson, location  
+	id, user_id, geojson, location  
 	"""
 	__tablename__ = 'location'
 	id = Column(Integer, primary_key=True)
-	user_name = Column(String(50), ForeignKey('user.name'))
+	user_id = Column(Integer, ForeignKey('user.id'))
 	geojson = Column(Text)
 	location = Column(Text)
 
-	user = relationship("User", foreign_keys=[user_name])
+	user = relationship("User", foreign_keys=[user_id])
 
 class Message(Base): 
 	"""
-	Set-up location table: 
-	id, user_name, text
+	Set-up message table: 
+	id, user_id, text, tweet_id (unique, messages of older versions have none), created_at
 	"""
 	__tablename__ = 'message'
 	id = Column(Integer, primary_key=True)
-	user_name = Column(String(50), ForeignKey('user.name'))
+	user_id = Column(Integer, ForeignKey('user.id'), index=True)
 	text = Column(Text)
+	tweet_id = Column(Integer)
+	created_at = Column(DateTime)
 
-	user = relationship("User", foreign_keys=[user_name])
+	user = relationship("User", foreign_keys=[user_id])
 
-# Create an engine that stores data in the local path 
-engine = create_engine('sqlite:///data/twitter_search.db')
+	__table_args__ = (Index('ix_message_tweet_id', 'tweet_id', unique=True), )
 
-# Create all tables in the engine 
-Base.metadata.create_all(engine)
+class Frontier(Base): 
+	"""
+	Set-up crawl frontier table: 
+	user_id, depth, weight (sum of the weights of the connections through 
+	which the user was discovered), status (pending or done) 
+	"""
+	__tablename__ = 'frontier'
+	PENDING = 'pending'
+	DONE = 'done'
+
+	user_id = Column(Integer, ForeignKey('user.id'), primary_key=True)
+	depth = Column(Integer, nullable=False)
+	weight = Column(Float, nullable=False, default=0)
+	status = Column(String(10), nullable=False, default=PENDING)
+
+	user = relationship("User", foreign_keys=[user_id])
+
+	__table_args__ = (Index('ix_frontier_status_depth_weight', 'status', 'depth', 'weight'), Index('ix_frontier_status_weight', 'status', 'weight'))
+
+class Prediction(Base): 
+	"""
+	Set-up prediction table: 
+	id, message_id, model_version, label, probability (of the label), entropy (of all class probabilities) 
+	"""
+	__tablename__ = 'prediction'
+	id = Column(Integer, primary_key=True)
+	message_id = Column(Integer, ForeignKey('message.id'), nullable=False)
+	model_version = Column(String(64), nullable=False)
+	label = Column(String(100))
+	probability = Column(Float)
+	entropy = Column(Float)
+
+	message = relationship("Message", foreign_keys=[message_id])
+
+	__table_args__ = (Index('ix_prediction_message_model', 'message_id', 'model_version', unique=True), Index('ix_prediction_model_entropy', 'model_version', 'entropy'))
+
+def get_schema_version(engine): 
+	"""
+	Returns the schema version of a database. 
+	0 for an empty database, 1 for databases keyed by screen names. 
+	"""
+	inspector = inspect(engine)
+	if 'user' not in inspector.get_table_names(): 
+		return 0
+	if 'id' not in [c['name'] for c in inspector.get_columns('user')]: 
+		return 1
+	return max(2, engine.execute('PRAGMA user_version').scalar())
+
+def set_schema_version(engine, version=SCHEMA_VERSION): 
+	engine.execute('PRAGMA user_version = %d' % version)
 
 def create_sqlite_db(path):
 	# Create an engine that stores data in the local path 
 	engine = create_engine(path)
 
+	version = get_schema_version(engine)
+	if 0 < version < SCHEMA_VERSION: 
+		raise RuntimeError('Database %s has schema version %d, run migrate_db.py to convert it to version %d.' % (path, version, SCHEMA_VERSION))
+
 	# Create all tables in the engine 
 	Base.metadata.create_all(engine)
+	set_schema_version(engine)
 
+# Create an engine that stores data in the local path 
+engine = create_engine('sqlite:///data/twitter_search.db')
 
+# Create all tables in the engine 
+if get_schema_version(engine) == 0: 
+	Base.metadata.create_all(engine)
+	set_schema_version(engine)
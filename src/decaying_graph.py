@@ -0,0 +1,97 @@
+__author__ = "Fernando Carrillo"
+__email__ = "fernando at carrillo.at"
+
+import math
+import threading
+import networkx as nx
+
+class DecayingGraph(object):
+	"""
+	In-memory interaction graph of the stream whose edge weights decay
+	exponentially with the event time, so recent activity dominates. Weights are
+	decayed lazily when an edge is touched. Edges whose decayed weight drops
+	below threshold are evicted regularly, so memory is bounded by the recent
+	activity instead of the whole stream. Thread-safe.
+	"""
+	def __init__(self, half_life=6 * 3600, threshold=0.1, evict_every=None):
+		"""
+		half_life : float
+			Seconds after which a weight is halved.
+
+		threshold : float
+			Edges with a lower decayed weight are evicted.
+
+		evict_every : float
+			Seconds of event time between evictions (default: half_life / 4).
+		"""
+		self.half_life = half_life
+		self.rate = math.log(2) / half_life
+		self.threshold = threshold
+		self.evict_every = evict_every or half_life / 4.
+		# {(user_name1, user_name2): (weight, time of the weight)}
+		self.edges = {}
+		self.now = None
+		self.last_eviction = None
+		self.evicted = 0
+		self.lock = threading.Lock()
+
+	def _decayed(self, weight, timestamp, now):
+		return weight * math.exp(-self.rate * max(now - timestamp, 0))
+
+	def add(self, connections, timestamp):
+		"""
+		Adds {(user_name1, user_name2): weight} which occurred at timestamp (unix
+		seconds). Events may arrive late, e.g. from parallel workers.
+		"""
+		with self.lock:
+			if self.now is None or timestamp > self.now:
+				self.now = timestamp
+			if self.last_eviction is None:
+				self.last_eviction = self.now
+			edges = self.edges
+			for key, weight in connections.items():
+				old = edges.get(key)
+				if old is None:
+					edges[key] = (weight, timestamp)
+				elif timestamp >= old[1]:
+					edges[key] = (weight + self._decayed(old[0], old[1], timestamp), timestamp)
+				else:
+					edges[key] = (old[0] + self._decayed(weight, timestamp, old[1]), old[1])
+			if self.now - self.last_eviction >= self.evict_every:
+				self._evict()
+
+	def _evict(self):
+		now = self.now
+		expired = [key for key, (weight, timestamp) in self.edges.items() if self._decayed(weight, timestamp, now) < self.threshold]
+		for key in expired:
+			del self.edges[key]
+		self.evicted += len(expired)
+		self.last_eviction = now
+		return len(expired)
+
+	def evict(self):
+		"""
+		Evicts all edges below the threshold. Returns the number of evicted edges.
+		"""
+		with self.lock:
+			return self._evict() if self.now is not None else 0
+
+	def weights(self, now=None):
+		"""
+		Returns {(user_name1, user_name2): decayed weight} of all edges at time now
+		(default: latest event time).
+		"""
+		with self.lock:
+			now = self.now if now is None else now
+			return dict((key, self._decayed(weight, timestamp, now)) for key, (weight, timestamp) in self.edges.items())
+
+	def to_networkx(self, now=None):
+		"""
+		Returns the graph with decayed weights as networkx DiGraph.
+		"""
+		graph = nx.DiGraph()
+		graph.add_weighted_edges_from((u1, u2, weight) for (u1, u2), weight in self.weights(now).items())
+		return graph
+
+	def __len__(self):
+		return len(self.edges)
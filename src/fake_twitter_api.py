@@ -0,0 +1,127 @@
+__author__ = "Fernando Carrillo"
+__email__ = "fernando at carrillo.at"
+
+import random
+import threading
+from time import sleep
+
+from tweepy import TweepError
+
+class FakeStatus(object):
+	"""
+	Mimics a tweepy Status. Only the raw _json is provided.
+	"""
+	def __init__(self, json):
+		self._json = json
+
+class FakeUser(FakeStatus):
+	"""
+	Mimics a tweepy User.
+	"""
+	def __init__(self, json):
+		super(FakeUser, self).__init__(json)
+		self.id = json['id']
+		self.screen_name = json['screen_name']
+
+class FakeResponse(object):
+	def __init__(self, status_code):
+		self.status_code = status_code
+
+class FakeTwitterAPI(object):
+	"""
+	Offline stand-in for tweepy.API. Users, their tweets and followers are
+	generated deterministically from the screen name.
+	"""
+	def __init__(self, n_users=1000, mentions_per_tweet=2, followers_per_user=50, latency=0.0, error_rate=0.0, seed=32):
+		"""
+		n_users : int
+			Size of the user population. Screen names are user0 ... user<n_users-1>.
+
+		latency : float or function
+			Seconds every call takes, or a function returning them.
+
+		error_rate : float
+			Probability of a call failing with a 500 TweepError.
+		"""
+		self.n_users = n_users
+		self.mentions_per_tweet = mentions_per_tweet
+		self.followers_per_user = followers_per_user
+		self.latency = latency
+		self.error_rate = error_rate
+		self.seed = seed
+		self.calls = {}
+		self.lock = threading.Lock()
+		self.rand = random.Random(seed)
+
+	def _call(self, endpoint):
+		with self.lock:
+			self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+			fail = self.rand.random() < self.error_rate
+		latency = self.latency() if callable(self.latency) else self.latency
+		if latency > 0:
+			sleep(latency)
+		if fail:
+			raise TweepError('Internal error', response=FakeResponse(500))
+
+	def _rand(self, screen_name):
+		return random.Random('%s-%s' % (self.seed, screen_name))
+
+	def user_id(self, screen_name):
+		return int(screen_name[len('user'):]) + 1
+
+	def screen_name(self, user_id):
+		return 'user%d' % (user_id - 1)
+
+	def user_json(self, screen_name):
+		user_id = self.user_id(screen_name)
+		return {'id': user_id, 'id_str': str(user_id), 'screen_name': screen_name, 'location': 'City %d' % (user_id % 50)}
+
+	def user_timeline(self, screen_name=None, count=20, since_id=None, max_id=None, **kwargs):
+		"""
+		Returns count FakeStatus objects of screen_name, newest first.
+		"""
+		self._call('user_timeline')
+		rand = self._rand(screen_name)
+		user = self.user_json(screen_name)
+		statuses = []
+		for i in range(count):
+			tweet_id = self.user_id(screen_name) * 100000 + count - i
+			if since_id is not None and tweet_id <= since_id:
+				break
+			mentioned = ['user%d' % rand.randrange(self.n_users) for _ in range(rand.randint(0, self.mentions_per_tweet))]
+			text = ' '.join(['@' + m for m in mentioned] + ['fake tweet %d' % tweet_id])
+			mentions = [{'screen_name': m, 'id': self.user_id(m)} for m in mentioned]
+			coordinates = None
+			if rand.random() < 0.1:
+				coordinates = {'type': 'Point', 'coordinates': [rand.uniform(-180, 180), rand.uniform(-90, 90)]}
+			statuses.append(FakeStatus({'id': tweet_id, 'id_str': str(tweet_id), 'text': text, 'user': user, 'coordinates': coordinates, 'entities': {'user_mentions': mentions}}))
+		return statuses
+
+	def followers_ids(self, screen_name=None, cursor=-1, **kwargs):
+		"""
+		Returns (ids, (previous_cursor, next_cursor)) in pages of 5000 ids like tweepy.
+		"""
+		self._call('followers_ids')
+		rand = self._rand('followers-' + screen_name)
+		ids = [rand.randrange(self.n_users) + 1 for _ in range(self.followers_per_user)]
+		start = 0 if cursor == -1 else cursor
+		page = ids[start:start + 5000]
+		next_cursor = start + 5000 if start + 5000 < len(ids) else 0
+		return page, (start, next_cursor)
+	followers_ids.pagination_mode = 'cursor'
+
+	def get_user(self, user_id=None, screen_name=None, **kwargs):
+		self._call('get_user')
+		if screen_name is None:
+			screen_name = self.screen_name(user_id)
+		return FakeUser(self.user_json(screen_name))
+
+	def lookup_users(self, user_ids=None, screen_names=None, **kwargs):
+		"""
+		Returns FakeUser objects of up to 100 ids or screen names per call like tweepy.
+		"""
+		self._call('lookup_users')
+		if len(user_ids or []) + len(screen_names or []) > 100:
+			raise TweepError('Too many terms specified in query', response=FakeResponse(403))
+		names = [self.screen_name(user_id) for user_id in user_ids or []] + list(screen_names or [])
+		return [FakeUser(self.user_json(name)) for name in names]
@@ -0,0 +1,109 @@
+__author__ = "Fernando Carrillo"
+__email__ = "fernando at carrillo.at"
+
+import numpy as np
+import scipy.sparse as sparse
+
+def degree_sample(matrix, max_nodes):
+	"""
+	Returns the sorted indices of the max_nodes nodes with the highest weighted
+	degree (in + out) of an adjacency matrix.
+	"""
+	n = matrix.shape[0]
+	if max_nodes is None or n <= max_nodes:
+		return np.arange(n)
+	degree = np.asarray(matrix.sum(axis=0)).ravel() + np.asarray(matrix.sum(axis=1)).ravel()
+	return np.sort(np.argpartition(-degree, max_nodes - 1)[:max_nodes])
+
+def _repulsion(pos, k, grid, block_size=2048):
+	"""
+	Fruchterman-Reingold repulsion (k^2 / distance) of all nodes, approximated
+	Barnes-Hut style: nodes are binned into a grid x grid raster and every node
+	is repelled by the centers of mass of the cells. O(nodes * cells) instead
+	of O(nodes^2).
+	"""
+	low = pos.min(axis=0)
+	span = np.maximum(pos.max(axis=0) - low, 1e-9)
+	cell_xy = np.minimum((pos - low) / span * grid, grid - 1).astype(np.int64)
+	cell = cell_xy[:, 0] * grid + cell_xy[:, 1]
+	mass = np.bincount(cell, minlength=grid * grid).astype(np.float64)
+	occupied = np.flatnonzero(mass)
+	cell_index = np.zeros(grid * grid, dtype=np.int64)
+	cell_index[occupied] = np.arange(len(occupied))
+	mass = mass[occupied]
+	centers = np.column_stack([np.bincount(cell, pos[:, d], minlength=grid * grid)[occupied] for d in (0, 1)]) / mass[:, np.newaxis]
+
+	force = np.zeros_like(pos)
+	for start in range(0, len(pos), block_size):
+		p = pos[start:start + block_size]
+		delta = p[:, np.newaxis, :] - centers[np.newaxis, :, :]
+		distance2 = np.maximum(np.einsum('ijk,ijk->ij', delta, delta), 1e-6 * k ** 2)
+		f = np.einsum('ijk,ij->ik', delta, mass * k ** 2 / distance2)
+		# The own cell repels with the center of mass of the other nodes in it.
+		rows = np.arange(len(p))
+		own = cell_index[cell[start:start + block_size]]
+		f -= delta[rows, own] * (mass[own] * k ** 2 / distance2[rows, own])[:, np.newaxis]
+		others = mass[own] - 1
+		own_delta = p - (centers[own] * mass[own][:, np.newaxis] - p) / np.maximum(others, 1)[:, np.newaxis]
+		own_distance2 = np.maximum((own_delta ** 2).sum(axis=1), 1e-6 * k ** 2)
+		f += own_delta * (others * k ** 2 / own_distance2)[:, np.newaxis]
+		force[start:start + block_size] = f
+	return force
+
+def force_layout(matrix, start=None, iterations=50, temperature=None, grid=20, seed=32):
+	"""
+	Force-directed layout of a (sampled) graph in the unit square. Returns an
+	(n, 2) array of positions. Every iteration is vectorized and costs
+	O(nodes * grid^2 + edges).
+
+	matrix : scipy.sparse matrix
+		Adjacency matrix, edge direction and weight are ignored.
+
+	start : (n, 2) array
+		Initial positions, e.g. from a previous layout. Rows with NaN (new
+		nodes) start at the mean position of their placed neighbours.
+
+	temperature : float
+		Maximal initial step, cools down linearly. Defaults to 0.1 and to 0.02
+		if most nodes have a start position, so a cached layout is only refined.
+	"""
+	n = matrix.shape[0]
+	rand = np.random.RandomState(seed)
+	if n == 0:
+		return np.zeros((0, 2))
+	edges = sparse.triu(((matrix + matrix.T) != 0).astype(np.float64), k=1).tocoo()
+	source, target = edges.row, edges.col
+
+	if start is None:
+		pos = rand.uniform(size=(n, 2))
+		warm = False
+	else:
+		pos = np.array(start, dtype=np.float64)
+		new = np.isnan(pos).any(axis=1)
+		warm = new.sum() < n / 2
+		if new.any():
+			# New nodes start next to their placed neighbours, isolated ones at random.
+			placed = np.where(new, 0, 1).astype(np.float64)
+			adjacency = sparse.csr_matrix((np.ones(len(source)), (source, target)), shape=(n, n))
+			adjacency = adjacency + adjacency.T
+			count = adjacency.dot(placed)
+			mean = adjacency.dot(np.where(new[:, np.newaxis], 0, pos)) / np.maximum(count, 1)[:, np.newaxis]
+			jitter = rand.normal(scale=0.01, size=(n, 2))
+			pos[new] = np.where((count[new] > 0)[:, np.newaxis], mean[new] + jitter[new], rand.uniform(size=(new.sum(), 2)))
+	if temperature is None:
+		temperature = 0.02 if warm else 0.1
+
+	k = np.sqrt(1.0 / n)
+	for t in np.linspace(temperature, 0, iterations + 1)[:-1]:
+		force = _repulsion(pos, k, grid)
+		delta = pos[source] - pos[target]
+		distance = np.sqrt((delta ** 2).sum(axis=1))[:, np.newaxis]
+		attraction = delta * distance / k
+		for d in (0, 1):
+			force[:, d] -= np.bincount(source, attraction[:, d], minlength=n)
+			force[:, d] += np.bincount(target, attraction[:, d], minlength=n)
+		length = np.maximum(np.sqrt((force ** 2).sum(axis=1)), 1e-9)[:, np.newaxis]
+		pos += force / length * np.minimum(length, t)
+
+	low = pos.min(axis=0)
+	return (pos - low) / np.maximum(pos.max(axis=0) - low, 1e-9)
@@ -0,0 +1,143 @@
+__author__ = "Fernando Carrillo"
+__email__ = "fernando at carrillo.at"
+
+import os
+import struct
+import numpy as np
+import networkx as nx
+import scipy.sparse as sparse
+
+MAGIC = b'SMAGRAPH'
+VERSION = 1
+# magic, version, flags, nodes, edges, high water mark, bytes of the name table
+HEADER = struct.Struct('<8sIIqqqq')
+HEADER_SIZE = 64
+INTEGER_WEIGHTS = 1
+
+def _aligned(offset):
+	return (offset + 7) // 8 * 8
+
+def _layout(n_nodes, n_edges):
+	"""
+	Returns the byte offsets of name offsets, CSR offsets, targets, weights and names.
+	"""
+	name_offsets = HEADER_SIZE
+	indptr = _aligned(name_offsets + 8 * (n_nodes + 1))
+	indices = _aligned(indptr + 8 * (n_nodes + 1))
+	weights = _aligned(indices + 4 * n_edges)
+	names = _aligned(weights + 8 * n_edges)
+	return name_offsets, indptr, indices, weights, names
+
+class GraphSnapshot(object):
+	"""
+	Directed weighted graph in a single memory-mappable file: a table of the
+	utf-8 encoded node names and the out edges in CSR format (offsets, targets,
+	weights), together with the database high water mark of the graph.
+	Opening a snapshot only maps the file, arrays are read on access.
+	"""
+	def __init__(self, filename):
+		self.filename = filename
+		self.data = np.memmap(filename, dtype=np.uint8, mode='r')
+		magic, version, flags, self.n_nodes, self.n_edges, self.high_water_mark, name_bytes = HEADER.unpack(self.data[:HEADER.size].tostring())
+		if magic != MAGIC or version != VERSION:
+			raise ValueError('%s is not a graph snapshot (version %d).' % (filename, VERSION))
+		self.integer_weights = bool(flags & INTEGER_WEIGHTS)
+		name_offsets, indptr, indices, weights, names = _layout(self.n_nodes, self.n_edges)
+		self.name_offsets = self.data[name_offsets:name_offsets + 8 * (self.n_nodes + 1)].view('<i8')
+		self.indptr = self.data[indptr:indptr + 8 * (self.n_nodes + 1)].view('<i8')
+		self.indices = self.data[indices:indices + 4 * self.n_edges].view('<i4')
+		self.weights = self.data[weights:weights + 8 * self.n_edges].view('<f8')
+		self.name_table = self.data[names:names + name_bytes]
+		self._names = None
+		self._index = None
+
+	@staticmethod
+	def write(filename, nodes, indptr, indices, weights, high_water_mark=0):
+		"""
+		Writes a snapshot atomically (to a temporary file which is then renamed).
+
+		nodes : list
+			Node names (unicode or utf-8 strings), node i is nodes[i].
+
+		indptr, indices, weights : arrays
+			Out edges in CSR format: node i links to indices[indptr[i]:indptr[i+1]].
+
+		high_water_mark : int
+			Highest connection id contained in the graph.
+		"""
+		encoded = [node.encode('utf-8') if isinstance(node, unicode) else str(node) for node in nodes]
+		name_offsets = np.zeros(len(encoded) + 1, dtype='<i8')
+		np.cumsum([len(name) for name in encoded], out=name_offsets[1:])
+		weights = np.asarray(weights, dtype=np.float64)
+		flags = INTEGER_WEIGHTS if np.array_equal(weights, np.round(weights)) else 0
+		n_nodes, n_edges = len(encoded), len(weights)
+		sections = zip(_layout(n_nodes, n_edges), [
+			name_offsets,
+			np.asarray(indptr, dtype='<i8'),
+			np.asarray(indices, dtype='<i4'),
+			weights.astype('<f8'),
+			np.frombuffer(b''.join(encoded), dtype=np.uint8)])
+
+		tmp = filename + '.tmp'
+		with open(tmp, 'wb') as f:
+			f.write(HEADER.pack(MAGIC, VERSION, flags, n_nodes, n_edges, high_water_mark, int(name_offsets[-1])))
+			for offset, array in sections:
+				f.write(b'\0' * (offset - f.tell()))
+				f.write(array.tostring())
+		os.rename(tmp, filename)
+
+	def name(self, i):
+		return self.name_table[self.name_offsets[i]:self.name_offsets[i + 1]].tostring().decode('utf-8')
+
+	def names(self):
+		"""
+		Returns the list of node names (decoded once).
+		"""
+		if self._names is None:
+			table = self.name_table.tostring()
+			offsets = self.name_offsets.tolist()
+			self._names = [table[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+		return self._names
+
+	def index(self, name):
+		"""
+		Returns the position of a node name.
+		"""
+		if self._index is None:
+			self._index = dict((node, i) for i, node in enumerate(self.names()))
+		return self._index[name]
+
+	def successors(self, name):
+		"""
+		Returns [(target name, weight)] of the out edges of a node.
+		"""
+		i = self.index(name)
+		start, end = self.indptr[i], self.indptr[i + 1]
+		names = self.names()
+		weights = self.edge_weights(start, end)
+		return [(names[j], w) for j, w in zip(self.indices[start:end].tolist(), weights.tolist())]
+
+	def edge_weights(self, start=0, end=None):
+		"""
+		Edge weights, as integers if all weights of the saved graph were integral.
+		"""
+		weights = self.weights[start:end]
+		return weights.astype(np.int64) if self.integer_weights else weights
+
+	def matrix(self):
+		"""
+		Weighted adjacency matrix in CSR format backed by the mapped arrays.
+		"""
+		return sparse.csr_matrix((self.weights, self.indices, self.indptr), shape=(self.n_nodes, self.n_nodes), copy=False)
+
+	def to_networkx(self):
+		"""
+		Returns the graph as networkx DiGraph.
+		"""
+		names = self.names()
+		sources = np.repeat(np.arange(self.n_nodes), np.diff(self.indptr)).tolist()
+		weights = self.edge_weights()
+		graph = nx.DiGraph()
+		graph.add_nodes_from(names)
+		graph.add_weighted_edges_from((names[u], names[v], w) for u, v, w in zip(sources, self.indices.tolist(), weights.tolist()))
+		return graph
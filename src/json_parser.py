@@ -1,4 +1,114 @@
+import os
+import gc
 import json
+import gzip
+from collections import deque
+from datetime import datetime
+# datetime.strptime imports _strptime on first use, which fails if threads race for it.
+import _strptime
+from multiprocessing import Pool, cpu_count
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Format of the created_at field of the twitter API.
+TWITTER_TIME_FORMAT = '%a %b %d %H:%M:%S +0000 %Y'
+
+def is_gzip(path):
+	with open(path, 'rb') as f:
+		return f.read(2) == GZIP_MAGIC
+
+def open_data(path):
+	"""
+	Opens plain or gzip compressed files for reading.
+	"""
+	if is_gzip(path):
+		return gzip.open(path, 'rb')
+	return open(path, 'rb')
+
+def parse_created_at(value):
+	"""
+	Returns the created_at string of a tweet as datetime (UTC), None if missing or malformed.
+	"""
+	try:
+		return datetime.strptime(value, TWITTER_TIME_FORMAT)
+	except (TypeError, ValueError):
+		return None
+
+def project(tweet, fields):
+	"""
+	Returns a copy of tweet with only the dotted field paths in fields,
+	e.g. ['text', 'user.screen_name']. Missing fields are None.
+	"""
+	result = {}
+	for field in fields:
+		keys = field.split('.')
+		value = tweet
+		for key in keys:
+			value = value.get(key) if isinstance(value, dict) else None
+		target = result
+		for key in keys[:-1]:
+			target = target.setdefault(key, {})
+		target[keys[-1]] = value
+	return result
+
+def parse_lines(lines, fields=None):
+	"""
+	Decodes JSON lines. Returns (tweets, number of malformed lines). Blank lines are skipped.
+	"""
+	tweets = []
+	malformed = 0
+	# Decoded tweets hold no reference cycles. Collecting garbage while the
+	# list grows only costs time.
+	gc_enabled = gc.isenabled()
+	gc.disable()
+	try:
+		for line in lines:
+			if not line.strip():
+				continue
+			try:
+				tweet = json.loads(line)
+			except ValueError:
+				malformed += 1
+				continue
+			tweets.append(project(tweet, fields) if fields else tweet)
+	finally:
+		if gc_enabled:
+			gc.enable()
+	return tweets, malformed
+
+def parse_byte_range(args):
+	"""
+	Decodes all lines of the file which start in the byte range [start, end).
+	"""
+	path, start, end, fields = args
+	with open(path, 'rb') as f:
+		offset = max(start - 1, 0)
+		f.seek(offset)
+		data = f.read(end - offset)
+		if data and not data.endswith(b'\n'):
+			# Complete the last line, it starts inside the range.
+			data += f.readline()
+	if start > 0:
+		# Skip the line started in the previous range.
+		data = data[data.find(b'\n') + 1:] if b'\n' in data else b''
+	return parse_lines(data.split(b'\n'), fields)
+
+def parse_block(args):
+	data, fields = args
+	return parse_lines(data.split(b'\n'), fields)
+
+def to_columns(tweets, fields):
+	"""
+	Converts projected tweets into a dict {field: list of values}.
+	"""
+	columns = dict((field, []) for field in fields)
+	for tweet in tweets:
+		for field in fields:
+			value = tweet
+			for key in field.split('.'):
+				value = value[key]
+			columns[field].append(value)
+	return columns
 
 class ParseJSON:
 	"""
@@ -7,6 +117,7 @@ class ParseJSON:
 	"""
 	def __init__(self, json_data_path):
 		self.path = json_data_path
+		self.malformed = 0
 						
 
 	def __iter__(self):
@@ -18,13 +129,100 @@ class ParseJSON:
 		Always wrap the CSV reader in a function that returns a generator (via the yield statement).
 		Open the file in universal newline mode with 'rU' for backwards compatibility.
 		Use context managers with [callable] as [name] to ensure that the handle to the file is closed automatically.
+
+		Gzip compressed files are supported. Malformed lines are skipped and counted in self.malformed. 
 		"""
-		with open(self.path, 'rU') as data:
+		with open_data(self.path) as data:
 			for line in data:
-				try:
-					yield json.loads(line)
-				except:
-					continue
+				tweets, malformed = parse_lines([line])
+				self.malformed += malformed
+				for tweet in tweets: 
+					yield tweet
+
+class ParallelJSONReader(object):
+	"""
+	Reads JSON lines (e.g. tweet dumps) with a pool of processes.
+	Plain files are split into byte ranges which are parsed independently.
+	Gzip files are decompressed by the calling process and parsed in blocks.
+	"""
+	def __init__(self, path, processes=None, chunk_size=16 * 1024 ** 2, fields=None):
+		"""
+		path : String
+			Plain or gzip compressed JSON lines file.
+
+		processes : int
+			Number of parser processes (default: number of cpus).
+
+		chunk_size : int
+			Bytes per parse task (uncompressed bytes for gzip files).
+
+		fields : list of String
+			Dotted paths of the fields to keep, e.g. ['text', 'user.screen_name', 'coordinates', 'entities'].
+			Only these fields are sent back from the parser processes. All fields are kept if None.
+		"""
+		self.path = path
+		self.processes = processes or cpu_count()
+		self.chunk_size = chunk_size
+		self.fields = fields
+		self.tweets = 0
+		self.malformed = 0
+
+	def _tasks(self):
+		if is_gzip(self.path):
+			# Decompress in blocks, cut at the last complete line.
+			with open_data(self.path) as data:
+				rest = b''
+				while True:
+					block = data.read(self.chunk_size)
+					if not block:
+						break
+					block = rest + block
+					cut = block.rfind(b'\n') + 1
+					rest = block[cut:]
+					yield parse_block, (block[:cut], self.fields)
+				if rest:
+					yield parse_block, (rest, self.fields)
+		else:
+			size = os.path.getsize(self.path)
+			for start in range(0, size, self.chunk_size):
+				yield parse_byte_range, (self.path, start, min(start + self.chunk_size, size), self.fields)
+
+	def batches(self):
+		"""
+		Generates lists of tweets in file order. At most two tasks per process
+		are in flight, so memory stays bounded for files of any size.
+		"""
+		pool = Pool(self.processes)
+		try:
+			pending = deque()
+			for function, args in self._tasks():
+				pending.append(pool.apply_async(function, (args, )))
+				if len(pending) >= 2 * self.processes:
+					yield self._collect(pending.popleft())
+			while pending:
+				yield self._collect(pending.popleft())
+		finally:
+			pool.terminate()
+
+	def _collect(self, result):
+		tweets, malformed = result.get()
+		self.tweets += len(tweets)
+		self.malformed += malformed
+		return tweets
+
+	def columnar_batches(self):
+		"""
+		Generates batches as dicts {field: list of values}. Needs fields.
+		"""
+		if not self.fields:
+			raise ValueError('Columnar batches need a list of fields.')
+		for tweets in self.batches():
+			yield to_columns(tweets, self.fields)
+
+	def __iter__(self):
+		for tweets in self.batches():
+			for tweet in tweets:
+				yield tweet
 
 if __name__ == '__main__':
 	#twitter_data_path = "/Users/carrillo/workspace/SmallProjects/TwitterAnalysis/data/packersFalcons.json"	
@@ -33,4 +231,8 @@ if __name__ == '__main__':
 	
 	for tweet in parser:
 		print tweet
-		
\ No newline at end of file
+
+	reader = ParallelJSONReader(twitter_data_path, fields=['text', 'user.screen_name', 'coordinates', 'entities'])
+	for columns in reader.columnar_batches(): 
+		print('%d tweets in batch' % len(columns['text']))
+	print('%d tweets, %d malformed lines' % (reader.tweets, reader.malformed))
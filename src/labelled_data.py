@@ -0,0 +1,92 @@
+__author__ = "Fernando Carrillo"
+__email__ = "fernando at carrillo.at"
+
+import abc
+import json
+
+from json_parser import open_data
+
+class LabelledSource(object):
+	"""
+	Re-iterable stream of labelled texts in chunks of (texts, labels).
+
+	Every holdout_every-th row is held out: a source with validation=False skips
+	these rows, the same source with validation=True yields only these rows. So
+	training and validation stream disjoint rows of the same data without keeping
+	anything in memory.
+	"""
+	__metaclass__ = abc.ABCMeta
+
+	def __init__(self, chunk_size=10000, holdout=0.0, validation=False):
+		"""
+		chunk_size : int
+			Rows per chunk.
+
+		holdout : float
+			Fraction of rows held out for validation.
+
+		validation : boolean
+			Yield the held out rows instead of the training rows.
+		"""
+		self.chunk_size = chunk_size
+		self.holdout_every = int(round(1. / holdout)) if holdout > 0 else 0
+		self.validation = validation
+
+	@abc.abstractmethod
+	def rows(self):
+		"""
+		Generates (text, label) of all rows.
+		"""
+		return
+
+	def __iter__(self):
+		texts, labels = [], []
+		for i, (text, label) in enumerate(self.rows()):
+			held_out = self.holdout_every > 0 and i % self.holdout_every == 0
+			if held_out != self.validation:
+				continue
+			texts.append(text)
+			labels.append(label)
+			if len(texts) >= self.chunk_size:
+				yield texts, labels
+				texts, labels = [], []
+		if texts:
+			yield texts, labels
+
+class JSONLinesSource(LabelledSource):
+	"""
+	Labelled texts from a (gzip compressed) JSON lines file, e.g. {"text": "...", "label": "sci.med"}.
+	Lines without text or label are skipped.
+	"""
+	def __init__(self, path, text_field='text', label_field='label', **kwargs):
+		super(JSONLinesSource, self).__init__(**kwargs)
+		self.path = path
+		self.text_field = text_field
+		self.label_field = label_field
+
+	def rows(self):
+		with open_data(self.path) as data:
+			for line in data:
+				if not line.strip():
+					continue
+				try:
+					row = json.loads(line)
+				except ValueError:
+					continue
+				if row.get(self.text_field) is not None and row.get(self.label_field) is not None:
+					yield row[self.text_field], row[self.label_field]
+
+class QuerySource(LabelledSource):
+	"""
+	Labelled texts from a database query returning (text, label) rows, e.g.
+	session.query(Message.text, Prediction.label).join(...). Rows are fetched in
+	chunks of chunk_size with yield_per.
+	"""
+	def __init__(self, query, **kwargs):
+		super(QuerySource, self).__init__(**kwargs)
+		self.query = query
+
+	def rows(self):
+		for text, label in self.query.yield_per(self.chunk_size):
+			if text is not None and label is not None:
+				yield text, label
@@ -0,0 +1,70 @@
+__author__ = "Fernando Carrillo"
+__email__ = "fernando at carrillo.at"
+
+import re
+from collections import Counter
+
+# Mentions in the tweet text, only used if the tweet has no entities.
+MENTION_PATTERN = re.compile(r'(?<!\w)@(\w{1,15})')
+
+def tweet_mentions(tweet, text_fallback=False):
+	"""
+	Returns the screen names mentioned in a tweet dict, read from entities.user_mentions
+	(of the extended tweet for truncated stream tweets).
+
+	text_fallback : boolean
+		Search the text for @mentions if the tweet has no entities, e.g. for
+		tweets stored without them.
+	"""
+	entities = tweet.get('entities')
+	extended = tweet.get('extended_tweet')
+	if extended and 'entities' in extended:
+		entities = extended['entities']
+	if entities is not None and 'user_mentions' in entities:
+		return [mention['screen_name'] for mention in entities['user_mentions']]
+	if text_fallback:
+		text = extended.get('full_text') if extended else None
+		return MENTION_PATTERN.findall(text or tweet.get('text') or '')
+	return []
+
+def count_mentions(tweets, text_fallback=False):
+	"""
+	Returns a Counter {screen name: number of mentions} over a batch of tweets.
+	"""
+	counts = Counter()
+	get = counts.get
+	for tweet in tweets:
+		for name in tweet_mentions(tweet, text_fallback):
+			counts[name] = get(name, 0) + 1
+	return counts
+
+def count_edges(tweets, text_fallback=False):
+	"""
+	Returns a Counter {(author screen name, mentioned screen name): number of mentions}
+	over a batch of tweets.
+	"""
+	counts = Counter()
+	get = counts.get
+	for tweet in tweets:
+		names = tweet_mentions(tweet, text_fallback)
+		if names:
+			author = tweet['user']['screen_name']
+			for name in names:
+				key = (author, name)
+				counts[key] = get(key, 0) + 1
+	return counts
+
+def user_ids(tweets):
+	"""
+	Returns {screen name: twitter user id} of the authors and mentioned users of a batch of tweets.
+	"""
+	ids = {}
+	for tweet in tweets:
+		user = tweet.get('user')
+		if user and 'id' in user:
+			ids[user['screen_name']] = user['id']
+		entities = tweet.get('entities') or {}
+		for mention in entities.get('user_mentions', ()):
+			if 'id' in mention:
+				ids[mention['screen_name']] = mention['id']
+	return ids
@@ -2,39 +2,146 @@ __author__ = "Fernando Carrillo"
 __email__ = "fernando at carrillo.at"
 
 
+import os
+import glob
+import hashlib
+import argparse
 import numpy as np
-import scipy as sp
-from time import time 
+from time import time
 
 from message_classifier import MessageClassifier
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, and_
 from sqlalchemy.sql import exists
-from db_tables import Base, Message, create_sqlite_db
-
-# Set-up connection to message data_base 
-print('Connect to database.')
-engine = create_engine('sqlite:///data/testuser.db')
-Base.metadata.bind = engine 
-DBSession = sessionmaker(bind=engine)
-session = DBSession()
-print('Connect to database. Done.')
-
-# Load trained classfier. At this point this is trained on the 
-# newsgroup data, but will be trained on a data-set of the domain of interest. 
-print('Load classifier.')
-mc = MessageClassifier()
-mc.load('data/tweet_clf_nb')
-print('Load classifier. Done.')
-
-messages = [getattr(x, "text").encode('utf-8') for x in session.query(Message).all()]
-print('Predict.')
-t0 = time() 
-probabilities = mc.predict_proba(messages)
-print('Predicted %d messages in %fs.' % (len(messages), (time()-t0)))
-
-for message, probs in zip(messages, probabilities): 
-	if sp.stats.entropy(probs) < 1.0: 
-		print('%s with a probability of\t%f\t%r' % (mc.labels[np.argmax(probs)], np.max(probs), message))
-		print('Entropy of prediction: %f' % (sp.stats.entropy(probs)))
\ No newline at end of file
+from sqlalchemy.orm import sessionmaker
+from db_tables import Base, Message, Prediction, create_sqlite_db
+
+def model_version(filename):
+	"""
+	Returns the md5 of the saved model files, so predictions of retrained models are kept apart.
+	"""
+	digest = hashlib.md5()
+	paths = [filename + '_model.p', filename + '_labels.p', filename + '_compact.npz'] + sorted(glob.glob(filename + '_compact/*'))
+	for path in paths:
+		if os.path.isfile(path):
+			with open(path, 'rb') as f:
+				for block in iter(lambda: f.read(1024 ** 2), b''):
+					digest.update(block)
+	return digest.hexdigest()
+
+def entropy(probabilities):
+	"""
+	Entropy (natural logarithm) of every row of a probability matrix.
+	"""
+	p = np.asarray(probabilities, dtype=np.float64)
+	return -np.sum(np.where(p > 0, p * np.log(np.where(p > 0, p, 1)), 0), axis=1)
+
+class BatchClassification(object):
+	"""
+	Classifies the messages of a database in chunks and stores label, probability
+	and entropy in the prediction table. Only messages without a prediction of
+	the model version are classified, so an interrupted or repeated run only
+	processes new messages.
+	"""
+	def __init__(self, db_session, classifier, model_version, chunk_size=10000, verbose=1):
+		"""
+		classifier : MessageClassifier
+			Loaded classifier.
+
+		model_version : String
+			Identifies the model, e.g. model_version(filename).
+
+		chunk_size : int
+			Messages read, classified and written per transaction.
+		"""
+		self.db_session = db_session
+		self.classifier = classifier
+		self.model_version = model_version
+		self.chunk_size = chunk_size
+		self.verbose = verbose
+		self.classified = 0
+
+	def get_chunk(self, after_id):
+		"""
+		Returns (id, text) of the next chunk of unclassified messages with ids above after_id.
+		"""
+		scored = exists().where(and_(Prediction.message_id == Message.id, Prediction.model_version == self.model_version))
+		return(self.db_session.query(Message.id, Message.text).filter(Message.id > after_id).filter(~scored).order_by(Message.id).limit(self.chunk_size).all())
+
+	def classify_chunk(self, rows):
+		"""
+		Classifies a chunk and inserts its predictions in one transaction.
+		"""
+		probabilities = self.classifier.predict_proba([text or u'' for _, text in rows])
+		best = np.argmax(probabilities, axis=1)
+		labels = np.asarray(self.classifier.labels)[best]
+		probability = probabilities[np.arange(len(rows)), best]
+		entropies = entropy(probabilities)
+		predictions = [{'message_id': id_, 'model_version': self.model_version, 'label': label, 'probability': p, 'entropy': h}
+			for (id_, _), label, p, h in zip(rows, labels.tolist(), probability.tolist(), entropies.tolist())]
+		try:
+			self.db_session.execute(Prediction.__table__.insert(), predictions)
+			self.db_session.commit()
+		except:
+			self.db_session.rollback()
+			raise
+
+	def run(self):
+		"""
+		Classifies all unclassified messages. Returns the number of classified messages.
+		"""
+		t0 = time()
+		after_id = 0
+		while True:
+			rows = self.get_chunk(after_id)
+			if not rows:
+				break
+			self.classify_chunk(rows)
+			self.classified += len(rows)
+			after_id = rows[-1][0]
+			if self.verbose > 1:
+				print('Classified %d messages.' % self.classified)
+		if self.verbose > 0:
+			print('Classified %d messages in %fs.' % (self.classified, time() - t0))
+		return self.classified
+
+	def get_candidates(self, max_entropy=1.0, labels=None):
+		"""
+		Returns (label, probability, entropy, text) of confidently classified messages.
+		"""
+		query = self.db_session.query(Prediction.label, Prediction.probability, Prediction.entropy, Message.text).join(Message, Message.id == Prediction.message_id)
+		query = query.filter(Prediction.model_version == self.model_version).filter(Prediction.entropy < max_entropy)
+		if labels:
+			query = query.filter(Prediction.label.in_(labels))
+		return(query.order_by(Prediction.message_id).all())
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Classifies new messages of a database and stores the predictions.')
+	parser.add_argument('--db', default='sqlite:///data/testuser.db')
+	parser.add_argument('--model', default='data/tweet_clf_nb', help='model file name prefix')
+	parser.add_argument('--chunk-size', type=int, default=10000)
+	parser.add_argument('--max-entropy', type=float, default=1.0, help='print messages classified with a lower entropy')
+	args = parser.parse_args()
+
+	# Set-up connection to message data_base
+	print('Connect to database.')
+	create_sqlite_db(args.db)
+	engine = create_engine(args.db)
+	Base.metadata.bind = engine
+	DBSession = sessionmaker(bind=engine)
+	session = DBSession()
+	print('Connect to database. Done.')
+
+	# Load trained classfier. At this point this is trained on the
+	# newsgroup data, but will be trained on a data-set of the domain of interest.
+	print('Load classifier.')
+	mc = MessageClassifier()
+	mc.load(args.model, compact=True)
+	print('Load classifier. Done.')
+
+	job = BatchClassification(session, mc, model_version(args.model), chunk_size=args.chunk_size)
+	job.run()
+
+	for label, probability, h, message in job.get_candidates(max_entropy=args.max_entropy):
+		print('%s with a probability of\t%f\t%r' % (label, probability, message))
+		print('Entropy of prediction: %f' % (h))
@@ -4,17 +4,37 @@ __email__ = "fernando at carrillo.at"
 import pandas as pd 
 import numpy as np 
 import re
+from time import time
+from collections import OrderedDict
 from matplotlib import pyplot as plt
 
 
 from sklearn.datasets import fetch_20newsgroups
 from sklearn.pipeline import Pipeline
 from sklearn.grid_search import GridSearchCV
-from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer, HashingVectorizer
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.linear_model import SGDClassifier
 from sklearn.externals import joblib
+from sklearn.externals.joblib import Parallel, delayed
+from sklearn.model_selection import StratifiedKFold, ParameterGrid
+from sklearn.base import clone
 from sklearn import metrics
+
+from compact_model import CompactTextModel
+
+
+###########################
+# Grid search helpers. Module level, so joblib can run them in worker processes. 
+###########################
+def _fit_and_score(estimator, train_X, train_y, test_X, test_y): 
+	"""
+	Fits estimator on a fold and returns its f1_micro score on the held out part 
+	(see MessageClassifier.cached_grid_search). 
+	"""
+	estimator.fit(train_X, train_y)
+	return metrics.f1_score(test_y, estimator.predict(test_X), average='micro')
+
 ###########################
 # Train a text classifier. 
 ###########################
@@ -22,10 +42,14 @@ class MessageClassifier(object):
 	"""docstring for MessageClassifier"""
 	def __init__(self):
 		self.clf = None
+		self.compact = None
+		# File the model was saved to or loaded from. 
+		self.filename = None
 
 	def train(self, train_X, train_y, labels,
 		pipeline=Pipeline([('vect', CountVectorizer(encoding='utf-8', decode_error='strict')), ('tfidf', TfidfTransformer()), ('nb', MultinomialNB())]), 
-		param_grid={'vect__ngram_range': [(1, 2)], 'nb__alpha': [10**-4,10**-3,10**-2]}
+		param_grid={'vect__ngram_range': [(1, 2)], 'nb__alpha': [10**-4,10**-3,10**-2]}, 
+		cache_features=False, cv=5, n_jobs=-1
 		): 
 		"""
 		Trains a classifier on training data. 
@@ -47,13 +71,134 @@ class MessageClassifier(object):
 
         param_grid = dictionary 
         	Metaparameters to grid search. 
+
+        cache_features : boolean 
+        	Vectorize every fold once per setting of the transformer steps and only 
+        	refit the final estimator for its parameters (see cached_grid_search). 
 		"""
-		grid_search = GridSearchCV(estimator=pipeline, param_grid=param_grid, scoring='f1_micro', verbose=1, cv=5, n_jobs=-1)
-		grid_search.fit(train_X, train_y)
-		print( ('Best score %s of estimator %s') % (grid_search.best_score_, grid_search.best_estimator_))
-		self.clf = grid_search.best_estimator_
-		self.clf.fit(train_X, train_y)
+		if cache_features: 
+			self.clf, best_score = self.cached_grid_search(train_X, train_y, pipeline, param_grid, cv=cv, n_jobs=n_jobs)
+			print( ('Best score %s of estimator %s') % (best_score, self.clf))
+		else: 
+			# GridSearchCV refits the best estimator on the whole training data. 
+			grid_search = GridSearchCV(estimator=pipeline, param_grid=param_grid, scoring='f1_micro', verbose=1, cv=cv, n_jobs=n_jobs)
+			grid_search.fit(train_X, train_y)
+			print( ('Best score %s of estimator %s') % (grid_search.best_score_, grid_search.best_estimator_))
+			self.clf = grid_search.best_estimator_
 		self.labels = labels
+		# The saved model files belong to the previous model. 
+		self.compact = None
+		self.filename = None
+
+	def cached_grid_search(self, train_X, train_y, pipeline, param_grid, cv=5, n_jobs=-1): 
+		"""
+		Grid search with the folds of GridSearchCV and f1_micro scoring, but the 
+		transformer steps (e.g. CountVectorizer, TfidfTransformer) are fitted once per 
+		fold and setting. The feature matrices are reused for all parameters of the 
+		final estimator. Returns (best pipeline refitted on all data, best score). 
+		"""
+		t0 = time()
+		final_name, final_estimator = pipeline.steps[-1]
+		prefix = final_name + '__'
+		# Group the grid by the parameters of the transformer steps. 
+		settings = OrderedDict()
+		for params in ParameterGrid(param_grid): 
+			features = tuple(sorted((k, v) for k, v in params.items() if not k.startswith(prefix)))
+			settings.setdefault(features, []).append(dict((k[len(prefix):], v) for k, v in params.items() if k.startswith(prefix)))
+
+		texts = np.asarray(train_X, dtype=object)
+		train_y = np.asarray(train_y)
+		folds = list(StratifiedKFold(n_splits=cv).split(texts, train_y))
+		scores = OrderedDict()
+		feature_time = 0.0
+		time_saved = 0.0
+		for features, estimator_grid in settings.items(): 
+			for train, test in folds: 
+				t1 = time()
+				transformer = Pipeline(clone(pipeline).steps[:-1]).set_params(**dict(features))
+				fold_train_X = transformer.fit_transform(list(texts[train]))
+				fold_test_X = transformer.transform(list(texts[test]))
+				duration = time() - t1
+				feature_time += duration
+				# Every further estimator setting would have vectorized the fold again. 
+				time_saved += duration * (len(estimator_grid) - 1)
+				fold_scores = Parallel(n_jobs=n_jobs)(delayed(_fit_and_score)(clone(final_estimator).set_params(**params), fold_train_X, train_y[train], fold_test_X, train_y[test]) 
+					for params in estimator_grid)
+				for i, score in enumerate(fold_scores): 
+					scores.setdefault((features, i), []).append(score)
+
+		(features, i), fold_scores = max(scores.items(), key=lambda item: np.mean(item[1]))
+		best_params = dict(features)
+		best_params.update((prefix + k, v) for k, v in settings[features][i].items())
+		best = clone(pipeline).set_params(**best_params).fit(train_X, train_y)
+		self.search_time_saved = time_saved
+		print('Searched %d settings in %fs. Vectorizing took %fs, caching the features saved about %fs.' % (len(scores), time() - t0, feature_time, time_saved))
+		return best, np.mean(fold_scores)
+
+	def train_streaming(self, source, labels, estimator=None, validation=None, n_features=2 ** 20, ngram_range=(1, 2), epochs=1, verbose=1): 
+		"""
+		Trains out-of-core on chunks of labelled texts. Features are hashed, so no 
+		vocabulary has to be kept, and the estimator is updated with partial_fit. 
+		The resulting pipeline works with dump, load, test and predict_proba. 
+
+		Parameters
+    	----------
+    	source : iterable of (texts, labels) 
+        	Re-iterable chunks, e.g. a labelled_data.JSONLinesSource. 
+
+    	labels : array 
+        	Text class names. Labels of the source are class names or indices. 
+
+    	estimator : 
+        	Estimator with partial_fit, e.g. MultinomialNB or SGDClassifier(loss='log'). 
+        	MultinomialNB(alpha=0.01) if None. 
+
+    	validation : iterable of (texts, labels) 
+        	Held out chunks, scored after training (see validate_streaming). 
+
+    	epochs : int 
+        	Passes over the source. 
+		"""
+		t0 = time()
+		vect = HashingVectorizer(n_features=n_features, ngram_range=ngram_range, alternate_sign=False, norm='l2', encoding='utf-8', decode_error='replace')
+		if estimator is None: 
+			estimator = MultinomialNB(alpha=0.01)
+		classes = np.arange(len(labels))
+		index = dict((label, i) for i, label in enumerate(labels))
+		rows = 0
+		for epoch in range(epochs): 
+			for texts, y in source: 
+				estimator.partial_fit(vect.transform(texts), [index.get(label, label) for label in y], classes=classes)
+				rows += len(texts)
+				if verbose > 1: 
+					print('Epoch %d: trained on %d texts.' % (epoch + 1, rows))
+		self.clf = Pipeline([('vect', vect), ('clf', estimator)])
+		self.labels = labels
+		self.compact = None
+		self.filename = None
+		if verbose > 0: 
+			print('Trained on %d texts in %fs.' % (rows, time() - t0))
+		if validation is not None: 
+			return self.validate_streaming(validation, verbose=verbose)
+
+	def validate_streaming(self, source, verbose=1): 
+		"""
+		Scores the model on chunks of labelled texts with a running confusion matrix. 
+		Returns accuracy, macro averaged f1 and the confusion matrix. 
+		"""
+		index = dict((label, i) for i, label in enumerate(self.labels))
+		confusion = np.zeros((len(self.labels), len(self.labels)), dtype=np.int64)
+		for texts, y in source: 
+			predicted = np.argmax(self.predict_proba(texts), axis=1)
+			np.add.at(confusion, ([index.get(label, label) for label in y], predicted), 1)
+		true_positives = np.diag(confusion).astype(np.float64)
+		precision = true_positives / np.maximum(confusion.sum(axis=0), 1)
+		recall = true_positives / np.maximum(confusion.sum(axis=1), 1)
+		f1 = 2 * precision * recall / np.maximum(precision + recall, 1e-12)
+		result = {'accuracy': true_positives.sum() / max(confusion.sum(), 1), 'f1_macro': f1.mean(), 'confusion': confusion}
+		if verbose > 0: 
+			print('Validated on %d texts: accuracy %f, macro f1 %f.' % (confusion.sum(), result['accuracy'], result['f1_macro']))
+		return result
 
 	def dump(self, filename): 
 		"""
@@ -66,8 +211,9 @@ class MessageClassifier(object):
 		"""
 		_ = joblib.dump(self.clf, filename + '_model.p', compress=9)
 		_ = joblib.dump(self.labels, filename + '_labels.p', compress=9)
+		self.filename = filename
 
-	def load(self, filename): 
+	def load(self, filename, compact=False): 
 		"""
 		Loads model from file 
 
@@ -75,9 +221,49 @@ class MessageClassifier(object):
     	----------
     	filename : String 
         	Filename for saved model. 
+
+    	compact : boolean 
+        	Load the (memory-mapped) compact model written by export instead of 
+        	decompressing the pipeline, if it exists. 
 		"""
+		if compact and CompactTextModel.exists(filename): 
+			self.load_compact(filename)
+			return
 		self.clf = joblib.load(filename + '_model.p')
 		self.labels = joblib.load(filename + '_labels.p')
+		self.filename = filename
+
+	def export(self, filename, mmap=True): 
+		"""
+		Exports the trained pipeline as compact inference model 
+		(see CompactTextModel) and uses it for prediction. 
+
+		Parameters
+    	----------
+    	filename : String 
+        	Filename for saved model. 
+
+    	mmap : boolean 
+        	Write the uncompressed memory-mappable format, which loads instantly and 
+        	is shared between processes. Otherwise a compressed archive is written. 
+		"""
+		self.compact = CompactTextModel.from_pipeline(self.clf, self.labels)
+		self.compact.save(filename, mmap=mmap)
+		self.filename = filename
+
+	def load_compact(self, filename): 
+		"""
+		Loads a compact inference model written by export. The memory-mappable 
+		format is mapped read-only, not read. 
+
+		Parameters
+    	----------
+    	filename : String 
+        	Filename for saved model. 
+		"""
+		self.compact = CompactTextModel.load(filename)
+		self.labels = self.compact.labels
+		self.filename = filename
 
 	def test(self, valid_X, valid_y): 
 		"""
@@ -94,25 +280,32 @@ class MessageClassifier(object):
 		valid_targetnames : array 
 			Text of targets
 		"""
-		predicted = self.clf.predict(valid_X)
+		predicted = (self.compact or self.clf).predict(valid_X)
 		print(metrics.classification_report(valid_y, predicted, target_names=self.labels))		
 
 	def predict_proba(self, text): 
 		"""
-		Classifies text provided. 
+		Classifies text provided. Uses the compact model if one was exported or loaded. 
 		"""
-		return self.clf.predict_proba(text)
+		return (self.compact or self.clf).predict_proba(text)
 
 	def time_prediction(self, text=['God is love', 'OpenGL on the GPU is fast', 'What is this sentence about?'], iterations=100):
 		"""
-		times execution of prediction 
+		times execution of prediction. If both the pipeline and the compact model 
+		are available, both are timed and their predictions compared. 
 		"""
-		from time import time
-		t0 = time()
-		for _ in range(iterations): 
-			self.predict_proba(text)
-		duration = time() - t0
-		print('Took %fs to classify %d phrases %d times.' %(duration, len(text), iterations) )
+		durations = {} 
+		for name, clf in [('pipeline', self.clf), ('compact model', self.compact)]: 
+			if clf is None: 
+				continue
+			t0 = time()
+			for _ in range(iterations): 
+				clf.predict_proba(text)
+			durations[name] = time() - t0
+			print('%s took %fs to classify %d phrases %d times.' %(name, durations[name], len(text), iterations) )
+		if len(durations) == 2: 
+			difference = np.abs(self.clf.predict_proba(text) - self.compact.predict_proba(text)).max()
+			print('Compact model is %.1fx faster. Maximal probability difference %g.' % (durations['pipeline'] / max(durations['compact model'], 1e-9), difference))
 
 	# def top_keys(self, n=10):
 	# 	for i, category in enumerate(self.labels)
@@ -0,0 +1,196 @@
+__author__ = "Fernando Carrillo"
+__email__ = "fernando at carrillo.at"
+
+import os
+import glob
+import shutil
+import argparse
+from time import time
+
+from sqlalchemy import create_engine
+from db_tables import SCHEMA_VERSION, get_schema_version
+
+###########################
+# Schema migrations. Every step converts a database of the previous
+# version and is written in plain SQL, so it does not depend on later
+# changes of db_tables.
+###########################
+
+V2_TABLES = [
+	'CREATE TABLE user (id INTEGER NOT NULL PRIMARY KEY, name VARCHAR(50) NOT NULL UNIQUE, visited BOOLEAN NOT NULL, depth INTEGER NOT NULL)',
+	'CREATE INDEX ix_user_visited_depth ON user (visited, depth)',
+	'CREATE TABLE connection (id INTEGER NOT NULL PRIMARY KEY, user_1_id INTEGER NOT NULL REFERENCES user (id), user_2_id INTEGER NOT NULL REFERENCES user (id), weight INTEGER)',
+	'CREATE UNIQUE INDEX ix_connection_users ON connection (user_1_id, user_2_id)',
+	'CREATE TABLE location (id INTEGER NOT NULL PRIMARY KEY, user_id INTEGER REFERENCES user (id), geojson TEXT, location TEXT)',
+	'CREATE TABLE message (id INTEGER NOT NULL PRIMARY KEY, user_id INTEGER REFERENCES user (id), text TEXT)',
+	'CREATE INDEX ix_message_user_id ON message (user_id)',
+]
+
+def migrate_v1_to_v2(conn):
+	"""
+	Replaces screen name keys by integer user ids and adds the indexes.
+	Duplicated connections of the v1 crawler are merged by summing their weights.
+	"""
+	old_tables = [t for t in ['user', 'connection', 'location', 'message'] if conn.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = ?", t).scalar()]
+	for table in old_tables:
+		conn.execute('ALTER TABLE "%s" RENAME TO "%s_v1"' % (table, table))
+	for statement in V2_TABLES:
+		conn.execute(statement)
+
+	# Users which were only referenced (e.g. mentioned users of the stream) become unvisited users.
+	referenced = {
+		'user': 'SELECT name AS n FROM user_v1',
+		'connection': 'SELECT user_1_name AS n FROM connection_v1 UNION SELECT user_2_name FROM connection_v1',
+		'location': 'SELECT user_name AS n FROM location_v1',
+		'message': 'SELECT user_name AS n FROM message_v1',
+	}
+	if 'user' in old_tables:
+		conn.execute('INSERT INTO user (name, visited, depth) SELECT name, visited, depth FROM user_v1 ORDER BY rowid')
+	names = ' UNION '.join(referenced[t] for t in old_tables if t != 'user')
+	if names:
+		conn.execute('INSERT INTO user (name, visited, depth) SELECT n, 0, 0 FROM (%s) WHERE n IS NOT NULL AND n NOT IN (SELECT name FROM user)' % names)
+
+	if 'connection' in old_tables:
+		conn.execute('''INSERT INTO connection (id, user_1_id, user_2_id, weight)
+			SELECT min(c.id), u1.id, u2.id, sum(c.weight) FROM connection_v1 c
+			JOIN user u1 ON u1.name = c.user_1_name JOIN user u2 ON u2.name = c.user_2_name
+			GROUP BY u1.id, u2.id''')
+	if 'location' in old_tables:
+		conn.execute('INSERT INTO location (id, user_id, geojson, location) SELECT l.id, u.id, l.geojson, l.location FROM location_v1 l LEFT JOIN user u ON u.name = l.user_name')
+	if 'message' in old_tables:
+		conn.execute('INSERT INTO message (id, user_id, text) SELECT m.id, u.id, m.text FROM message_v1 m LEFT JOIN user u ON u.name = m.user_name')
+
+	for table in ['connection', 'location', 'message', 'user']:
+		if table in old_tables:
+			conn.execute('DROP TABLE "%s_v1"' % table)
+
+def migrate_v2_to_v3(conn):
+	"""
+	Recreates the connection table with AUTOINCREMENT ids.
+	"""
+	conn.execute('CREATE TABLE connection_v3 (id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, user_1_id INTEGER NOT NULL REFERENCES user (id), user_2_id INTEGER NOT NULL REFERENCES user (id), weight INTEGER)')
+	conn.execute('INSERT INTO connection_v3 (id, user_1_id, user_2_id, weight) SELECT id, user_1_id, user_2_id, weight FROM connection ORDER BY id')
+	conn.execute('DROP TABLE connection')
+	conn.execute('ALTER TABLE connection_v3 RENAME TO connection')
+	conn.execute('CREATE UNIQUE INDEX ix_connection_users ON connection (user_1_id, user_2_id)')
+
+def migrate_v3_to_v4(conn):
+	"""
+	Adds the crawl frontier. Unvisited users become pending at their depth, weighted
+	by the connections pointing to them, so an interrupted crawl can be resumed.
+	"""
+	conn.execute('CREATE TABLE IF NOT EXISTS frontier (user_id INTEGER NOT NULL PRIMARY KEY REFERENCES user (id), depth INTEGER NOT NULL, weight FLOAT NOT NULL, status VARCHAR(10) NOT NULL)')
+	conn.execute('CREATE INDEX IF NOT EXISTS ix_frontier_status_depth_weight ON frontier (status, depth, weight)')
+	conn.execute('CREATE INDEX IF NOT EXISTS ix_frontier_status_weight ON frontier (status, weight)')
+	conn.execute('''INSERT OR IGNORE INTO frontier (user_id, depth, weight, status)
+		SELECT u.id, u.depth, COALESCE(w.weight, 0), CASE WHEN u.visited THEN 'done' ELSE 'pending' END FROM user u
+		LEFT JOIN (SELECT user_2_id, sum(weight) AS weight FROM connection GROUP BY user_2_id) w ON w.user_2_id = u.id''')
+
+def migrate_v4_to_v5(conn):
+	"""
+	Adds the twitter user id to the user table.
+	"""
+	conn.execute('ALTER TABLE user ADD COLUMN twitter_id INTEGER')
+	conn.execute('CREATE UNIQUE INDEX ix_user_twitter_id ON user (twitter_id)')
+
+def migrate_v5_to_v6(conn):
+	"""
+	Adds tweet id and creation time to the message table. Existing messages have no tweet id.
+	"""
+	conn.execute('ALTER TABLE message ADD COLUMN tweet_id INTEGER')
+	conn.execute('ALTER TABLE message ADD COLUMN created_at DATETIME')
+	conn.execute('CREATE UNIQUE INDEX ix_message_tweet_id ON message (tweet_id)')
+
+def migrate_v6_to_v7(conn):
+	"""
+	Adds the prediction table of message_classification.py.
+	"""
+	conn.execute('CREATE TABLE IF NOT EXISTS prediction (id INTEGER NOT NULL PRIMARY KEY, message_id INTEGER NOT NULL REFERENCES message (id), '
+		'model_version VARCHAR(64) NOT NULL, label VARCHAR(100), probability FLOAT, entropy FLOAT)')
+	conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS ix_prediction_message_model ON prediction (message_id, model_version)')
+	conn.execute('CREATE INDEX IF NOT EXISTS ix_prediction_model_entropy ON prediction (model_version, entropy)')
+
+def migrate_v7_to_v8(conn):
+	"""
+	Recreates the connection table with the time bucket of connections in their
+	unique key. Existing connections get bucket -1 (db_tables.NO_BUCKET). The
+	bucket is NOT NULL, since NULLs never collide in the unique index.
+	"""
+	sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'connection'").scalar()
+	conn.execute('CREATE TABLE connection_v8 (id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, user_1_id INTEGER NOT NULL REFERENCES user (id), '
+		'user_2_id INTEGER NOT NULL REFERENCES user (id), weight INTEGER, bucket INTEGER NOT NULL DEFAULT -1)')
+	conn.execute('INSERT INTO connection_v8 (id, user_1_id, user_2_id, weight, bucket) SELECT id, user_1_id, user_2_id, weight, -1 FROM connection ORDER BY id')
+	conn.execute('DROP TABLE connection')
+	conn.execute('ALTER TABLE connection_v8 RENAME TO connection')
+	# Ids of deleted connections must not be reused (see db_tables.Connection).
+	if sequence is not None:
+		conn.execute("UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = 'connection'", sequence)
+	conn.execute('CREATE UNIQUE INDEX ix_connection_users ON connection (user_1_id, user_2_id, bucket)')
+	conn.execute('CREATE INDEX ix_connection_bucket ON connection (bucket)')
+
+# (version, function converting the previous version into it)
+MIGRATIONS = [
+	(2, migrate_v1_to_v2),
+	(3, migrate_v2_to_v3),
+	(4, migrate_v3_to_v4),
+	(5, migrate_v4_to_v5),
+	(6, migrate_v5_to_v6),
+	(7, migrate_v6_to_v7),
+	(8, migrate_v7_to_v8),
+]
+
+def migrate(path, keep_backup=False, vacuum=True, verbose=1):
+	"""
+	Converts the sqlite database at path in place to the current schema version.
+	A copy of the database is restored if a migration step fails.
+
+	Parameters
+	----------
+	path : String
+		Path of the sqlite file.
+
+	keep_backup : boolean
+		Keep the copy of the unconverted database at path + '.bak'.
+
+	vacuum : boolean
+		Reclaim the space of the dropped tables.
+	"""
+	t0 = time()
+	engine = create_engine('sqlite:///' + path)
+	version = get_schema_version(engine)
+	steps = [(v, step) for v, step in MIGRATIONS if v > version]
+	if version == 0 or not steps:
+		if verbose > 0:
+			print('%s: nothing to do (schema version %d).' % (path, version))
+		return
+
+	backup = path + '.bak'
+	shutil.copyfile(path, backup)
+	try:
+		for v, step in steps:
+			with engine.begin() as conn:
+				step(conn)
+				conn.execute('PRAGMA user_version = %d' % v)
+			if verbose > 0:
+				print('%s: migrated to schema version %d.' % (path, v))
+		if vacuum:
+			engine.execute('VACUUM')
+	except:
+		engine.dispose()
+		shutil.move(backup, path)
+		raise
+	engine.dispose()
+	if not keep_backup:
+		os.remove(backup)
+	if verbose > 0:
+		print('%s: done in %fs.' % (path, time() - t0))
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Converts sqlite databases in place to schema version %d.' % SCHEMA_VERSION)
+	parser.add_argument('paths', nargs='*', help='sqlite files (default: data/*.db)')
+	parser.add_argument('--keep-backup', action='store_true', help='keep a copy of every database as <path>.bak')
+	parser.add_argument('--no-vacuum', action='store_true', help='do not reclaim free space after the migration')
+	args = parser.parse_args()
+
+	for path in args.paths or sorted(glob.glob('data/*.db')):
+		migrate(path, keep_backup=args.keep_backup, vacuum=not args.no_vacuum)
@@ -1,15 +1,26 @@
 __author__ = "Fernando Carrillo"
 __email__ = "fernando at carrillo.at"
 
+import os
 import networkx as nx
-import operator
-from matplotlib import pyplot as plt
+from time import time
+import numpy as np
+from matplotlib.collections import LineCollection
 
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.sql import exists
-from db_tables import Base, Connection, create_sqlite_db
+from sqlalchemy.orm import sessionmaker, aliased
+from sqlalchemy.sql import exists, func
+from db_tables import Base, User, Connection, create_sqlite_db, time_bucket, NO_BUCKET
+from bulk_writer import chunks
+from page_rank import adjacency_matrix, page_rank, top_k
+from graph_snapshot import GraphSnapshot
+from components import UnionFind, component_labels, small_components
+from graph_layout import degree_sample, force_layout
+from centrality import hits, core_number, path_centrality
+
+# Measures of centrality and get_top_nodes.
+MEASURES = ['page_rank', 'betweenness', 'closeness', 'hubs', 'authorities', 'core_number']
 
 
 class NetworkGraph(object):
@@ -17,36 +28,331 @@ class NetworkGraph(object):
 	def __init__(self, db_session):
 		self.db_session = db_session
 		self.graph = nx.DiGraph()
+		self.high_water_mark = 0
+		self.last_rank = None
+		self.snapshot = None
+		self.components = None
+		self.positions = {}
+		self.window = None
 
-	def build(self): 
+	def build(self, incremental=False, chunk_size=10000, hours=None, now=None): 
 		"""
 		Loads connections from database and 
 		creates Graph. 
+
+		incremental : boolean 
+			Only merge connections which were added or updated since the last build 
+			into the existing graph. Otherwise the graph is rebuilt from scratch. 
+
+		chunk_size : int 
+			Number of connections fetched per query. Rows are read as plain tuples, 
+			so memory is bounded by the graph and one chunk. 
+
+		hours : float 
+			Only use the connections of the time buckets of the last hours (stream 
+			connections, see db_tables.time_bucket). Once the window has moved to a 
+			new bucket an incremental build rebuilds the graph. 
+
+		now : float 
+			End of the window in unix seconds (default: current time). 
+		"""
+		window = None
+		if hours is not None: 
+			window = time_bucket((time() if now is None else now) - hours * 3600)
+		if incremental and window != self.window: 
+			incremental = False
+		self.window = window
+
+		if not incremental: 
+			self.graph = nx.DiGraph()
+			self.high_water_mark = 0
+			self.components = None
+		else: 
+			self.networkx()
+		components = self.components
+
+		user_1 = aliased(User)
+		user_2 = aliased(User)
+		query = self.db_session.query(Connection.id, Connection.user_1_id, Connection.user_2_id, user_1.name, user_2.name, Connection.weight, Connection.bucket).join(user_1, Connection.user_1_id == user_1.id).join(user_2, Connection.user_2_id == user_2.id).order_by(Connection.id)
+		if window is not None: 
+			query = query.filter(Connection.bucket >= window)
+		# A full build streams all buckets of a pair, so their weights are summed 
+		# here. Incremental builds only see the new buckets and query the sums. 
+		sums = None if incremental else {}
+		while True: 
+			rows = query.filter(Connection.id > self.high_water_mark).limit(chunk_size).all()
+			bucketed = {}
+			for _, user_id1, user_id2, user_name1, user_name2, weight, bucket in rows: 
+				if bucket == NO_BUCKET: 
+					# Updated connections carry their total weight. 
+					self.graph.add_edge(user_name1, user_name2, weight=weight)
+				elif sums is not None: 
+					pair = (user_name1, user_name2)
+					sums[pair] = sums.get(pair, 0) + (weight or 0)
+					self.graph.add_edge(user_name1, user_name2, weight=sums[pair])
+				else: 
+					bucketed[(user_id1, user_id2)] = (user_name1, user_name2)
+				if components is not None: 
+					components.union(user_name1, user_name2)
+			# Connections of time buckets weigh the sum over their buckets. 
+			for pair, weight in self.bucket_totals(bucketed, window).items(): 
+				user_name1, user_name2 = bucketed[pair]
+				self.graph.add_edge(user_name1, user_name2, weight=weight)
+			if rows: 
+				self.high_water_mark = rows[-1][0]
+			if len(rows) < chunk_size: 
+				break
+
+	def bucket_totals(self, pairs, window=None): 
+		"""
+		Returns {(user_1_id, user_2_id): weight summed over the time buckets} of 
+		pairs, over the buckets from window on if window is not None. 
+		"""
+		totals = {}
+		for chunk in chunks(set(u1 for u1, _ in pairs)): 
+			query = self.db_session.query(Connection.user_1_id, Connection.user_2_id, func.sum(Connection.weight)).filter(Connection.user_1_id.in_(chunk)).filter(Connection.bucket != NO_BUCKET)
+			if window is not None: 
+				query = query.filter(Connection.bucket >= window)
+			for user_id1, user_id2, weight in query.group_by(Connection.user_1_id, Connection.user_2_id): 
+				if (user_id1, user_id2) in pairs: 
+					totals[(user_id1, user_id2)] = weight
+		return totals
+
+	def networkx(self): 
+		"""
+		Returns the networkx graph. A snapshot loaded as array view is converted on first use. 
 		"""
-		for edge in self.db_session.query(Connection).all(): 
-			self.graph.add_edge(edge.user_1_name, edge.user_2_name, weight=edge.weight)
+		if self.graph is None: 
+			self.graph = self.snapshot.to_networkx()
+		return self.graph
+
+	def adjacency(self): 
+		"""
+		Returns (nodes, weighted adjacency matrix in CSR format), read directly 
+		from the snapshot while it is loaded as array view. 
+		"""
+		if self.graph is None: 
+			return self.snapshot.names(), self.snapshot.matrix()
+		return adjacency_matrix(self.graph)
+
+	def save_snapshot(self, filename): 
+		"""
+		Saves the graph and its high water mark as binary snapshot (see GraphSnapshot). 
+		"""
+		nodes, matrix = self.adjacency()
+		matrix.sort_indices()
+		GraphSnapshot.write(filename, nodes, matrix.indptr, matrix.indices, matrix.data, self.high_water_mark)
+
+	def load_snapshot(self, filename, networkx=False, refresh=False): 
+		"""
+		Loads a graph snapshot. 
+
+		networkx : boolean 
+			Convert the snapshot to a networkx graph. Otherwise the graph stays an 
+			array view of the mapped file (graph is None) until a method needs networkx. 
+
+		refresh : boolean 
+			Merge connections added to the database after the snapshot was saved. 
+		"""
+		self.snapshot = GraphSnapshot(filename)
+		self.high_water_mark = self.snapshot.high_water_mark
+		self.last_rank = None
+		self.components = None
+		self.window = None
+		self.graph = self.snapshot.to_networkx() if networkx else None
+		if refresh and self.is_stale(): 
+			self.build(incremental=True)
+
+	def is_stale(self): 
+		"""
+		True if the database contains connections added or updated after the last build. 
+		"""
+		last_id = self.db_session.query(func.max(Connection.id)).scalar()
+		return last_id is not None and last_id > self.high_water_mark
+
+	def layout(self, max_nodes=None, iterations=50): 
+		"""
+		Computes a force-directed layout (see graph_layout.py). Returns (nodes, 
+		positions array, adjacency matrix) of the laid out nodes. 
+
+		Positions are cached in self.positions: a redraw of an unchanged graph 
+		reuses them, after graph updates only the new nodes are placed and the 
+		layout is refined. 
+
+		max_nodes : int 
+			Lay out only the max_nodes nodes with the highest weighted degree. 
+		"""
+		nodes, matrix = self.adjacency()
+		keep = degree_sample(matrix, max_nodes)
+		if len(keep) < len(nodes): 
+			matrix = matrix[keep][:, keep]
+			nodes = [nodes[i] for i in keep.tolist()]
+
+		start = None
+		if self.positions: 
+			start = np.array([self.positions.get(node, (np.nan, np.nan)) for node in nodes], dtype=np.float64).reshape(-1, 2)
+		if start is not None and not np.isnan(start).any(): 
+			positions = start
+		else: 
+			positions = force_layout(matrix, start=start, iterations=iterations)
+			self.positions.update(zip(nodes, map(tuple, positions.tolist())))
+		return nodes, positions, matrix
 
-	def draw(self, node_size=10, edge_width=1, figure_size=[6,6]): 
+	def draw(self, node_size=10, edge_width=1, figure_size=[6,6], filename=None, max_nodes=20000, iterations=50, dpi=150): 
 		"""
 		Draws the graph. 
+
+		filename : String 
+			Render to an image file (PNG, SVG or PDF by extension) with the Agg 
+			backend, which needs no display. Otherwise the figure is shown. 
+
+		max_nodes : int 
+			Draw only the max_nodes nodes with the highest weighted degree. 
+
+		iterations : int 
+			Iterations of the force-directed layout. Cached positions are reused. 
 		"""
-		elarge=[(u,v) for (u,v,d) in self.graph.edges(data=True) if d['weight'] > 5]
-		esmall=[(u,v) for (u,v,d) in self.graph.edges(data=True) if d['weight'] <= 5]
+		nodes, positions, matrix = self.layout(max_nodes=max_nodes, iterations=iterations)
+		edges = matrix.tocoo()
+		segments = np.stack([positions[edges.row], positions[edges.col]], axis=1)
+		large = edges.data > 5
 
-		pos=nx.spring_layout(self.graph) # positions for all nodes
-		#pos=nx.spectral_layout(self.graph)
-		nx.draw_networkx_nodes(self.graph,pos,node_size=node_size)
-		nx.draw_networkx_edges(self.graph,pos,edgelist=elarge,width=edge_width)
-		nx.draw_networkx_edges(self.graph,pos,edgelist=esmall,width=edge_width,alpha=0.5,edge_color='b',style='dashed')
+		if filename: 
+			from matplotlib.figure import Figure
+			from matplotlib.backends.backend_agg import FigureCanvasAgg
+			figure = Figure(figsize=figure_size)
+			FigureCanvasAgg(figure)
+		else: 
+			from matplotlib import pyplot as plt
+			figure = plt.figure(figsize=figure_size)
+		axes = figure.add_subplot(111)
+		axes.set_axis_off()
+		axes.add_collection(LineCollection(segments[large], linewidths=edge_width, colors='k'))
+		axes.add_collection(LineCollection(segments[~large], linewidths=edge_width, colors='b', alpha=0.5, linestyles='dashed'))
+		axes.scatter(positions[:, 0], positions[:, 1], s=node_size, c='r', zorder=2)
+		axes.set_xlim(-0.02, 1.02)
+		axes.set_ylim(-0.02, 1.02)
 
-		plt.show()
+		if filename: 
+			figure.savefig(filename, dpi=dpi)
+		else: 
+			plt.show()
 
-	def page_rank(self): 
+	def export(self, filename): 
+		"""
+		Writes the graph with the cached layout positions for external viewers 
+		(e.g. Gephi). The format is chosen by extension: .gexf or .graphml. 
+		"""
+		graph = self.networkx()
+		extension = os.path.splitext(filename)[1].lower()
+		if extension not in ('.gexf', '.graphml'): 
+			raise ValueError('Unknown graph format %s, use .gexf or .graphml.' % extension)
+		placed = [node for node in graph if node in self.positions]
+		for node in placed: 
+			x, y = self.positions[node]
+			if extension == '.gexf': 
+				graph.nodes[node]['viz'] = {'position': {'x': 1000 * x, 'y': 1000 * y, 'z': 0.0}}
+			else: 
+				graph.nodes[node]['x'] = x
+				graph.nodes[node]['y'] = y
+		try: 
+			if extension == '.gexf': 
+				nx.write_gexf(graph, filename)
+			else: 
+				nx.write_graphml(graph, filename)
+		finally: 
+			for node in placed: 
+				for key in ('viz', 'x', 'y'): 
+					graph.nodes[node].pop(key, None)
+
+	def page_rank(self, seeds=None, alpha=0.85, tol=1.0e-6, max_iter=100, warm_start=True): 
 		"""
 		Returns the page rank of the nodes in the graph
 		"""
-		return nx.pagerank(self.graph)
+		nodes, rank = self.page_rank_vector(seeds=seeds, alpha=alpha, tol=tol, max_iter=max_iter, warm_start=warm_start)
+		return dict(zip(nodes, rank))
+
+	def page_rank_vector(self, seeds=None, alpha=0.85, tol=1.0e-6, max_iter=100, warm_start=True): 
+		"""
+		Computes page rank with sparse power iteration. Returns (nodes, rank array). 
+
+		seeds : list or dict 
+			Personalized page rank: teleport only to these nodes (e.g. the crawl root), 
+			or according to the given {node: weight} dict. 
+
+		warm_start : boolean 
+			Start from the ranks of the previous call, which converges in a few 
+			iterations after incremental graph updates. 
+		"""
+		nodes, matrix = self.adjacency()
+		personalization = None
+		if seeds is not None: 
+			if not isinstance(seeds, dict): 
+				seeds = dict((node, 1.0) for node in seeds)
+			personalization = np.array([seeds.get(node, 0.0) for node in nodes])
+		start = None
+		if warm_start and self.last_rank: 
+			default = 1.0 / max(len(nodes), 1)
+			start = np.array([self.last_rank.get(node, default) for node in nodes])
+
+		rank, _ = page_rank(matrix, alpha=alpha, personalization=personalization, start=start, tol=tol, max_iter=max_iter)
+		self.last_rank = dict(zip(nodes, rank))
+		return nodes, rank
+
+
+	def hits_vector(self, tol=1.0e-8, max_iter=100): 
+		"""
+		Computes HITS with sparse power iteration. Returns (nodes, hubs array, authorities array). 
+		"""
+		nodes, matrix = self.adjacency()
+		hubs, authorities, _ = hits(matrix, tol=tol, max_iter=max_iter)
+		return nodes, hubs, authorities
 
+	def core_number_vector(self): 
+		"""
+		Returns (nodes, core number array) of the k-core decomposition. 
+		"""
+		nodes, matrix = self.adjacency()
+		return nodes, core_number(matrix)
+
+	def path_centrality(self, samples=200, processes=None, seed=32): 
+		"""
+		Approximate betweenness and closeness from breadth first searches of 
+		samples source nodes in a process pool. Returns (nodes, PathCentrality) 
+		with estimates and their errors (1.96 standard errors, see centrality.py). 
+
+		processes : int 
+			Number of processes (default: number of cpus). 
+		"""
+		nodes, matrix = self.adjacency()
+		return nodes, path_centrality(matrix, samples=samples, processes=processes, seed=seed)
+
+	def centrality(self, measure='page_rank', **kwargs): 
+		"""
+		Returns (nodes, values array) of a measure in MEASURES. Keyword arguments 
+		are passed to page_rank_vector, path_centrality or hits_vector. 
+		"""
+		if measure == 'page_rank': 
+			return self.page_rank_vector(**kwargs)
+		if measure in ('betweenness', 'closeness'): 
+			nodes, paths = self.path_centrality(**kwargs)
+			return nodes, getattr(paths, measure)
+		if measure in ('hubs', 'authorities'): 
+			nodes, hubs, authorities = self.hits_vector(**kwargs)
+			return nodes, hubs if measure == 'hubs' else authorities
+		if measure == 'core_number': 
+			return self.core_number_vector()
+		raise ValueError('Unknown measure %s, use one of %s.' % (measure, ', '.join(MEASURES)))
+
+	def weak_components(self): 
+		"""
+		Returns the weakly connected components of the graph as UnionFind. They are 
+		computed on first use and then kept up to date by incremental builds. 
+		"""
+		if self.components is None: 
+			graph = self.networkx()
+			self.components = UnionFind(graph.edges(), graph.nodes())
+		return self.components
 
 	def filter_graph_for_weakly_connected_components(self, min_nodes=2): 
 		"""
@@ -54,13 +360,10 @@ class NetworkGraph(object):
 		min_nodes : int 
 			Return only connected components with a minimal number of min_nodes
 		"""
-		edges = [] 
-		for g in nx.weakly_connected_component_subgraphs(self.graph): 
-			if len(g.nodes(data=True)) >= min_nodes: 
-				for e in g.edges(data=True): 
-					edges.append(e)
-
-		self.graph = nx.DiGraph(edges)
+		components = self.weak_components()
+		small = [node for node in self.graph if components.component_size(node) < min_nodes]
+		self.graph.remove_nodes_from(small)
+		components.remove(small)
 
 	def filter_graph_for_strongly_connected_components(self, min_nodes=2): 
 		"""
@@ -68,25 +371,28 @@ class NetworkGraph(object):
 		min_nodes : int 
 			Return only connected components with a minimal number of min_nodes
 		"""
-		edges = [] 
-		for g in nx.strongly_connected_component_subgraphs(self.graph): 
-			if len(g.nodes(data=True)) >= min_nodes: 
-				for e in g.edges(data=True): 
-					edges.append(e)
-
-		self.graph = nx.DiGraph(edges)
+		nodes, matrix = self.adjacency()
+		labels = component_labels(matrix, connection='strong')
+		small = small_components(labels, min_nodes)
+		# Edges between two kept components are no part of either component. 
+		edges = matrix.tocoo()
+		sources, targets = edges.row, edges.col
+		between = (labels[sources] != labels[targets]) & ~small[sources] & ~small[targets]
+		graph = self.networkx()
+		graph.remove_edges_from((nodes[u], nodes[v]) for u, v in zip(sources[between].tolist(), targets[between].tolist()))
+		graph.remove_nodes_from(nodes[i] for i in np.flatnonzero(small).tolist())
+		self.components = None
 
-	def get_top_nodes(self, n=-1): 
+	def get_top_nodes(self, n=-1, measure='page_rank', **kwargs): 
 		"""
 		Returns a list of the top n nodes in sorted order. 
 		If n=-1 all nodes are returned. 
+
+		measure : String 
+			Centrality measure in MEASURES. Keyword arguments are passed to it (see centrality). 
 		"""
-		pr = self.page_rank()
-		sorted_pr = sorted(pr.items(), key=operator.itemgetter(1), reverse=True)
-		if n == -1: 
-			return sorted_pr
-		else: 
-			return sorted_pr[:n]
+		nodes, rank = self.centrality(measure, **kwargs)
+		return [(nodes[i], rank[i]) for i in top_k(rank, n)]
 	
 if __name__ == '__main__':
 	# Set-up connection to message data_base 
@@ -96,9 +402,14 @@ if __name__ == '__main__':
 	session = DBSession()
 
 	ng = NetworkGraph(db_session=session)
-	ng.build()
+	snapshot = 'data/twitter_stream_graph.snap'
+	if os.path.isfile(snapshot): 
+		ng.load_snapshot(snapshot, refresh=True)
+	else: 
+		ng.build()
+	ng.save_snapshot(snapshot)
 	ng.filter_graph_for_strongly_connected_components(min_nodes=2)
-	ng.draw()
+	ng.draw(filename='data/twitter_stream_graph.png')
 	node_rank = ng.get_top_nodes(n=10)
 	print(node_rank)
 	
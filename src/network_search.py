@@ -3,7 +3,10 @@ __email__ = "fernando at carrillo.at"
 
 import pandas as pd
 import numpy as np 
+import copy
+import math
 from time import time
+from multiprocessing.pool import ThreadPool
 
 from users import Twitter_user
 from twitter_auth import Twitter_auth
@@ -11,9 +14,10 @@ from json_parser import ParseJSON
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.sql import exists
+from sqlalchemy.sql import exists, func
 
-from db_tables import Base, User, Connection, Message, Location, create_sqlite_db
+from db_tables import Base, User, Connection, Message, Location, Frontier, create_sqlite_db
+from bulk_writer import BulkWriter
 
 class Network_search(object):
 	"""
@@ -29,7 +33,11 @@ class Network_search(object):
 		self.root_node = getattr(user_object, 'user_name')
 		self.db_session = db_session
 		self.cur_depth = 0
+		self.writer = BulkWriter(db_session)
 		self.add_user(self.root_node)
+		self.add_to_frontier(self.root_node)
+		# Resume at the lowest depth with pending users. 
+		self.cur_depth = self.get_frontier_depth()
 		
 			
 	def add_user(self, user_name): 
@@ -43,14 +51,53 @@ class Network_search(object):
 			self.db_session.add(new_user)
 			self.db_session.commit()
 
+	def add_to_frontier(self, user_name, weight=0): 
+		"""
+		Adds a stored user as pending to the frontier at the current depth if it is not yet part of it. 
+		"""
+		user = self.get_user(user_name)
+		if not self.db_session.query(exists().where(Frontier.user_id == user.id)).scalar(): 
+			status = Frontier.DONE if user.visited else Frontier.PENDING
+			self.db_session.add(Frontier(user_id=user.id, depth=self.cur_depth, weight=weight, status=status))
+			self.db_session.commit()
+
 	def get_next_user(self): 
 		"""
-		Get the next user who has not been visited. 
+		Get the pending user with the highest discovery weight. 
+		"""
+		users = self.get_pending_users(limit=1)
+		if users: 
+			return users[0][0]
+
+	def get_pending_users(self, depth=None, max_depth=None, limit=None): 
+		"""
+		Returns (user_name, depth) of pending frontier users ordered by decreasing discovery weight. 
+		@param depth Only users of this depth. 
+		@param max_depth Only users up to this depth. 
+		"""
+		query = self.db_session.query(User.name, Frontier.depth).join(Frontier, Frontier.user_id == User.id).filter(Frontier.status == Frontier.PENDING)
+		if depth is not None: 
+			query = query.filter(Frontier.depth == depth)
+		if max_depth is not None: 
+			query = query.filter(Frontier.depth <= max_depth)
+		query = query.order_by(Frontier.weight.desc(), Frontier.user_id)
+		if limit is not None: 
+			query = query.limit(limit)
+		return(query.all())
+
+	def get_frontier_depth(self): 
+		"""
+		Returns the lowest depth of pending users, 0 if there are none. 
 		"""
-		try:
-			return(self.db_session.query(User).filter(User.visited == False).first().name)
-		except Exception, e:
-			return 
+		return(self.db_session.query(func.min(Frontier.depth)).filter(Frontier.status == Frontier.PENDING).scalar() or 0)
+
+	def remaining_budget(self, max_users): 
+		"""
+		Returns how many more users may be visited, None if max_users is None. 
+		"""
+		if max_users is None: 
+			return None
+		return max(0, max_users - self.db_session.query(Frontier).filter(Frontier.status == Frontier.DONE).count())
 
 	def get_user(self, user_name): 
 		"""
@@ -58,11 +105,15 @@ class Network_search(object):
 		"""
 		return(self.db_session.query(User).filter(User.name == user_name).one())
 
-	def get_users_of_current_depth(self):
+	def get_users_of_current_depth(self, unvisited_only=False):
 		"""
 		Returns all the users of all users of the current depth. 
+		@param unvisited_only Return only users which have not been visited yet. 
 		"""
-		return(self.db_session.query(User).filter(User.depth == self.cur_depth).all())
+		query = self.db_session.query(User).filter(User.depth == self.cur_depth)
+		if unvisited_only: 
+			query = query.filter(User.visited == False)
+		return(query.all())
 		
 	def set_user_visited(self, user_name): 
 		"""
@@ -74,90 +125,171 @@ class Network_search(object):
 	def add_connection(self, user_name1, user_name2, weight): 
 		"""
 		Add connection between user 1 and user 2 in CONNECTION relationship. 
+		The weight is added to an already existing connection. 
 		"""
-		new_connection = Connection(user_1_name=user_name1, user_2_name=user_name2, weight=weight )
-		self.db_session.add(new_connection)
-		self.db_session.commit()
+		self.writer.write(connections={(user_name1, user_name2): weight}, depth=self.cur_depth)
 
 	def add_message(self, user_name, text): 
 		"""
 		Add message to MESSAGE relationship. 
 		"""
-		new_message = Message(user_name=user_name, text=text)
-		self.db_session.add(new_message)
-		self.db_session.commit()
+		self.writer.write(messages=[(user_name, text)], depth=self.cur_depth)
 
 	def add_location(self, user_name, geojson, location): 
 		"""
 		Add message to LOCATION relationship. 
 		"""
-		if (geojson == "nan"): geojson = "NULL"
-		if (location == "nan"): location = "NULL"
-		new_location = Location(user_name=user_name, geojson=geojson, location=location)
-		self.db_session.add(new_location)
-		self.db_session.commit()
+		self.writer.write(locations=[(user_name, geojson, location)], depth=self.cur_depth)
 
-	def search_current_depth(self, message_count=100, dump=True, fraction_connections=1.0, verbose=1): 
+	def search_current_depth(self, message_count=100, dump=True, fraction_connections=1.0, max_users=None, max_from_followers=0, verbose=1): 
 		"""
 		@param: message_count Number of messages to retrieve
 		@param: dump Dump user object to file (either pickled or JSON (twitter) )
 		@param: fraction_connections Fraction of connection to follow. If connections are weighted, take the top 
 					fraction of connections. 
+		@param: max_users Stop once this many users of the frontier are done. 
 
 		1. Download and dump messages
-		2. Get nodes and add to users and connection tables. 
+		2. Get nodes and add to users, connection and frontier tables. 
 		3. Get location and add to location table. 
+		Every user is stored in a single transaction, so an interrupted search resumes at the next pending user. 
 		"""
-
-		users = self.get_users_of_current_depth()
+		users = [name for name, _ in self.get_pending_users(depth=self.cur_depth, limit=self.remaining_budget(max_users))]
 		if verbose > 0: 
 			print('Iterating through %d users at current depth %d' % (len(users), self.cur_depth))
 		self.cur_depth += 1
-		for user in users: # Iterate through all users of the current depth. 
-			if not user.visited:
-				u1 = user.name
+		for u1 in users: # Iterate through all pending users of the current depth. 
+			if verbose > 1: 
+				print(u1)
+			self.store(self.fetch_user(u1, message_count=message_count, dump=dump, fraction_connections=fraction_connections, max_from_followers=max_from_followers), depth=self.cur_depth)
+
+	def fetch_user(self, user_name, message_count=100, dump=True, fraction_connections=1.0, max_from_followers=0): 
+		"""
+		Downloads messages, connections and locations of a single user. 
+		Runs in a worker thread and therefore does not touch the database. 
+		Returns (user_name, messages as (text, tweet_id, created_at), connections, locations, twitter_ids). 
+
+		@param: max_from_followers Also connect to up to this many followers, resolved to screen names in batches. 
+		"""
+		user_object = copy.copy(self.user_object)
+		setattr(user_object, 'user_name', user_name)
+		user_object.load(message_count)
+		if (dump): user_object.dump('data/' + user_name + '.json')
+
+		# Follow the top fraction of the connections. 
+		if max_from_followers > 0: 
+			nodes = user_object.get_nodes(max_from_followers=max_from_followers, user_id_to_screen_name=True).most_common()
+		else: 
+			nodes = user_object.get_nodes().most_common()
+		connections = {}
+		for name, weight in nodes[:int(math.ceil(fraction_connections * len(nodes)))]: 
+			key = (user_name, name.strip('\@'))
+			connections[key] = connections.get(key, 0) + weight
+
+		locations = user_object.get_locations()
+		locations = [(user_name, str(locations['geojson'][i]), locations['location'][i]) for i in locations.index]
+		if hasattr(user_object, 'get_message_records'): 
+			messages = user_object.get_message_records()
+		else: 
+			messages = [(text, ) for text in user_object.get_messages()]
+		twitter_ids = user_object.get_user_ids() if hasattr(user_object, 'get_user_ids') else {}
+		return user_name, messages, connections, locations, twitter_ids
+
+	def store(self, result, depth): 
+		"""
+		Stores the result of fetch_user in one transaction: the user is marked visited and done, 
+		connected users are added to the frontier at depth. 
+		"""
+		u1, messages, connections, locations, twitter_ids = result
+		self.writer.write(users=[u2 for _, u2 in connections], messages=[(u1, ) + tuple(message) for message in messages], 
+			locations=locations, connections=connections, depth=depth, visited=[u1], frontier=depth, twitter_ids=twitter_ids)
+
+	def search_current_depth_concurrent(self, message_count=100, dump=True, fraction_connections=1.0, workers=8, max_users=None, max_from_followers=0, verbose=1): 
+		"""
+		Same as search_current_depth, but all users of the current depth are fetched 
+		by a pool of worker threads. The calling thread is the only database writer 
+		and stores the results of every user in a single transaction. 
+
+		@param: workers Number of concurrent API requests. Rate limits and retries 
+					are handled by the api of the user object (see rate_limit.RateLimitedAPI). 
+		"""
+		users = [name for name, _ in self.get_pending_users(depth=self.cur_depth, limit=self.remaining_budget(max_users))]
+		if verbose > 0: 
+			print('Fetching %d users at current depth %d with %d workers' % (len(users), self.cur_depth, workers))
+		self.cur_depth += 1
+
+		def fetch(user_name): 
+			return self.fetch_user(user_name, message_count=message_count, dump=dump, fraction_connections=fraction_connections, max_from_followers=max_from_followers)
+
+		pool = ThreadPool(workers)
+		try: 
+			for result in pool.imap_unordered(fetch, users): 
 				if verbose > 1: 
-					print(u1)
-				setattr(self.user_object, 'user_name', u1)
-				#user = Twitter_user(u1, Twitter_auth().authenticate())
-				self.user_object.load(message_count)
-				if (dump): self.user_object.dump('data/' + u1 + '.json')
+					print(result[0])
+				self.store(result, depth=self.cur_depth)
+		finally: 
+			pool.close()
+			pool.join()
 
-				messages = self.user_object.get_messages()
-				for text in messages: 
-					self.add_message(u1, text)
+	def search_best_first(self, message_count=100, dump=True, fraction_connections=1.0, max_users=100, max_depth=None, workers=1, max_from_followers=0, verbose=1): 
+		"""
+		Expands the pending users with the highest discovery weight first until max_users 
+		users are done or the frontier is empty. Weights are updated after every user, 
+		so the search follows the strongest connections of the network found so far. 
 
-				nodes = self.user_object.get_nodes()
-				user_count = 1
-				for name, weight in nodes.iteritems(): 
-					if (user_count <= fraction_connections * message_count): 
-						u2 = name.strip('\@')
-						self.add_user(user_name=u2)
-						self.add_connection(user_name1=u1, user_name2=u2, weight=weight)
-						user_count += 1 
+		@param: max_depth Do not expand users deeper than max_depth (no limit if None). 
+		@param: workers Number of users fetched concurrently. 
+		"""
+		if verbose > 0: 
+			print('Best-first search of up to %s users with %d workers' % ('unlimited' if max_users is None else max_users, workers))
 
-				locations = self.user_object.get_locations()
-				for i in locations.index: 
-					g = str(locations['geojson'][i])
-					l = (locations['location'][i])
-					self.add_location(user_name=u1, geojson=g, location=l)
+		def fetch(user): 
+			return self.fetch_user(user[0], message_count=message_count, dump=dump, fraction_connections=fraction_connections, max_from_followers=max_from_followers), user[1]
 
-				self.set_user_visited(user_name=u1)
+		pool = ThreadPool(workers)
+		try: 
+			while True: 
+				budget = self.remaining_budget(max_users)
+				limit = workers if budget is None else min(workers, budget)
+				users = self.get_pending_users(max_depth=max_depth, limit=limit) if limit > 0 else []
+				if not users: 
+					break
+				for result, depth in pool.imap_unordered(fetch, users): 
+					if verbose > 1: 
+						print('%s (depth %d)' % (result[0], depth))
+					self.store(result, depth=depth + 1)
+		finally: 
+			pool.close()
+			pool.join()
 
-	def run(self, message_count=100, dump=True, fraction_connections=0.2, max_depth=1, verbose=1): 
+	def run(self, message_count=100, dump=True, fraction_connections=0.2, max_depth=1, workers=1, strategy='breadth_first', max_users=None, max_from_followers=0, verbose=1): 
 		"""
-		Run the network search. 
+		Run the network search. Resumes an interrupted search stored in the database. 
+
+		@param: workers Fetch users of a depth with this many concurrent workers if > 1. 
+		@param: strategy 'breadth_first' (depth by depth) or 'best_first' (highest discovery weight first). 
+		@param: max_users Global budget of users to visit, including users visited by earlier runs. 
+		@param: max_from_followers Also follow up to this many followers per user (costs a followers_ids call and one lookup call per 100 followers). 
 		"""
 		t0 = time() 
 		if verbose > 0: 
 			print('Network search started.')
 		
 		self.max_depth = max_depth
-		while self.cur_depth <= self.max_depth: 
-			self.search_current_depth(message_count=message_count, dump=dump, fraction_connections=fraction_connections, verbose=verbose)
+		if strategy == 'best_first': 
+			self.search_best_first(message_count=message_count, dump=dump, fraction_connections=fraction_connections, max_users=max_users, max_from_followers=max_from_followers, max_depth=max_depth, workers=workers, verbose=verbose)
+		else: 
+			while self.cur_depth <= self.max_depth and self.remaining_budget(max_users) != 0: 
+				if workers > 1: 
+					self.search_current_depth_concurrent(message_count=message_count, dump=dump, fraction_connections=fraction_connections, workers=workers, max_users=max_users, max_from_followers=max_from_followers, verbose=verbose)
+				else: 
+					self.search_current_depth(message_count=message_count, dump=dump, fraction_connections=fraction_connections, max_users=max_users, max_from_followers=max_from_followers, verbose=verbose)
 		
 		if verbose > 0: 
-			print('Collected %d tweets from %d users in %fm' % (len(self.db_session.query(Message).all()), len(self.db_session.query(User).all()), (time()-t0)/60))
+			print('Collected %d tweets from %d users in %fm' % (self.db_session.query(Message).count(), self.db_session.query(User).count(), (time()-t0)/60))
+			for cache in [getattr(self.user_object, 'cache', None), getattr(self.user_object, 'id_cache', None)]: 
+				if cache is not None: 
+					print(cache.summary())
 		
 if __name__ == '__main__':
 
@@ -177,4 +309,11 @@ if __name__ == '__main__':
 	search = Network_search(user_object=user, db_session=session)
 	search.run(message_count=1000, dump=False, fraction_connections=0.02, max_depth=3, verbose=2) # Get the top 2% connection of the last 1000 messages. 
 
+	# Concurrent search. Calls are rate limited and retried by RateLimitedAPI. 
+	# Replace tweepy.API(auth) by FakeTwitterAPI(latency=0.1) to run offline. 
+	#auth = Twitter_auth().authenticate()
+	#user = Twitter_user(source_node_name, auth, api=RateLimitedAPI(tweepy.API(auth)), cache=ResponseCache('data/api_cache.db'))
+	#search = Network_search(user_object=user, db_session=session)
+	#search.run(message_count=1000, dump=False, fraction_connections=0.02, max_depth=3, workers=8, verbose=2)
+
 
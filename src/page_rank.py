@@ -0,0 +1,85 @@
+__author__ = "Fernando Carrillo"
+__email__ = "fernando at carrillo.at"
+
+import numpy as np
+import scipy.sparse as sparse
+
+def adjacency_matrix(graph, nodes=None, weight='weight'):
+	"""
+	Returns (nodes, matrix) where matrix is the weighted adjacency matrix of
+	graph in CSR format. Row i holds the out edges of nodes[i].
+	"""
+	if nodes is None:
+		nodes = list(graph.nodes())
+	index = dict((node, i) for i, node in enumerate(nodes))
+	n_edges = graph.number_of_edges()
+	rows = np.empty(n_edges, dtype=np.int64)
+	cols = np.empty(n_edges, dtype=np.int64)
+	weights = np.empty(n_edges, dtype=np.float64)
+	for i, (u, v, d) in enumerate(graph.edges(data=True)):
+		rows[i] = index[u]
+		cols[i] = index[v]
+		weights[i] = d.get(weight, 1)
+	matrix = sparse.csr_matrix((weights, (rows, cols)), shape=(len(nodes), len(nodes)))
+	return nodes, matrix
+
+def page_rank(matrix, alpha=0.85, personalization=None, start=None, tol=1.0e-6, max_iter=100):
+	"""
+	Vectorized power iteration on a weighted adjacency matrix.
+	Returns the rank vector and the number of iterations.
+
+	Parameters
+	----------
+	matrix : scipy.sparse matrix
+		Weighted adjacency matrix (rows are sources).
+
+	alpha : float
+		Damping factor.
+
+	personalization : array
+		Teleport distribution, e.g. non-zero only for a seed set. Uniform if None.
+		Dangling nodes jump according to it as well.
+
+	start : array
+		Initial rank vector, e.g. the ranks before the last graph update.
+
+	tol : float
+		Convergence threshold of the L1 change per node (as in networkx).
+	"""
+	n = matrix.shape[0]
+	if n == 0:
+		return np.zeros(0), 0
+
+	out_weight = np.asarray(matrix.sum(axis=1)).ravel()
+	dangling = out_weight == 0
+	scale = np.zeros(n)
+	scale[~dangling] = 1.0 / out_weight[~dangling]
+	# Transition matrix transposed, so one iteration is a single sparse product.
+	transition = sparse.csr_matrix(sparse.diags(scale).dot(matrix).T)
+
+	p = _distribution(personalization, n)
+	x = _distribution(start, n) if start is not None else p.copy()
+
+	for i in range(1, max_iter + 1):
+		x_last = x
+		x = alpha * (transition.dot(x_last) + x_last[dangling].sum() * p) + (1 - alpha) * p
+		if np.abs(x - x_last).sum() < n * tol:
+			return x, i
+	raise RuntimeError('Page rank did not converge in %d iterations.' % max_iter)
+
+def top_k(values, k):
+	"""
+	Returns the indices of the k largest values in descending order.
+	Uses a partial selection, so only the k selected values are sorted.
+	"""
+	if k < 0 or k >= len(values):
+		return np.argsort(-values, kind='mergesort')
+	candidates = np.argpartition(-values, k)[:k]
+	return candidates[np.argsort(-values[candidates], kind='mergesort')]
+
+def _distribution(vector, n):
+	vector = np.asarray(vector, dtype=np.float64) if vector is not None else np.ones(n)
+	total = vector.sum()
+	if total <= 0:
+		raise ValueError('Distribution needs a positive sum.')
+	return vector / total
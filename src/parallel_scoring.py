@@ -0,0 +1,60 @@
+__author__ = "Fernando Carrillo"
+__email__ = "fernando at carrillo.at"
+
+import numpy as np
+from multiprocessing import Pool, cpu_count
+
+from message_classifier import MessageClassifier
+
+# Classifier of a worker process, set once by the pool initializer.
+_classifier = None
+
+def _init_worker(filename, classifier):
+	global _classifier
+	if filename is not None:
+		_classifier = MessageClassifier()
+		_classifier.load(filename, compact=True)
+	else:
+		_classifier = classifier
+
+def _predict_proba(texts):
+	return _classifier.predict_proba(texts)
+
+class ParallelScorer(object):
+	"""
+	Scores texts with a pool of classifier processes. Every process loads the
+	model once at start-up: classifiers loaded from a file are reloaded from it
+	(memory-mapped if a compact model was exported, so all processes share
+	one copy), other classifiers are pickled to the processes once.
+	Batches are split into shards and the probabilities are returned in input order.
+	"""
+	def __init__(self, classifier, processes=None, min_shard_size=500):
+		"""
+		classifier : MessageClassifier
+			Trained or loaded classifier.
+
+		processes : int
+			Number of scoring processes (default: number of cpus).
+
+		min_shard_size : int
+			Smaller batches are scored in the calling process.
+		"""
+		self.classifier = classifier
+		self.labels = classifier.labels
+		self.processes = processes or cpu_count()
+		self.min_shard_size = min_shard_size
+		filename = getattr(classifier, 'filename', None)
+		self.pool = Pool(self.processes, initializer=_init_worker, initargs=(filename, None if filename else classifier))
+
+	def predict_proba(self, texts):
+		texts = list(texts)
+		n_shards = min(self.processes, len(texts) // self.min_shard_size)
+		if n_shards < 2:
+			return self.classifier.predict_proba(texts)
+		bounds = np.linspace(0, len(texts), n_shards + 1).astype(int)
+		shards = [texts[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+		return np.vstack(self.pool.map(_predict_proba, shards))
+
+	def close(self):
+		self.pool.close()
+		self.pool.join()
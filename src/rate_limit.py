@@ -0,0 +1,139 @@
+__author__ = "Fernando Carrillo"
+__email__ = "fernando at carrillo.at"
+
+import random
+import threading
+from time import time, sleep
+from collections import deque, defaultdict
+
+# Requests per window (calls, seconds) of the twitter REST API (user auth).
+TWITTER_RATE_LIMITS = {
+	'user_timeline': (900, 15 * 60),
+	'followers_ids': (15, 15 * 60),
+	'get_user': (900, 15 * 60),
+	'lookup_users': (900, 15 * 60),
+}
+
+# HTTP status codes which are not worth retrying (protected, suspended or unknown users).
+NO_RETRY_STATUS = (401, 403, 404)
+
+def is_rate_limit_error(e):
+	"""
+	True if the exception signals an exhausted rate-limit window.
+	"""
+	response = getattr(e, 'response', None)
+	return getattr(response, 'status_code', None) == 429 or getattr(e, 'api_code', None) == 88
+
+class RateLimiter(object):
+	"""
+	Thread-safe sliding window rate limiter with one window per endpoint.
+	"""
+	def __init__(self, limits=TWITTER_RATE_LIMITS, clock=time, sleep=sleep):
+		"""
+		limits : dict {endpoint: (calls, seconds)}
+			Endpoints missing in limits are not limited.
+
+		clock, sleep : functions
+			Time source and sleep function. Replace for offline tests.
+		"""
+		self.limits = dict(limits)
+		self.clock = clock
+		self.sleep = sleep
+		self.calls = defaultdict(deque)
+		self.blocked_until = defaultdict(float)
+		self.waited = 0.0
+		self.lock = threading.Lock()
+
+	def acquire(self, endpoint):
+		"""
+		Blocks until a call to endpoint is allowed and registers the call.
+		"""
+		while True:
+			with self.lock:
+				wait = self._wait_time(endpoint)
+				if wait <= 0:
+					self.calls[endpoint].append(self.clock())
+					return
+				self.waited += wait
+			self.sleep(wait)
+
+	def pause(self, endpoint, seconds=None):
+		"""
+		Blocks endpoint for seconds (default: its full window), e.g. after a 429 response.
+		"""
+		if seconds is None:
+			seconds = self.limits.get(endpoint, (0, 60))[1]
+		with self.lock:
+			self.blocked_until[endpoint] = max(self.blocked_until[endpoint], self.clock() + seconds)
+
+	def _wait_time(self, endpoint):
+		now = self.clock()
+		wait = self.blocked_until[endpoint] - now
+		if endpoint not in self.limits:
+			return wait
+		max_calls, period = self.limits[endpoint]
+		window = self.calls[endpoint]
+		while window and window[0] <= now - period:
+			window.popleft()
+		if len(window) >= max_calls:
+			wait = max(wait, window[0] + period - now)
+		return wait
+
+class RateLimitedAPI(object):
+	"""
+	Wraps a tweepy.API (or a fake with the same methods). Every call of an endpoint
+	waits for its rate-limit window and is retried with exponential backoff.
+	"""
+	def __init__(self, api, limiter=None, max_retries=5, backoff=1.0, max_backoff=60.0):
+		"""
+		api : tweepy.API
+			API object performing the calls.
+
+		limiter : RateLimiter
+			Shared limiter. A new one with the twitter limits is created if None.
+
+		max_retries : int
+			Retries of a failed call before the exception is raised.
+
+		backoff : float
+			Seconds to wait before the first retry. Doubles on every retry.
+		"""
+		self.api = api
+		self.limiter = limiter if limiter is not None else RateLimiter()
+		self.max_retries = max_retries
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.retries = 0
+
+	def __getattr__(self, name):
+		method = getattr(self.api, name)
+		if not callable(method):
+			return method
+
+		def call(*args, **kwargs):
+			return self.call(name, method, *args, **kwargs)
+		# tweepy.Cursor needs to know how the wrapped method paginates.
+		if hasattr(method, 'pagination_mode'):
+			call.pagination_mode = method.pagination_mode
+		return call
+
+	def call(self, endpoint, method, *args, **kwargs):
+		"""
+		Calls method with rate limiting and retries.
+		"""
+		attempt = 0
+		while True:
+			self.limiter.acquire(endpoint)
+			try:
+				return method(*args, **kwargs)
+			except Exception, e:
+				status = getattr(getattr(e, 'response', None), 'status_code', None)
+				if status in NO_RETRY_STATUS or attempt >= self.max_retries:
+					raise
+				if is_rate_limit_error(e):
+					self.limiter.pause(endpoint)
+				else:
+					delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+					self.limiter.sleep(delay * (0.5 + random.random() / 2))
+				attempt += 1
+				self.retries += 1
@@ -0,0 +1,160 @@
+__author__ = "Fernando Carrillo"
+__email__ = "fernando at carrillo.at"
+
+import json
+import zlib
+import sqlite3
+import threading
+from time import time
+from collections import namedtuple
+
+# Seconds until a cached response of an endpoint is stale.
+DEFAULT_TTL = {
+	'user_timeline': 24 * 60 * 60,
+	'followers_ids': 7 * 24 * 60 * 60,
+	'get_user': 30 * 24 * 60 * 60,
+}
+
+CacheEntry = namedtuple('CacheEntry', ['value', 'since_id', 'fresh'])
+
+class ResponseCache(object):
+	"""
+	On-disk cache of twitter API responses in a sqlite file, keyed by endpoint and
+	screen name. Entries older than the TTL of their endpoint are stale: they are
+	still returned, so the caller can fetch only what is newer than since_id.
+	The least recently used entries are evicted once the compressed responses
+	exceed max_bytes. Thread-safe.
+	"""
+	def __init__(self, path='data/api_cache.db', ttl=DEFAULT_TTL, max_bytes=1024 ** 3, clock=time):
+		"""
+		path : String
+			sqlite file of the cache.
+
+		ttl : dict {endpoint: seconds}
+			Endpoints missing in ttl never become stale.
+
+		max_bytes : int
+			Bound of the total size of the compressed responses.
+		"""
+		self.path = path
+		self.ttl = dict(ttl)
+		self.max_bytes = max_bytes
+		self.clock = clock
+		self.hits = 0
+		self.misses = 0
+		self.stale = 0
+		self.evicted = 0
+		self.lock = threading.Lock()
+		self.conn = sqlite3.connect(path, check_same_thread=False)
+		self.conn.execute('CREATE TABLE IF NOT EXISTS response (endpoint TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, '
+			'since_id INTEGER, fetched REAL NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (endpoint, key))')
+		self.conn.execute('CREATE INDEX IF NOT EXISTS ix_response_accessed ON response (accessed)')
+		self.conn.commit()
+		self.size = self.conn.execute('SELECT COALESCE(SUM(LENGTH(value)), 0) FROM response').fetchone()[0]
+
+	def get(self, endpoint, key):
+		"""
+		Returns a CacheEntry (value, since_id, fresh) or None.
+		"""
+		with self.lock:
+			row = self.conn.execute('SELECT value, since_id, fetched FROM response WHERE endpoint = ? AND key = ?', (endpoint, key)).fetchone()
+			if row is None:
+				self.misses += 1
+				return None
+			now = self.clock()
+			self.conn.execute('UPDATE response SET accessed = ? WHERE endpoint = ? AND key = ?', (now, endpoint, key))
+			self.conn.commit()
+			value, since_id, fetched = row
+			fresh = endpoint not in self.ttl or now - fetched < self.ttl[endpoint]
+			if fresh:
+				self.hits += 1
+			else:
+				self.stale += 1
+			return CacheEntry(json.loads(zlib.decompress(value)), since_id, fresh)
+
+	def put(self, endpoint, key, value, since_id=None):
+		"""
+		Stores a JSON serializable response and evicts old entries if needed.
+		"""
+		blob = sqlite3.Binary(zlib.compress(json.dumps(value)))
+		with self.lock:
+			now = self.clock()
+			old = self.conn.execute('SELECT LENGTH(value) FROM response WHERE endpoint = ? AND key = ?', (endpoint, key)).fetchone()
+			self.conn.execute('INSERT OR REPLACE INTO response VALUES (?, ?, ?, ?, ?, ?)', (endpoint, key, blob, since_id, now, now))
+			self.size += len(blob) - (old[0] if old else 0)
+			if self.size > self.max_bytes:
+				self._evict()
+			self.conn.commit()
+
+	def _evict(self):
+		"""
+		Deletes least recently used entries until the cache is below 90% of max_bytes.
+		"""
+		rows = self.conn.execute('SELECT endpoint, key, LENGTH(value) FROM response ORDER BY accessed')
+		target = 0.9 * self.max_bytes
+		victims = []
+		for endpoint, key, size in rows:
+			if self.size <= target:
+				break
+			victims.append((endpoint, key))
+			self.size -= size
+		self.conn.executemany('DELETE FROM response WHERE endpoint = ? AND key = ?', victims)
+		self.evicted += len(victims)
+
+	def clear(self):
+		with self.lock:
+			self.conn.execute('DELETE FROM response')
+			self.conn.commit()
+			self.size = 0
+
+	def summary(self):
+		return 'API cache: %d hits, %d stale, %d misses, %d evicted, %.1f MB.' % (self.hits, self.stale, self.misses, self.evicted, self.size / 1024. ** 2)
+
+	def close(self):
+		with self.lock:
+			self.conn.close()
+
+class UserIdCache(object):
+	"""
+	Persistent mapping between twitter user ids and screen names in a sqlite file,
+	shared by all users and crawls. Thread-safe.
+	"""
+	def __init__(self, path='data/user_ids.db'):
+		self.path = path
+		self.hits = 0
+		self.misses = 0
+		self.lock = threading.Lock()
+		self.conn = sqlite3.connect(path, check_same_thread=False)
+		self.conn.execute('CREATE TABLE IF NOT EXISTS user_id (id INTEGER NOT NULL PRIMARY KEY, screen_name TEXT NOT NULL, fetched REAL NOT NULL)')
+		self.conn.execute('CREATE INDEX IF NOT EXISTS ix_user_id_screen_name ON user_id (screen_name)')
+		self.conn.commit()
+
+	def get_names(self, ids):
+		"""
+		Returns {id: screen name} of the cached ids.
+		"""
+		ids = list(set(ids))
+		names = {}
+		with self.lock:
+			for i in range(0, len(ids), 500):
+				chunk = ids[i:i + 500]
+				names.update(self.conn.execute('SELECT id, screen_name FROM user_id WHERE id IN (%s)' % ','.join('?' * len(chunk)), chunk))
+			self.hits += len(names)
+			self.misses += len(ids) - len(names)
+		return names
+
+	def put(self, names):
+		"""
+		Stores a dict {id: screen name}. Renamed users are overwritten.
+		"""
+		now = time()
+		with self.lock:
+			self.conn.executemany('INSERT OR REPLACE INTO user_id VALUES (?, ?, ?)', ((id_, name, now) for id_, name in names.items()))
+			self.conn.commit()
+
+	def summary(self):
+		return 'User id cache: %d hits, %d misses.' % (self.hits, self.misses)
+
+	def close(self):
+		with self.lock:
+			self.conn.close()
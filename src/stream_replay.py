@@ -0,0 +1,128 @@
+__author__ = "Fernando Carrillo"
+__email__ = "fernando at carrillo.at"
+
+import json
+import argparse
+from time import time, sleep
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from db_tables import Base, create_sqlite_db
+from json_parser import open_data
+from message_classifier import MessageClassifier
+from twitter_stream_classifier import TwitterStreamClassifier
+
+class ReplayStream(object):
+	"""
+	Feeds recorded stream data (JSON lines, including delete notices) into the
+	on_data method of a StreamListener, as tweepy.Stream does for the live stream.
+	"""
+	def __init__(self, listener, path, rate=None, sample_every=100, verbose=1):
+		"""
+		listener : StreamListener
+			E.g. a TwitterStreamClassifier.
+
+		path : String
+			Plain or gzip compressed JSON lines file.
+
+		rate : float
+			Target tweets per second. Replays as fast as possible if None.
+
+		sample_every : int
+			Sample the queue depth of a pipelined listener every sample_every tweets.
+		"""
+		self.listener = listener
+		self.path = path
+		self.rate = rate
+		self.sample_every = sample_every
+		self.verbose = verbose
+
+	def run(self):
+		"""
+		Replays the file, drains the listener and returns a report dict.
+		"""
+		queue = getattr(self.listener, 'queue', None)
+		depths = []
+		tweets = 0
+		t0 = time()
+		with open_data(self.path) as data:
+			for line in data:
+				if not line.strip():
+					continue
+				if self.rate:
+					# Wait for the scheduled time of this tweet.
+					delay = t0 + tweets / float(self.rate) - time()
+					if delay > 0:
+						sleep(delay)
+				self.listener.on_data(line)
+				tweets += 1
+				if queue is not None and tweets % self.sample_every == 0:
+					depths.append(queue.qsize())
+		intake = time() - t0
+		if hasattr(self.listener, 'close'):
+			self.listener.close()
+		duration = time() - t0
+
+		report = {
+			'tweets': tweets,
+			'intake_seconds': intake,
+			'intake_rate': tweets / max(intake, 1e-9),
+			'seconds': duration,
+			'throughput': tweets / max(duration, 1e-9),
+		}
+		if queue is not None:
+			report['queue_depth_mean'] = sum(depths) / float(max(len(depths), 1))
+			report['queue_depth_max'] = queue.max_depth
+			report['dropped'] = queue.dropped
+			report['spilled'] = queue.spilled
+		if hasattr(self.listener, 'latency'):
+			report['latency'] = self.listener.latency.summary()
+		if hasattr(self.listener, 'failed_tweets'):
+			report['failed_tweets'] = self.listener.failed_tweets
+		if self.verbose > 0:
+			self.print_report(report)
+		return report
+
+	def print_report(self, report):
+		print('Replayed %d tweets in %fs: %.0f tweets/s sustained (intake %.0f tweets/s).' % (report['tweets'], report['seconds'], report['throughput'], report['intake_rate']))
+		if 'queue_depth_max' in report:
+			print('Queue depth mean %.0f, max %d. Dropped %d, spilled %d tweets.' % (report['queue_depth_mean'], report['queue_depth_max'], report['dropped'], report['spilled']))
+		if 'latency' in report:
+			latency = report['latency']
+			print('End-to-end latency: mean %fs, p50 %fs, p95 %fs, p99 %fs, max %fs.' % (latency['mean'], latency['p50'], latency['p95'], latency['p99'], latency['max']))
+		if report.get('failed_tweets'):
+			print('Failed to classify or persist %d tweets.' % report['failed_tweets'])
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Replays recorded stream data through the TwitterStreamClassifier.')
+	parser.add_argument('path', help='JSON lines file of the raw stream (plain or gzip)')
+	parser.add_argument('--model', default='data/tweet_clf_nb', help='model file name prefix')
+	parser.add_argument('--db', default='sqlite:///data/twitter_replay.db')
+	parser.add_argument('--classes', nargs='+', default=['sci.med'])
+	parser.add_argument('--threshold', type=float, default=0.9)
+	parser.add_argument('--rate', type=float, default=None, help='tweets per second (default: as fast as possible)')
+	parser.add_argument('--batch-size', type=int, default=10000)
+	parser.add_argument('--pipelined', action='store_true')
+	parser.add_argument('--workers', type=int, default=1)
+	parser.add_argument('--scoring-processes', type=int, default=1, help='classifier processes per batch')
+	parser.add_argument('--queue-size', type=int, default=100000)
+	parser.add_argument('--backpressure', default='block', choices=['block', 'drop_oldest', 'spill'])
+	parser.add_argument('--report', default=None, help='write the report as JSON to this file')
+	args = parser.parse_args()
+
+	mc = MessageClassifier()
+	mc.load(args.model, compact=True)
+
+	create_sqlite_db(args.db)
+	engine = create_engine(args.db)
+	Base.metadata.bind = engine
+	session = sessionmaker(bind=engine)()
+
+	listener = TwitterStreamClassifier(db_session=session, classifier=mc, classes_of_interest=args.classes, probability_threshold=args.threshold,
+		batch_size=args.batch_size, verbose=0, pipelined=args.pipelined, workers=args.workers, queue_size=args.queue_size, backpressure=args.backpressure,
+		scoring_processes=args.scoring_processes)
+	report = ReplayStream(listener, args.path, rate=args.rate).run()
+	if args.report:
+		with open(args.report, 'w') as f:
+			json.dump(report, f, indent=2)
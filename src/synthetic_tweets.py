@@ -0,0 +1,122 @@
+__author__ = "Fernando Carrillo"
+__email__ = "fernando at carrillo.at"
+
+import json
+import numpy as np
+from datetime import datetime, timedelta
+
+from json_parser import TWITTER_TIME_FORMAT
+
+class SyntheticTweets(object):
+	"""
+	Generates tweets and user graphs with the statistics of real stream data:
+	mentions follow a power law over users, most tweets mention nobody, a few
+	tweets carry coordinates and text lengths vary up to 140 characters.
+	"""
+	def __init__(self, n_users=10000, n_words=20000, labels=('sci.med', 'sci.space', 'rec.autos'), mention_exponent=1.2,
+		mean_mentions=0.6, geo_fraction=0.02, retweet_fraction=0.3, seed=32):
+		"""
+		n_users : int
+			Size of the user population, screen names are user0 ... user<n_users-1>.
+
+		n_words : int
+			Vocabulary size. Word frequencies follow Zipf's law, every label prefers its own words.
+
+		mention_exponent : float
+			Exponent of the power law of how often a user is mentioned.
+
+		mean_mentions : float
+			Mean number of mentions per tweet (Poisson distributed).
+		"""
+		self.rand = np.random.RandomState(seed)
+		self.n_users = n_users
+		self.labels = list(labels)
+		self.mean_mentions = mean_mentions
+		self.geo_fraction = geo_fraction
+		self.retweet_fraction = retweet_fraction
+		self.words = np.array(['word%d' % i for i in range(n_words)])
+		self.user_popularity = self._power_law(n_users, mention_exponent)
+		# Every label draws from a differently shuffled Zipf distribution.
+		zipf = self._power_law(n_words, 1.0)
+		self.word_distributions = [zipf[self.rand.permutation(n_words)] for _ in self.labels]
+		self.next_id = 10 ** 17
+		self.start = datetime(2017, 1, 1)
+
+	def _power_law(self, n, exponent):
+		p = 1.0 / np.arange(1, n + 1) ** exponent
+		return p / p.sum()
+
+	def text(self, label=None):
+		"""
+		Returns (text, label index). The label is chosen at random if None.
+		"""
+		if label is None:
+			label = self.rand.randint(len(self.labels))
+		n_words = min(int(self.rand.lognormal(2.3, 0.5)) + 1, 25)
+		return ' '.join(self.rand.choice(self.words, n_words, p=self.word_distributions[label])), label
+
+	def labelled(self, n):
+		"""
+		Returns (texts, label indices) for n tweets.
+		"""
+		texts, labels = zip(*[self.text() for _ in range(n)])
+		return list(texts), np.array(labels)
+
+	def user(self, i):
+		return {'id': i + 1, 'id_str': str(i + 1), 'screen_name': 'user%d' % i, 'location': 'City %d' % (i % 500) if i % 3 else ''}
+
+	def tweet(self, retweet=True):
+		"""
+		Returns a tweet as dict in the format of the twitter API.
+		"""
+		self.next_id += 1
+		author = self.rand.randint(self.n_users)
+		mentioned = self.rand.choice(self.n_users, self.rand.poisson(self.mean_mentions), p=self.user_popularity)
+		text, _ = self.text()
+		text = ' '.join(['@user%d' % m for m in mentioned] + [text])[:140]
+		coordinates = None
+		if self.rand.rand() < self.geo_fraction:
+			coordinates = {'type': 'Point', 'coordinates': [self.rand.uniform(-180, 180), self.rand.uniform(-90, 90)]}
+		tweet = {
+			'id': self.next_id,
+			'id_str': str(self.next_id),
+			'created_at': (self.start + timedelta(seconds=self.next_id - 10 ** 17)).strftime(TWITTER_TIME_FORMAT),
+			'text': text,
+			'user': self.user(author),
+			'coordinates': coordinates,
+			'entities': {'user_mentions': [{'screen_name': 'user%d' % m, 'id': int(m) + 1} for m in mentioned], 'hashtags': [], 'urls': []},
+		}
+		if retweet and self.rand.rand() < self.retweet_fraction:
+			original = self.tweet(retweet=False)
+			tweet['retweeted_status'] = original
+			tweet['text'] = ('RT @%s: %s' % (original['user']['screen_name'], original['text']))[:140]
+			tweet['entities']['user_mentions'].insert(0, {'screen_name': original['user']['screen_name'], 'id': original['user']['id']})
+		return tweet
+
+	def tweets(self, n):
+		return [self.tweet() for _ in range(n)]
+
+	def write(self, path, n, delete_fraction=0.01):
+		"""
+		Writes n raw stream lines to path, including delete notices.
+		"""
+		with open(path, 'w') as f:
+			for _ in range(n):
+				if self.rand.rand() < delete_fraction:
+					f.write(json.dumps({'delete': {'status': {'id': self.rand.randint(10 ** 17, self.next_id + 1), 'user_id': 1}}}))
+				else:
+					f.write(json.dumps(self.tweet()))
+				f.write('\r\n')
+
+	def edges(self, n):
+		"""
+		Returns a dict {(user_name1, user_name2): weight} of about n mention edges.
+		Sources are uniform, targets follow the mention power law.
+		"""
+		sources = self.rand.randint(self.n_users, size=n)
+		targets = self.rand.choice(self.n_users, n, p=self.user_popularity)
+		edges = {}
+		for u1, u2 in zip(sources, targets):
+			key = ('user%d' % u1, 'user%d' % u2)
+			edges[key] = edges.get(key, 0) + 1
+		return edges
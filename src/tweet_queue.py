@@ -0,0 +1,158 @@
+__author__ = "Fernando Carrillo"
+__email__ = "fernando at carrillo.at"
+
+import os
+import json
+import random
+import threading
+import numpy as np
+from time import time
+from Queue import Queue, Full, Empty
+
+# Seconds between checks of the spill file while waiting for a tweet.
+SPILL_POLL = 0.05
+# Returned by _unspill if nothing is spilled (None is a valid item).
+NOTHING = object()
+
+class TweetQueue(object):
+	"""
+	Bounded queue between stream intake and classification workers.
+	What happens to new tweets when the queue is full depends on backpressure:
+
+	block       : put blocks until a worker took an item.
+	drop_oldest : the oldest queued tweet is dropped.
+	spill       : the tweet is appended to a spill file, which workers read
+	              once the in-memory queue is empty.
+	"""
+	POLICIES = ('block', 'drop_oldest', 'spill')
+
+	def __init__(self, maxsize=10000, backpressure='block', spill_path='data/stream_spill.jsonl'):
+		if backpressure not in self.POLICIES:
+			raise ValueError('backpressure must be one of %s' % (self.POLICIES, ))
+		self.queue = Queue(maxsize)
+		self.backpressure = backpressure
+		self.spill_path = spill_path
+		self.spill_lock = threading.Lock()
+		self.spill_out = None
+		self.spill_in = None
+		self.spill_pending = 0
+		self.dropped = 0
+		self.spilled = 0
+		self.max_depth = 0
+
+	def put(self, item, force_block=False):
+		"""
+		Adds item according to the backpressure policy.
+		force_block : boolean
+			Block regardless of the policy, e.g. for shutdown sentinels. While
+			tweets are spilled the item is spilled behind them instead.
+		"""
+		if self.backpressure == 'block' or (force_block and not self.spill_pending):
+			self.queue.put(item)
+		elif self.backpressure == 'drop_oldest':
+			while True:
+				try:
+					self.queue.put_nowait(item)
+					break
+				except Full:
+					try:
+						self.queue.get_nowait()
+						self.dropped += 1
+					except Empty:
+						pass
+		else:
+			try:
+				# Keep the order: once spilling started new tweets go to disk as well.
+				if self.spill_pending:
+					raise Full
+				self.queue.put_nowait(item)
+			except Full:
+				self._spill(item)
+		self.max_depth = max(self.max_depth, self.qsize())
+
+	def get(self, timeout=None):
+		"""
+		Returns the next item. Raises Queue.Empty after timeout seconds.
+		"""
+		deadline = None if timeout is None else time() + timeout
+		while True:
+			try:
+				if self.spill_pending:
+					return self.queue.get_nowait()
+				# Wait in short steps, so waiting workers notice once tweets are spilled.
+				wait = SPILL_POLL if deadline is None else min(SPILL_POLL, max(deadline - time(), 0))
+				return self.queue.get(timeout=wait)
+			except Empty:
+				# Another worker may have read the spilled item first.
+				item = self._unspill()
+				if item is not NOTHING:
+					return item
+				if deadline is not None and time() >= deadline:
+					raise
+
+	def qsize(self):
+		return self.queue.qsize() + self.spill_pending
+
+	def _spill(self, item):
+		with self.spill_lock:
+			if self.spill_out is None:
+				self.spill_out = open(self.spill_path, 'wb')
+				self.spill_in = open(self.spill_path, 'rb')
+			self.spill_out.write(json.dumps(item) + '\n')
+			self.spill_pending += 1
+			self.spilled += 1
+
+	def _unspill(self):
+		with self.spill_lock:
+			if not self.spill_pending:
+				return NOTHING
+			self.spill_out.flush()
+			item = json.loads(self.spill_in.readline())
+			self.spill_pending -= 1
+			if not self.spill_pending:
+				# Everything was read back. Start over with an empty file.
+				self.spill_out.close()
+				self.spill_in.close()
+				os.remove(self.spill_path)
+				self.spill_out = self.spill_in = None
+			return tuple(item) if item is not None else None
+
+class LatencyStats(object):
+	"""
+	Thread-safe running count, mean and maximum of latencies plus a fixed size
+	reservoir sample for percentiles.
+	"""
+	def __init__(self, sample_size=10000, seed=32):
+		self.sample_size = sample_size
+		self.rand = random.Random(seed)
+		self.sample = []
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+		self.lock = threading.Lock()
+
+	def add(self, latencies):
+		with self.lock:
+			for latency in latencies:
+				self.count += 1
+				self.total += latency
+				self.max = max(self.max, latency)
+				if len(self.sample) < self.sample_size:
+					self.sample.append(latency)
+				else:
+					i = self.rand.randint(0, self.count - 1)
+					if i < self.sample_size:
+						self.sample[i] = latency
+
+	def percentile(self, q):
+		with self.lock:
+			if not self.sample:
+				return 0.0
+			return float(np.percentile(self.sample, q))
+
+	def summary(self):
+		"""
+		Returns count, mean, p50, p95, p99 and max in seconds as dict.
+		"""
+		return {'count': self.count, 'mean': self.total / max(self.count, 1), 'p50': self.percentile(50),
+			'p95': self.percentile(95), 'p99': self.percentile(99), 'max': self.max}
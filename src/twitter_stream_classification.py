@@ -1,3 +1,4 @@
+import sys
 from message_classifier import MessageClassifier
 
 from sqlalchemy import create_engine
@@ -17,7 +18,7 @@ keywords = []
 # newsgroup data, but will be trained on a data-set of the domain of interest. 
 print('Load classifier.')
 mc = MessageClassifier()
-mc.load('../data/tweet_clf_nb')
+mc.load('../data/tweet_clf_nb', compact=True)
 print('Load classifier. Done.')
 
 # Create and connect to database
@@ -29,7 +30,7 @@ DBSession = sessionmaker(bind=engine)
 session = DBSession()
 
 # Load the StreamListener. This holds the classifier. 
-lister = TwitterStreamClassifier(db_session=session, classifier=mc, classes_of_interest=['sci.med'], probability_threshold=0.90)
+lister = TwitterStreamClassifier(db_session=session, classifier=mc, classes_of_interest=['sci.med'], probability_threshold=0.90, pipelined=True)
 
 # Get login from Twitter_auth module. 
 stream = Stream(Twitter_auth().authenticate(), lister)
@@ -43,4 +44,6 @@ try:
 except Exception, e:
 	print >> sys.stderr, e 
 	pass
+finally: 
+	lister.close()
 
@@ -6,23 +6,36 @@ import json
 import re
 import numpy as np
 import scipy as sp
+import calendar
+import threading
+from time import time
+from Queue import Empty
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker 
 from sqlalchemy.sql import exists
-from db_tables import Base, User, Connection, Message, Location, create_sqlite_db
+from db_tables import Base, User, Connection, Message, Location, create_sqlite_db, time_bucket
 
 from tweepy.streaming import StreamListener
 from tweepy import Stream
 
 from twitter_auth import Twitter_auth
 from message_classifier import MessageClassifier
+from bulk_writer import BulkWriter
+from tweet_queue import TweetQueue, LatencyStats
+from mentions import count_edges
+from bloom_filter import BloomFilter
+from parallel_scoring import ParallelScorer
+from json_parser import parse_created_at
+from decaying_graph import DecayingGraph
 
 class TwitterStreamClassifier(StreamListener):
  	"""
  	docstring for TwitterStreamClassifier
  	"""
- 	def __init__(self, db_session, classifier, classes_of_interest, batch_size=10000, probability_threshold=0, verbose=1):
+ 	def __init__(self, db_session, classifier, classes_of_interest, batch_size=10000, probability_threshold=0, verbose=1, 
+		pipelined=False, workers=1, queue_size=100000, backpressure='block', spill_path='data/stream_spill.jsonl', dedupe_capacity=1000000, 
+		scoring_processes=1, decay_half_life=None, decay_threshold=0.1, compact_after=None, max_wait=60):
  		"""
  		classifier : 
  			Classifier used for tweet classification 
@@ -33,16 +46,87 @@ class TwitterStreamClassifier(StreamListener):
  		batch_size : int 
  			Number of tweets to collect for batch classification. 
 
+		max_wait : float 
+			Classify a smaller batch once its oldest tweet waited max_wait seconds, 
+			so a slow stream is persisted regularly. No limit if None. 
+
+		pipelined : boolean 
+			on_data only enqueues tweets. Parsing, classification and persistence 
+			run in background worker threads, so the stream socket is always read. 
+			Call close() to drain the queue on shutdown. 
+
+		workers : int 
+			Number of background workers in pipelined mode. 
+
+		queue_size : int 
+			Maximal number of queued tweets in pipelined mode. 
+
+		backpressure : String 
+			Behaviour of a full queue: 'block', 'drop_oldest' or 'spill' (to spill_path). 
+
+		dedupe_capacity : int 
+			Tweet ids remembered by the Bloom filter which drops repeated tweets before 
+			classification (bounded memory, about 2.4 bytes per id). No filter if 0. 
+
+		scoring_processes : int 
+			Score every batch with a pool of this many classifier processes if > 1 
+			(see parallel_scoring.ParallelScorer). Export and load a compact model 
+			first, so the processes share one memory-mapped copy of it. 
+
+		decay_half_life : float 
+			Keep an in-memory graph of the mentions in self.graph whose weights halve 
+			every decay_half_life seconds (see decaying_graph.DecayingGraph). 
+
+		decay_threshold : float 
+			Edges of the in-memory graph with a lower decayed weight are evicted. 
+
+		compact_after : float 
+			Merge hourly connection buckets older than compact_after seconds into 
+			daily buckets in the database (see BulkWriter.compact_connections). 
  		"""
  		self.db_session = db_session
  		self.classifier = classifier
  		self.classes_of_interest = classes_of_interest
  		self.batch_size = batch_size
+		self.max_wait = max_wait
  		self.probability_threshold = probability_threshold
  		self.verbose = verbose
  		self.batch = [] 
+ 		self.writer = BulkWriter(db_session, verbose=verbose)
+		self.db_lock = threading.Lock()
+		# Arrival times of the batch and time from arrival until persisted. 
+		self.received = [] 
+		self.latency = LatencyStats()
+		self.seen = BloomFilter(capacity=dedupe_capacity) if dedupe_capacity > 0 else None
+		self.duplicates = 0
+		# Batches of the workers which could not be classified or persisted. 
+		self.failed_batches = 0
+		self.failed_tweets = 0
+		self.stats_lock = threading.Lock()
+		self.graph = DecayingGraph(half_life=decay_half_life, threshold=decay_threshold) if decay_half_life else None
+		self.compact_after = compact_after
+		self.compacted_before = None
+
+		# Start the scoring processes before any worker thread. 
+		self.scorer = None
+		if scoring_processes > 1: 
+			self.scorer = ParallelScorer(classifier, processes=scoring_processes)
+			self.classifier = self.scorer
+
+		self.pipelined = pipelined
+		self.workers = []
+		if pipelined: 
+			self.queue = TweetQueue(maxsize=queue_size, backpressure=backpressure, spill_path=spill_path)
+			for _ in range(workers): 
+				worker = threading.Thread(target=self.work)
+				worker.daemon = True
+				worker.start()
+				self.workers.append(worker)
 
  	def on_data(self, data):
+		if self.pipelined: 
+			self.queue.put((time(), data))
+			return True
  		if json.loads(data).keys()[0] != 'delete': 
 			self.add_to_batch(data)
 			if self.verbose > 0 and len(self.batch) % 100 == 0: 
@@ -51,9 +135,16 @@ class TwitterStreamClassifier(StreamListener):
 
 	def add_to_batch(self, data): 
 		self.batch.append(data)
-		if len(self.batch) >= self.batch_size: 
+		self.received.append(time())
+		if len(self.batch) >= self.batch_size or self.waited_too_long(self.received): 
 			self.classify()
 
+	def waited_too_long(self, received): 
+		"""
+		True if the oldest of the batch arrival times waited at least max_wait seconds. 
+		"""
+		return bool(received) and self.max_wait is not None and time() - received[0] >= self.max_wait
+
 	def add_user(self, user_name): 
 		"""
 		Adds a user to the database.
@@ -69,50 +160,156 @@ class TwitterStreamClassifier(StreamListener):
 		"""
 		Add message to MESSAGE relationship. 
 		"""
-		new_message = Message(user_name=user_name, text=text)
-		self.db_session.add(new_message)
-		self.db_session.commit()
+		self.writer.write(messages=[(user_name, text)])
 
-	def add_connection(self, user_name1, user_name2, weight): 
+	def add_connection(self, user_name1, user_name2, weight, timestamp=None): 
 		"""
 		Add connection between user 1 and user 2 in CONNECTION relationship. 
+		The weight is added to an already existing connection of the same time 
+		bucket as timestamp (unix seconds, default: now). 
 		"""
-		entry = self.db_session.query(Connection).filter((Connection.user_1_name == user_name1) & (Connection.user_2_name == user_name2)).scalar()
-		if not entry: 
-			new_connection = Connection(user_1_name=user_name1, user_2_name=user_name2, weight=weight )
-			self.db_session.add(new_connection)
-			self.db_session.commit()	
-		else: 
-			self.db_session.query(Connection).filter((Connection.user_1_name == user_name1) & (Connection.user_2_name == user_name2)).update({"weight": (entry.weight + weight)})
-			self.db_session.commit()
+		timestamp = time() if timestamp is None else timestamp
+		if self.graph is not None: 
+			self.graph.add({(user_name1, user_name2): weight}, timestamp)
+		self.writer.write(connections={(user_name1, user_name2, time_bucket(timestamp)): weight})
 
 	def add_location(self, user_name, geojson, location): 
 		"""
 		Add message to LOCATION relationship. 
 		"""
-		if (geojson == "nan"): geojson = "NULL"
-		if (location == "nan"): location = "NULL"
-		new_location = Location(user_name=user_name, geojson=geojson, location=location)
-		self.db_session.add(new_location)
-		self.db_session.commit()
+		self.writer.write(locations=[(user_name, geojson, location)])
+
+	def work(self): 
+		"""
+		Background worker of the pipelined mode. Collects batches from the queue 
+		until it receives the None sentinel of close(). A batch is classified when 
+		it is full or its oldest tweet waited max_wait seconds. 
+		"""
+		batch = [] 
+		received = [] 
+		while True: 
+			# Wait no longer than until the oldest tweet of the batch is due. 
+			timeout = None if not received or self.max_wait is None else max(received[0] + self.max_wait - time(), 0)
+			try: 
+				item = self.queue.get(timeout=timeout)
+			except Empty: 
+				item = ()
+			except Exception, e: 
+				print >> sys.stderr, e 
+				continue
+			if item: 
+				received.append(item[0])
+				batch.append(item[1])
+			if batch and (item is None or len(batch) >= self.batch_size or self.waited_too_long(received)): 
+				try: 
+					self.classify_batch(batch)
+					now = time()
+					self.latency.add([now - t for t in received])
+				except Exception, e: 
+					print >> sys.stderr, e 
+					with self.stats_lock: 
+						self.failed_batches += 1
+						self.failed_tweets += len(batch)
+				batch = [] 
+				received = [] 
+			if item is None: 
+				return
+
+	def close(self): 
+		"""
+		Classifies all remaining tweets. In pipelined mode the queue is drained 
+		and the workers are stopped, tweets of failed batches are reported. 
+		Scoring processes are shut down. 
+		"""
+		if self.pipelined: 
+			# The sentinels queue up behind the remaining tweets. 
+			for _ in self.workers: 
+				self.queue.put(None, force_block=True)
+			for worker in self.workers: 
+				worker.join()
+			self.workers = [] 
+			if self.failed_batches: 
+				print >> sys.stderr, 'Lost %d tweets in %d failed batches.' % (self.failed_tweets, self.failed_batches)
+		elif self.batch: 
+			self.classify()
+		if self.scorer is not None: 
+			self.scorer.close()
+			self.scorer = None
+			self.classifier = self.classifier.classifier
 
 	def classify(self): 
-		json_entries = [json.loads(x) for x in self.batch]
+		"""
+		Classifies the batch and deletes it from the buffer. 
+		"""
+		self.classify_batch(self.batch)
+		now = time()
+		self.latency.add([now - t for t in self.received])
+		# Delete entries from the buffer. 
+		self.batch = [] 
+		self.received = [] 
+
+	def classify_batch(self, batch): 
+		"""
+		Classifies raw tweets and persists tweets of interest in a single transaction. 
+		Users are deduplicated and connection weights aggregated in memory first. 
+		"""
+		json_entries = [x for x in (json.loads(x) for x in batch) if 'delete' not in x]
+		if self.seen is not None and json_entries: 
+			# Drop tweets which were already received. 
+			seen = self.seen.add([x['id'] for x in json_entries])
+			self.duplicates += int(seen.sum())
+			json_entries = [x for x, duplicate in zip(json_entries, seen) if not duplicate]
+		if not json_entries: 
+			return
 		messages = [x['text'] for x in json_entries]
 		probabilities = self.classifier.predict_proba(messages)
 		
+		users = set()
+		new_messages = []
+		new_locations = []
+		selected = []
+		times = []
+		now = time()
 		for message, probs, tweet in zip(messages, probabilities, json_entries): 
 			if self.classifier.labels[np.argmax(probs)] in self.classes_of_interest and np.max(probs) > self.probability_threshold: 
 				u1 = tweet['user']['screen_name']
-				self.add_user(u1)
-				self.add_message(u1, message)
+				users.add(u1)
+				created_at = parse_created_at(tweet.get('created_at'))
+				new_messages.append((u1, message, tweet['id'], created_at))
 				geostring = str(tweet['coordinates'])
 				if (geostring == 'None'): geostring = 'NULL'
-				self.add_location(u1, geostring, tweet['user']['location'])
-				for u2 in re.findall('\B\@\w+', str(tweet)): 
-					self.add_connection(user_name1=u1, user_name2=u2.strip('\@'), weight=1)
-		# Delete entries from the buffer. 
-		self.batch = [] 
+				new_locations.append((u1, geostring, tweet['user']['location']))
+				selected.append(tweet)
+				times.append(calendar.timegm(created_at.utctimetuple()) if created_at else now)
+		connections = self.count_connections(selected, times)
+		with self.db_lock: 
+			self.writer.write(users=users, messages=new_messages, locations=new_locations, connections=connections)
+			if self.compact_after and times: 
+				# Compact whole days, once per day, only the days since the last run. 
+				before = time_bucket(max(times) - self.compact_after) // 24 * 24
+				if self.compacted_before is None or before > self.compacted_before: 
+					self.writer.compact_connections(before, span=24, after=self.compacted_before or 0)
+					self.compacted_before = before
+
+	def count_connections(self, tweets, times): 
+		"""
+		Counts the mention edges of tweets per time bucket and adds them to the 
+		decaying graph at the minute of the tweets. 
+		Returns {(user_name1, user_name2, bucket): weight}. 
+		"""
+		minutes = {}
+		for tweet, t in zip(tweets, times): 
+			minutes.setdefault(int(t // 60), []).append(tweet)
+		connections = {}
+		for minute, group in minutes.items(): 
+			edges = count_edges(group, text_fallback=True)
+			if self.graph is not None: 
+				self.graph.add(edges, minute * 60)
+			bucket = time_bucket(minute * 60)
+			for (u1, u2), weight in edges.items(): 
+				key = (u1, u2, bucket)
+				connections[key] = connections.get(key, 0) + weight
+		return connections
 
 	def on_error(self, status):
 		print status 
@@ -152,5 +349,7 @@ if __name__ == '__main__':
 	except Exception, e:
 		print >> sys.stderr, e 
 		pass
+	finally: 
+		lister.close()
 	
 	
\ No newline at end of file
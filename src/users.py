@@ -1,16 +1,22 @@
 __author__ = "Fernando Carrillo"
 __email__ = "fernando at carrillo.at"
 
+import sys
 import tweepy 
 import json 
 import abc 
 import re 
 import pandas as pd
+from collections import Counter
 import numpy as np
 
 from twitter_auth import Twitter_auth
 from nltk.tokenize import TweetTokenizer
-from json_parser import ParseJSON
+from json_parser import ParseJSON, parse_created_at
+from mentions import count_mentions, user_ids
+
+# Maximal number of user ids per lookup_users call. 
+LOOKUP_SIZE = 100
 
 class User_base(object): 
 
@@ -61,21 +67,83 @@ class Twitter_user(User_base):
 	"""
 	Generates a twitter user instance
 	"""
-	def __init__(self, user_name, twitter_auth):
+	def __init__(self, user_name, twitter_auth, api=None, cache=None, id_cache=None):
+		"""
+		api : tweepy.API 
+			Optional API object, e.g. a RateLimitedAPI or a FakeTwitterAPI. 
+			Created from twitter_auth on load if None. 
+
+		cache : ResponseCache 
+			Optional on-disk cache of timelines and follower ids. 
+
+		id_cache : UserIdCache 
+			Optional persistent cache of user id to screen name resolutions. 
+		"""
 		super(Twitter_user, self).__init__(user_name)
 		self.auth = twitter_auth
+		self.api = api
+		self.cache = cache
+		self.id_cache = id_cache
+		self.resolved_ids = {}
 
 	def load(self, tweet_count=100):
-		self.api = tweepy.API(self.auth)
+		"""
+		Loads the last tweet_count tweets. With a cache, fresh cached timelines are 
+		used as they are and stale ones are only completed by the tweets newer 
+		than the newest cached tweet. 
+		"""
+		if self.api is None: 
+			self.api = tweepy.API(self.auth)
+		self.resolved_ids = {}
+		cached = None
+		if self.cache is not None: 
+			cached = self.cache.get('user_timeline', self.user_name)
+			if cached is not None and cached.value['count'] < tweet_count: 
+				cached = None # Cached timeline is too short. 
+			if cached is not None and cached.fresh: 
+				self.tweets = cached.value['tweets'][:tweet_count]
+				return
+
+		since_id = cached.since_id if cached is not None else None
 		try:
-			t = self.api.user_timeline(screen_name = self.user_name, count = tweet_count)
+			t = self.api.user_timeline(screen_name = self.user_name, count = tweet_count, since_id = since_id)
 		except Exception, e:
-			t = [] 
+			if cached is not None: # Stale data is better than none. 
+				self.tweets = cached.value['tweets'][:tweet_count]
+			else: 
+				self.tweets = [] 
+			return # Failed requests are not cached. 
 		
 		tweets = [] 
 		for tweet in t: 
 			tweets.append(dict(tweet._json))
+		if cached is not None: 
+			tweets = (tweets + cached.value['tweets'])[:tweet_count]
 		self.tweets = tweets
+
+		if self.cache is not None: 
+			newest = max([tweet['id'] for tweet in tweets]) if tweets else since_id
+			self.cache.put('user_timeline', self.user_name, {'count': tweet_count, 'tweets': tweets}, since_id=newest)
+
+	def get_follower_ids(self, max_from_followers): 
+		"""
+		Returns up to max_from_followers follower ids, from the cache if possible. 
+		"""
+		if self.cache is not None: 
+			cached = self.cache.get('followers_ids', self.user_name)
+			if cached is not None and cached.fresh and (cached.value['complete'] or len(cached.value['ids']) >= max_from_followers): 
+				return cached.value['ids'][:max_from_followers]
+
+		followers = [] 
+		complete = True
+		for page in tweepy.Cursor(self.api.followers_ids, screen_name=self.user_name).pages(): # Get all follower ids. 
+			followers.extend(page)
+			if (len(followers) >= max_from_followers):
+				complete = False
+				break
+		if self.cache is not None: 
+			self.cache.put('followers_ids', self.user_name, {'complete': complete, 'ids': followers})
+		return followers[:max_from_followers]
 	
 	def dump(self, file_name): 
 		with open(file_name, 'w') as outfile: 
@@ -87,28 +155,55 @@ class Twitter_user(User_base):
 		"""
 		Get screen_names of users mentioned in the tweets and of followers. 
 		Be careful the from_followers is really expensive.
+		Returns a Counter {screen_name: weight}, use most_common() for the top nodes. 
 		"""
-		nodes = [] 
-		# Retrieve usernames from tweet texts
+		nodes = Counter() 
+		# Retrieve usernames mentioned in the tweets
 		if (from_tweets): 
-			for tweet in self.tweets: 
-				nodes = nodes + re.findall('\B\@\w+', str(tweet))
+			nodes = count_mentions(self.tweets, text_fallback=True)
 
 		# Retrive usernames from followers.
 		if (max_from_followers > 0): 
-			followers = [] 
-			for page in tweepy.Cursor(self.api.followers_ids, screen_name=self.user_name).pages(): # Get all follower ids. 
-				followers.extend(page)
-				if (len(followers) >= max_from_followers):
-					break
+			followers = self.get_follower_ids(max_from_followers)
 			
-			if (user_id_to_screen_name): # Do not convert user ids into screen names, too expensive in API terms. Just add the user_ids. 
+			if (user_id_to_screen_name): # Converts up to 100 user ids per API call. 
+				names = self.resolve_screen_names(followers)
 				for user_id in followers: 
-					nodes.extend("@" + self.api.get_user(user_id).screen_name)
+					if user_id in names: 
+						nodes[names[user_id]] += 1
 			else:
-				nodes.extend(followers)	
+				nodes.update(followers)	
+
+		return nodes
 
-		return pd.Series(nodes).value_counts(sort=True)
+	def resolve_screen_names(self, user_ids): 
+		"""
+		Returns {user_id: screen_name}. Ids missing in the id cache are looked up 
+		in batches of LOOKUP_SIZE per API call. Unknown (e.g. suspended) users are left out. 
+		"""
+		user_ids = list(set(user_ids))
+		names = self.id_cache.get_names(user_ids) if self.id_cache is not None else {}
+		missing = [user_id for user_id in user_ids if user_id not in names]
+		for i in range(0, len(missing), LOOKUP_SIZE): 
+			try:
+				users = self.api.lookup_users(user_ids=missing[i:i + LOOKUP_SIZE])
+			except Exception, e:
+				print >> sys.stderr, e
+				continue
+			found = dict((user.id, user.screen_name) for user in users)
+			if self.id_cache is not None: 
+				self.id_cache.put(found)
+			names.update(found)
+		self.resolved_ids.update((name, user_id) for user_id, name in names.items())
+		return names
+
+	def get_user_ids(self): 
+		"""
+		Returns {screen_name: twitter user id} of all users seen in the tweets or resolved from followers. 
+		"""
+		ids = user_ids(self.tweets)
+		ids.update(self.resolved_ids)
+		return ids
 
 	def get_locations(self): 
 		"""
@@ -132,6 +227,12 @@ class Twitter_user(User_base):
 		"""
 		return(self.get_field_values("text"))
 
+	def get_message_records(self): 
+		"""
+		Returns the messages as list of (text, tweet_id, created_at). 
+		"""
+		return [(tweet['text'], tweet.get('id'), parse_created_at(tweet.get('created_at'))) for tweet in self.tweets]
+
 	def get_field_values(self, key): 
 		"""
 		Retrieve data of specific field